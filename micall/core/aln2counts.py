@@ -70,7 +70,7 @@ def parse_args():
     return parser.parse_args()
 
 
-logger = miseq_logging.init_logging_console_only(logging.DEBUG)
+logger = logging.getLogger(__name__)
 
 MAX_CUTOFF = 'MAX'
 
@@ -1095,6 +1095,7 @@ def aln2counts(aligned_csv,
 
 
 def main():
+    miseq_logging.init_logging_console_only(logging.DEBUG)
     args = parse_args()
     aln2counts(args.aligned_csv,
                args.nuc_csv,
@@ -2,25 +2,53 @@
 
 import os
 import argparse
-from collections import Counter
-from csv import DictReader, DictWriter
 import errno
-import itertools
-from operator import itemgetter
+import hashlib
+import logging
+from itertools import starmap
 import tarfile
+from time import perf_counter
 
-from matplotlib.ticker import FuncFormatter
-
-from micall.core import project_config, aln2counts
-
-# NOTE: this must be performed BEFORE pyplot is imported
-# http://stackoverflow.com/a/3054314/4794
-import matplotlib
-matplotlib.use('Agg')
-from matplotlib import pyplot as plt, patches  # noqa
+from micall.core.coverage_scores import create_score_writer, \
+    iter_coverage_scores, get_counts, get_key_positions
 
 MAX_COVERAGE = 1000000
 FONT_SIZE = 8
+FIGURE_SIZE = (4, 3)
+# file types that can store the map's hash in their metadata
+HASHED_FILETYPES = ('png', 'svg')
+
+logger = logging.getLogger(__name__)
+
+# figures that were already created in this process: {figure size: (fig, ax)}
+loaded_figures = {}
+
+
+def get_pyplot():
+    """ Import pyplot on first use, because it's slow to import. """
+    # NOTE: this must be performed BEFORE pyplot is imported
+    # http://stackoverflow.com/a/3054314/4794
+    import matplotlib
+    matplotlib.use('Agg')
+    from matplotlib import pyplot as plt  # noqa
+    return plt
+
+
+def get_figure(figsize=FIGURE_SIZE):
+    """ Create a figure once per process, and make it the current figure.
+
+    Each map clears the axis when it's finished, so the next map can reuse
+    the figure.
+    :return: (fig, ax)
+    """
+    plt = get_pyplot()
+    figure = loaded_figures.get(figsize)
+    if figure is None or not plt.fignum_exists(figure[0].number):
+        # noinspection PyTypeChecker
+        figure = loaded_figures[figsize] = plt.subplots(figsize=figsize,
+                                                        dpi=100)
+    plt.figure(figure[0].number)
+    return figure
 
 
 def coverage_plot(amino_csv,
@@ -28,11 +56,14 @@ def coverage_plot(amino_csv,
                   coverage_maps_path=None,
                   coverage_maps_prefix=None,
                   filetype='png',
-                  excluded_projects=None):
+                  excluded_projects=None,
+                  pool=None,
+                  skip_unchanged=False):
     """ Generate coverage plots.
 
     @param amino_csv: an open file object that holds amino acid frequencies
-    @param coverage_scores_csv: an open file object to write the coverage scores
+    @param coverage_scores_csv: an open file object to write the coverage
+    scores, or None if coverage_scores.coverage_scores() already wrote them.
     @param coverage_maps_path: path for coverage maps. Defaults to the path
     of amino_csv.
     @param coverage_maps_prefix: file name prefix for coverage maps. Full name
@@ -41,184 +72,225 @@ def coverage_plot(amino_csv,
     @param filetype: controls which file type will be saved, must be supported
     by matplotlib (probably png, pdf, ps, eps and svg).
     @param excluded_projects: a list of project names to exclude
+    @param pool: a multiprocessing pool to draw the maps in parallel, or None
+    to draw them in this process.
+    @param skip_unchanged: True if maps should be left alone when they were
+    drawn from the same counts before.
     @return: a list of full paths to the image files.
     """
-    # imports project information from JSON
+    map_jobs = build_map_jobs(amino_csv,
+                              coverage_scores_csv,
+                              coverage_maps_path,
+                              coverage_maps_prefix,
+                              filetype,
+                              excluded_projects)
+    return draw_all_coverage_maps(map_jobs, pool, skip_unchanged)
+
+
+def build_map_jobs(amino_csv,
+                   coverage_scores_csv,
+                   coverage_maps_path=None,
+                   coverage_maps_prefix=None,
+                   filetype='png',
+                   excluded_projects=None):
+    """ Collect the counts for each coverage map, and write coverage scores.
+
+    Jobs from several samples can be drawn together by
+    draw_all_coverage_maps(). See coverage_plot() for the parameters.
+    :return: a list of map jobs for draw_coverage_maps()
+    """
     if coverage_maps_path is None:
         coverage_maps_path, _ = os.path.split(amino_csv.name)
-    projects = project_config.ProjectConfig.loadScoring()
-    reader = DictReader(amino_csv)
-    writer = DictWriter(coverage_scores_csv,
-                        ['project',
-                         'region',
-                         'seed',
-                         'q.cut',
-                         'min.coverage',
-                         'which.key.pos',
-                         'off.score',
-                         'on.score'],
-                        lineterminator=os.linesep)
-    writer.writeheader()
+    if coverage_scores_csv is None:
+        writer = None
+    else:
+        writer = create_score_writer(coverage_scores_csv)
+    map_jobs = []
+    for score_row, project_region, counts in iter_coverage_scores(
+            amino_csv,
+            excluded_projects):
+        figname_parts = [project_region['project_name'],
+                         score_row['region'],
+                         filetype]
+        if coverage_maps_prefix:
+            figname_parts.insert(0, coverage_maps_prefix)
+        map_jobs.append(build_map_job(coverage_maps_path,
+                                      figname_parts,
+                                      project_region,
+                                      counts))
+        if writer is not None:
+            writer.writerow(score_row)
+    return map_jobs
+
+
+def build_map_job(coverage_maps_path, figname_parts, project_region, counts):
+    """ Collect everything needed to draw one project region's maps.
+
+    :param str coverage_maps_path: the folder to write the files in
+    :param list figname_parts: will be joined together with dots to make the
+        file name
+    :param project_region: a project region dictionary from ProjectConfig
+    :param counts: count arrays from coverage_scores.read_coverage_counts()
+    :return: a dictionary that can be sent to another process
+    """
+    region_length = project_region['coordinate_region_length']
+    key_positions = get_key_positions(project_region)
+    region_counts = {name: get_counts(name_counts, 1, region_length)
+                     for name, name_counts in counts.items()}
+    map_hash = hashlib.sha1(repr((figname_parts,
+                                  region_length,
+                                  key_positions)).encode('utf8'))
+    for name in sorted(region_counts):
+        map_hash.update(name.encode('utf8'))
+        map_hash.update(region_counts[name].tobytes())
+    return dict(coverage_maps_path=coverage_maps_path,
+                figname_parts=figname_parts,
+                region_length=region_length,
+                key_positions=key_positions,
+                counts=region_counts,
+                map_hash=map_hash.hexdigest())
+
+
+def draw_all_coverage_maps(map_jobs, pool=None, skip_unchanged=False):
+    """ Draw coverage maps, possibly for several samples.
+
+    :param map_jobs: a list of jobs from build_map_jobs()
+    :param pool: a multiprocessing pool to draw the maps in parallel, or None
+        to draw them in this process
+    :param skip_unchanged: True if maps should be left alone when they were
+        drawn from the same counts before
+    :return: a list of full paths to the image files
+    """
+    args = [(map_job, skip_unchanged) for map_job in map_jobs]
+    if pool is None:
+        results = starmap(draw_coverage_maps, args)
+    else:
+        results = pool.starmap(draw_coverage_maps, args)
     paths = []
+    for map_paths in results:
+        paths.extend(map_paths)
+    return paths  # locations of image files
+
+
+def draw_coverage_maps(map_job, skip_unchanged=False):
+    """ Draw the coverage map and the details map for one project region.
 
+    This is a top-level function so it can run in a process pool.
+    :param map_job: a dictionary from build_map_job()
+    :param skip_unchanged: True if the maps should be left alone when they
+        were drawn from the same counts before
+    :return: a list of full paths to the image files
+    """
+    start_time = perf_counter()
+    coverage_maps_path = map_job['coverage_maps_path']
+    figname_parts = list(map_job['figname_parts'])
+    details_parts = figname_parts[:-1] + ['details', figname_parts[-1]]
+    map_hash = map_job['map_hash']
+    if skip_unchanged and all(
+            is_map_current(os.path.join(coverage_maps_path, '.'.join(parts)),
+                           map_hash)
+            for parts in (figname_parts, details_parts)):
+        logger.debug('Skipped unchanged coverage map %s.',
+                     '.'.join(figname_parts))
+        return [os.path.join(coverage_maps_path, '.'.join(parts))
+                for parts in (figname_parts, details_parts)]
+    if figname_parts[-1] in HASHED_FILETYPES:
+        metadata = {'Description': map_hash}
+    else:
+        metadata = None
+
+    plt = get_pyplot()
+    from matplotlib import patches
+    from matplotlib.ticker import FuncFormatter
+    fig, ax = get_figure()
     axis_formatter = FuncFormatter(lambda y, p: format(int(y), ','))
-    # noinspection PyTypeChecker
-    fig, ax = plt.subplots(figsize=(4, 3), dpi=100)
-    for (seed, region), group in itertools.groupby(reader, itemgetter('seed',
-                                                                      'region')):
-        coverage_counts = Counter()
-        stop_counts = Counter()
-        low_quality_counts = Counter()
-        deletion_counts = Counter()
-        partial_counts = Counter()
-        insertion_counts = Counter()
-        clipping_counts = Counter()
-        v3_overlap_counts = Counter()
-        qcut = None
-        for row in group:
-            pos = int(row['refseq.aa.pos'])
-            deletion_count = int(row['del'])
-            total = sum([int(row[aa]) for aa in aln2counts.AMINO_ALPHABET])
-            total += deletion_count
-            coverage_counts[pos] = total
-            stop_counts[pos] = int(row['*'])
-            low_quality_counts[pos] = int(row['X'])
-            deletion_counts[pos] = deletion_count
-            partial_counts[pos] = int(row['partial'])
-            insertion_counts[pos] = int(row['ins'])
-            clipping_counts[pos] = int(row['clip'])
-            v3_overlap_counts[pos] = int(row['v3_overlap'])
-            qcut = row['q-cutoff']
-        # use region to retrieve coordinate reference
-        for project_region in projects.getProjectRegions(
-                seed,
-                region,
-                excluded_projects=excluded_projects):
-            min_coverage = None
-            min_coverage_pos = None
-            project_name = project_region['project_name']
-            region_length = project_region['coordinate_region_length']
-            x = range(1, region_length+1)
-            y_coverage = [coverage_counts[pos] for pos in x]
-            y_stops = [stop_counts[pos] for pos in x]
-            y_low_quality = [low_quality_counts[pos] for pos in x]
-            y_deletions = [deletion_counts[pos] for pos in x]
-            y_partials = [partial_counts[pos] for pos in x]
-            y_insertions = [insertion_counts[pos] for pos in x]
-            y_clipping = [clipping_counts[pos] for pos in x]
-            y_v3_overlap = [v3_overlap_counts[pos] for pos in x]
-
-            key_positions = project_region['key_positions']
-            if not key_positions:
-                key_positions.append(dict(start_pos=1,
-                                          end_pos=region_length))
-            for key_pos in key_positions:
-                start = key_pos['start_pos']
-                end = key_pos['end_pos']
-                if end is None:
-                    end = start
-                for pos in range(start, end+1):
-                    count = coverage_counts[pos]
-                    if min_coverage is None or count < min_coverage:
-                        min_coverage = count
-                        min_coverage_pos = pos
-                start -= 0.5
-                end += 0.5
-                ax.add_patch(patches.Rectangle(xy=(start, 50),
-                                               width=end-start,
-                                               height=150,
-                                               fc='black',
-                                               ec='grey',
-                                               zorder=50,
-                                               alpha=.5))
-            if min_coverage <= project_region['min_coverage1']:
-                coverage_score_on = 1
-            elif min_coverage <= project_region['min_coverage2']:
-                coverage_score_on = 2
-            elif min_coverage <= project_region['min_coverage3']:
-                coverage_score_on = 3
-            else:
-                coverage_score_on = 4
-            max_coverage = max(y_coverage)
-            if max_coverage == 0:
-                coverage_score_off = 0
-            elif max_coverage <= 10:
-                coverage_score_off = -1
-            elif max_coverage <= 100:
-                coverage_score_off = -2
-            else:
-                coverage_score_off = -3
-            plt.step(x, y_coverage, linewidth=2, where='mid', label='coverage', zorder=100)
-            left_margin = -region_length / 25.0
-            plt.xlim([left_margin, region_length])
-            plt.ylim([0.5, MAX_COVERAGE])
-            plt.yscale('log')
-            ax.yaxis.set_major_formatter(axis_formatter)
-            plt.tick_params(axis='both', labelsize=FONT_SIZE)
-            ax.add_patch(patches.Rectangle(xy=(left_margin*0.5, 0),
-                                           width=-left_margin*0.4,
-                                           height=10,
-                                           fc='black',
-                                           ec='black'))
-            ax.add_patch(patches.Rectangle(xy=(left_margin*0.5, 10),
-                                           width=-left_margin*0.4,
-                                           height=40,
-                                           fc='red',
-                                           ec='red'))
-            ax.add_patch(patches.Rectangle(xy=(left_margin*0.5, 50),
-                                           width=-left_margin*0.4,
-                                           height=50,
-                                           fc='yellow',
-                                           ec='yellow'))
-            ax.add_patch(patches.Rectangle(xy=(left_margin*0.5, 100),
-                                           width=-left_margin*0.4,
-                                           height=MAX_COVERAGE-100,
-                                           fc='lightgreen',
-                                           ec='lightgreen'))
-            plt.plot((1, region_length), (100, 100), 'k--', zorder=51)
-            plt.xlabel('Reference coordinates (AA)', fontsize=9)
-            plt.ylabel('Read count', fontsize=9)
-            plt.tight_layout()
-            figname_parts = [project_name, region, filetype]
-            if coverage_maps_prefix:
-                figname_parts.insert(0, coverage_maps_prefix)
-            paths.append(save_figure(coverage_maps_path, figname_parts))
-            plt.step(x, y_deletions, where='mid', label='deletions', zorder=99)
-            plt.step(x, y_stops, where='mid', label='stop codons', zorder=98)
-            plt.step(x, y_partials, where='mid', label='partial dels', zorder=97)
-            plt.step(x, y_clipping, where='mid', label='soft clipped', zorder=96)
-            plt.step(x, y_insertions, where='mid', label='insertions', zorder=95)
-            plt.step(x, y_low_quality, where='mid', label='low quality', zorder=94)
-            plt.step(x, y_v3_overlap, where='mid', label='V3 overlap', zorder=93)
-            plt.legend(loc='best', fontsize=FONT_SIZE, fancybox=True, ncol=2)
-            figname_parts.insert(-1, 'details')
-            paths.append(save_figure(coverage_maps_path, figname_parts))
-            plt.cla()  # clear the axis, but don't remove the axis itself.
-            row = {'project': project_name,
-                   'region': region,
-                   'seed': seed,
-                   'q.cut': qcut,
-                   'min.coverage': min_coverage,
-                   'which.key.pos': min_coverage_pos,
-                   'off.score': coverage_score_off,
-                   'on.score': coverage_score_on}
-            writer.writerow(row)
-
-    plt.close(fig)
-    return paths  # locations of image files
+    paths = []
+    region_length = map_job['region_length']
+    y = map_job['counts']
+    x = range(1, region_length+1)
+
+    for start, end in map_job['key_positions']:
+        start -= 0.5
+        end += 0.5
+        ax.add_patch(patches.Rectangle(xy=(start, 50),
+                                       width=end-start,
+                                       height=150,
+                                       fc='black',
+                                       ec='grey',
+                                       zorder=50,
+                                       alpha=.5))
+    plt.step(x, y['coverage'], linewidth=2, where='mid', label='coverage', zorder=100)
+    left_margin = -region_length / 25.0
+    plt.xlim([left_margin, region_length])
+    plt.ylim([0.5, MAX_COVERAGE])
+    plt.yscale('log')
+    ax.yaxis.set_major_formatter(axis_formatter)
+    plt.tick_params(axis='both', labelsize=FONT_SIZE)
+    ax.add_patch(patches.Rectangle(xy=(left_margin*0.5, 0),
+                                   width=-left_margin*0.4,
+                                   height=10,
+                                   fc='black',
+                                   ec='black'))
+    ax.add_patch(patches.Rectangle(xy=(left_margin*0.5, 10),
+                                   width=-left_margin*0.4,
+                                   height=40,
+                                   fc='red',
+                                   ec='red'))
+    ax.add_patch(patches.Rectangle(xy=(left_margin*0.5, 50),
+                                   width=-left_margin*0.4,
+                                   height=50,
+                                   fc='yellow',
+                                   ec='yellow'))
+    ax.add_patch(patches.Rectangle(xy=(left_margin*0.5, 100),
+                                   width=-left_margin*0.4,
+                                   height=MAX_COVERAGE-100,
+                                   fc='lightgreen',
+                                   ec='lightgreen'))
+    plt.plot((1, region_length), (100, 100), 'k--', zorder=51)
+    plt.xlabel('Reference coordinates (AA)', fontsize=9)
+    plt.ylabel('Read count', fontsize=9)
+    plt.tight_layout()
+    paths.append(save_figure(coverage_maps_path, figname_parts, metadata))
+    plt.step(x, y['deletions'], where='mid', label='deletions', zorder=99)
+    plt.step(x, y['stops'], where='mid', label='stop codons', zorder=98)
+    plt.step(x, y['partials'], where='mid', label='partial dels', zorder=97)
+    plt.step(x, y['clipping'], where='mid', label='soft clipped', zorder=96)
+    plt.step(x, y['insertions'], where='mid', label='insertions', zorder=95)
+    plt.step(x, y['low_quality'], where='mid', label='low quality', zorder=94)
+    plt.step(x, y['v3_overlap'], where='mid', label='V3 overlap', zorder=93)
+    plt.legend(loc='best', fontsize=FONT_SIZE, fancybox=True, ncol=2)
+    paths.append(save_figure(coverage_maps_path, details_parts, metadata))
+    plt.cla()  # clear the axis, but don't remove the axis itself.
+    logger.debug('Drew coverage map %s in %0.2fs.',
+                 '.'.join(figname_parts),
+                 perf_counter() - start_time)
+    return paths
+
+
+def is_map_current(path, map_hash):
+    """ Check if a map file was drawn from counts with the same hash. """
+    try:
+        with open(path, 'rb') as map_file:
+            return map_hash.encode('ascii') in map_file.read()
+    except FileNotFoundError:
+        return False
 
 
-def save_figure(coverage_maps_path, figname_parts):
+def save_figure(coverage_maps_path, figname_parts, metadata=None):
     """ Write the current figure to a file.
 
     :param str coverage_maps_path: the folder to write the file in
     :param list figname_parts: will be joined together with dots to make the
         file name
+    :param dict metadata: extra information to store in the file, or None
     :return: the file name it was written to
     """
     figname = '.'.join(figname_parts)
     dest = os.path.join(coverage_maps_path, figname)
-    plt.savefig(dest)  # write image to file
+    if metadata is None:
+        get_pyplot().savefig(dest)  # write image to file
+    else:
+        get_pyplot().savefig(dest, metadata=metadata)
     return dest
 
 
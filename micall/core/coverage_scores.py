@@ -0,0 +1,221 @@
+#!/usr/bin/env python3.4
+""" Calculate coverage scores from amino counts, without drawing any maps.
+
+The counts are loaded into NumPy arrays, so this is quick enough to run
+before the resistance calls or the QAI upload, and coverage_plots can draw
+the maps from the same arrays later.
+"""
+import argparse
+from csv import DictReader, DictWriter
+import itertools
+from operator import itemgetter
+import os
+
+import numpy as np
+
+from micall.core import project_config
+from micall.core.aln2counts import AMINO_ALPHABET
+
+SCORE_COLUMNS = ['project',
+                 'region',
+                 'seed',
+                 'q.cut',
+                 'min.coverage',
+                 'which.key.pos',
+                 'off.score',
+                 'on.score']
+
+# amino.csv columns that add up to coverage.
+COVERAGE_COLUMNS = list(AMINO_ALPHABET) + ['del']
+# amino.csv columns that get read, starting with the coverage columns.
+READ_COLUMNS = COVERAGE_COLUMNS + ['X',
+                                   'partial',
+                                   'ins',
+                                   'clip',
+                                   'v3_overlap']
+# (count name, amino.csv column) for the counts that aren't coverage.
+DETAIL_COLUMNS = [('deletions', 'del'),
+                  ('stops', '*'),
+                  ('partials', 'partial'),
+                  ('clipping', 'clip'),
+                  ('insertions', 'ins'),
+                  ('low_quality', 'X'),
+                  ('v3_overlap', 'v3_overlap')]
+
+
+def read_coverage_counts(amino_csv):
+    """ Load the counts for each seed and region from amino.csv.
+
+    :param amino_csv: an open file object that holds amino acid frequencies
+    :return: a generator of (seed, region, qcut, counts), where counts is a
+        dictionary of arrays, indexed by reference position. Index 0 is
+        always zero. The keys are 'coverage' and the names in DETAIL_COLUMNS.
+    """
+    reader = DictReader(amino_csv)
+    for (seed, region), group in itertools.groupby(reader, itemgetter('seed',
+                                                                      'region')):
+        rows = list(group)
+        yield seed, region, rows[-1]['q-cutoff'], build_coverage_counts(rows)
+
+
+def build_coverage_counts(rows):
+    """ Build count arrays from one region's amino.csv rows.
+
+    :param rows: dictionaries with the columns of amino.csv
+    :return: a dictionary of arrays, indexed by reference position
+    """
+    positions = np.array(list(map(itemgetter('refseq.aa.pos'), rows)),
+                         dtype=np.int64)
+    row_counts = np.array(list(map(itemgetter(*READ_COLUMNS), rows)),
+                          dtype=np.int64)
+    size = positions.max() + 1 if len(rows) else 1
+    column_counts = np.zeros((size, len(READ_COLUMNS)), dtype=np.int64)
+    column_counts[positions] = row_counts  # later rows win, like a dict
+    counts = {'coverage': column_counts[:, :len(COVERAGE_COLUMNS)].sum(axis=1)}
+    for name, column in DETAIL_COLUMNS:
+        counts[name] = column_counts[:, READ_COLUMNS.index(column)]
+    return counts
+
+
+def get_counts(counts, start, end):
+    """ Get counts for a range of positions, with zeros past the end.
+
+    :param counts: an array indexed by reference position
+    :param start: the first position to include
+    :param end: the last position to include
+    :return: an array with end-start+1 entries
+    """
+    if end < counts.size:
+        return counts[start:end+1]
+    padded = np.zeros(end - start + 1, dtype=counts.dtype)
+    available = counts[start:end+1]
+    padded[:available.size] = available
+    return padded
+
+
+def get_key_positions(project_region):
+    """ List the key position ranges for a project region.
+
+    :param project_region: a project region dictionary from ProjectConfig
+    :return: a list of (start, end) pairs, or the whole region if it has no
+        key positions.
+    """
+    key_positions = [(key_pos['start_pos'],
+                      key_pos['start_pos']
+                      if key_pos['end_pos'] is None
+                      else key_pos['end_pos'])
+                     for key_pos in project_region['key_positions']]
+    if not key_positions:
+        key_positions.append((1, project_region['coordinate_region_length']))
+    return key_positions
+
+
+def calculate_score(project_region, coverage):
+    """ Score the coverage of a project region.
+
+    :param project_region: a project region dictionary from ProjectConfig
+    :param coverage: an array of coverage counts, indexed by reference
+        position
+    :return: (min_coverage, min_coverage_pos, off_score, on_score)
+    """
+    key_positions = get_key_positions(project_region)
+    key_coverage = np.concatenate([get_counts(coverage, start, end)
+                                   for start, end in key_positions])
+    key_offsets = np.concatenate([np.arange(start, end+1)
+                                  for start, end in key_positions])
+    min_index = key_coverage.argmin()  # first one wins a tie
+    min_coverage = int(key_coverage[min_index])
+    min_coverage_pos = int(key_offsets[min_index])
+    if min_coverage <= project_region['min_coverage1']:
+        coverage_score_on = 1
+    elif min_coverage <= project_region['min_coverage2']:
+        coverage_score_on = 2
+    elif min_coverage <= project_region['min_coverage3']:
+        coverage_score_on = 3
+    else:
+        coverage_score_on = 4
+    region_length = project_region['coordinate_region_length']
+    max_coverage = int(get_counts(coverage, 1, region_length).max())
+    if max_coverage == 0:
+        coverage_score_off = 0
+    elif max_coverage <= 10:
+        coverage_score_off = -1
+    elif max_coverage <= 100:
+        coverage_score_off = -2
+    else:
+        coverage_score_off = -3
+    return min_coverage, min_coverage_pos, coverage_score_off, coverage_score_on
+
+
+def iter_coverage_scores(amino_csv, excluded_projects=None, projects=None):
+    """ Score the coverage of every project region in amino.csv.
+
+    :param amino_csv: an open file object that holds amino acid frequencies
+    :param excluded_projects: a list of project names to exclude
+    :param projects: the ProjectConfig to use, or None to load the
+        scoring configuration
+    :return: a generator of (score_row, project_region, counts), where
+        score_row matches SCORE_COLUMNS, and counts is from
+        read_coverage_counts()
+    """
+    if projects is None:
+        projects = project_config.ProjectConfig.loadScoring()
+    for seed, region, qcut, counts in read_coverage_counts(amino_csv):
+        for project_region in projects.getProjectRegions(
+                seed,
+                region,
+                excluded_projects=excluded_projects):
+            (min_coverage,
+             min_coverage_pos,
+             coverage_score_off,
+             coverage_score_on) = calculate_score(project_region,
+                                                  counts['coverage'])
+            score_row = {'project': project_region['project_name'],
+                         'region': region,
+                         'seed': seed,
+                         'q.cut': qcut,
+                         'min.coverage': min_coverage,
+                         'which.key.pos': min_coverage_pos,
+                         'off.score': coverage_score_off,
+                         'on.score': coverage_score_on}
+            yield score_row, project_region, counts
+
+
+def create_score_writer(coverage_scores_csv):
+    writer = DictWriter(coverage_scores_csv,
+                        SCORE_COLUMNS,
+                        lineterminator=os.linesep)
+    writer.writeheader()
+    return writer
+
+
+def coverage_scores(amino_csv, coverage_scores_csv, excluded_projects=None):
+    """ Write coverage scores without drawing any coverage maps.
+
+    :param amino_csv: an open file object that holds amino acid frequencies
+    :param coverage_scores_csv: an open file object to write the coverage
+        scores
+    :param excluded_projects: a list of project names to exclude
+    """
+    writer = create_score_writer(coverage_scores_csv)
+    for score_row, _, _ in iter_coverage_scores(amino_csv, excluded_projects):
+        writer.writerow(score_row)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Calculate coverage scores from MiCall outputs.')
+    parser.add_argument('amino_csv', type=argparse.FileType('rU'),
+                        help='<input> CSV containing amino acid frequency outputs.')
+    parser.add_argument('coverage_scores_csv', type=argparse.FileType('w'),
+                        help='<output> CSV coverage scores.')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    coverage_scores(args.amino_csv, args.coverage_scores_csv)
+
+
+if __name__ == '__main__':
+    main()
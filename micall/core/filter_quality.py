@@ -26,7 +26,7 @@ def parseArgs():
 
     return parser.parse_args()
 
-logger = miseq_logging.init_logging_console_only(logging.DEBUG)
+logger = logging.getLogger(__name__)
 
 
 def direction_grouper(cycle):
@@ -62,7 +62,141 @@ def report_bad_cycles(quality_csv, bad_cycles_csv, bad_tiles_csv=None):
             tile_writer.writerow(dict(tile=tile, bad_cycles=bad_cycle_count))
 
 
+def build_error_matrix(errors, read_lengths=None):
+    """ Arrange phiX error rates in a tile x direction x cycle matrix.
+
+    This holds the same values as the quality.csv file from write_phix_csv().
+    :param errors: a structured array like the one from read_error_array()
+    :param read_lengths: a list of lengths for each type of read: forward,
+        indexes, and reverse
+    :return: (tiles, error_rates, is_present), where tiles is an array of
+        tile numbers, and the other two are matrices indexed by
+        [tile_index, direction, cycle-1]. Direction 0 is forward, and 1 is
+        reverse. error_rates is NaN for missing cycles, and is_present is
+        True for the cycles that would be written to quality.csv: up to the
+        end of the read or the last cycle with data, unless the tile has no
+        data at all in that direction.
+    """
+    import numpy as np  # slow to import
+    from micall.monitor.error_metrics_parser import map_cycles
+    tiles, cycles, error_rates = map_cycles(errors, read_lengths)
+    tile_numbers, tile_indexes = np.unique(tiles, return_inverse=True)
+    directions = (cycles < 0).astype(np.int64)
+    cycle_indexes = np.abs(cycles) - 1
+    extents = np.zeros((tile_numbers.size, 2), dtype=np.int64)
+    np.maximum.at(extents, (tile_indexes, directions), cycle_indexes + 1)
+    if read_lengths:
+        has_cycles = extents > 0
+        extents[:, 0] = np.where(has_cycles[:, 0],
+                                 np.maximum(extents[:, 0], read_lengths[0]),
+                                 0)
+        extents[:, 1] = np.where(has_cycles[:, 1],
+                                 np.maximum(extents[:, 1], read_lengths[-1]),
+                                 0)
+    width = int(extents.max()) if extents.size else 0
+    error_matrix = np.full((tile_numbers.size, 2, width), np.nan)
+    error_matrix[tile_indexes, directions, cycle_indexes] = error_rates
+    is_present = np.arange(width) < extents[:, :, None]
+    return tile_numbers, error_matrix, is_present
+
+
+def find_bad_cycles(error_rates, is_present):
+    """ Find the bad cycles in an error rate matrix.
+
+    A cycle is bad if its error rate is missing or at least BAD_ERROR_RATE,
+    or if an earlier cycle in the same direction was bad.
+    :param error_rates: a matrix from build_error_matrix()
+    :param is_present: a matrix from build_error_matrix()
+    :return: a boolean matrix with the same shape as error_rates
+    """
+    import numpy as np  # slow to import
+    is_bad = is_present & ~(error_rates < BAD_ERROR_RATE)
+    is_bad = np.logical_or.accumulate(is_bad, axis=2)
+    return is_bad & is_present
+
+
+def report_bad_cycle_matrix(tiles,
+                            error_rates,
+                            is_bad,
+                            bad_cycles_csv,
+                            bad_tiles_csv=None):
+    """ Write bad cycles and tiles, like report_bad_cycles().
+
+    :param tiles: an array of tile numbers from build_error_matrix()
+    :param error_rates: a matrix from build_error_matrix()
+    :param is_bad: a matrix from find_bad_cycles()
+    :param bad_cycles_csv: an open file to write the bad cycles to
+    :param bad_tiles_csv: an open file to write the bad cycle count for
+        each tile to, or None
+    """
+    import numpy as np  # slow to import
+    writer = csv.writer(bad_cycles_csv, lineterminator=os.linesep)
+    writer.writerow(['tile', 'cycle', 'errorrate'])
+    tile_indexes, directions, cycle_indexes = np.nonzero(is_bad)
+    bad_tiles = tiles[tile_indexes].tolist()
+    bad_cycles = np.where(directions == 0,
+                          cycle_indexes + 1,
+                          -cycle_indexes - 1).tolist()
+    bad_rates = error_rates[is_bad]
+    bad_rates = [
+        '' if is_missing else rate
+        for rate, is_missing in zip(bad_rates.tolist(),
+                                    np.isnan(bad_rates).tolist())]
+    writer.writerows(zip(bad_tiles, bad_cycles, bad_rates))
+    if bad_tiles_csv is not None:
+        tile_writer = csv.writer(bad_tiles_csv, lineterminator=os.linesep)
+        tile_writer.writerow(['tile', 'bad_cycles'])
+        tile_writer.writerows(zip(tiles.tolist(),
+                                  is_bad.sum(axis=(1, 2)).tolist()))
+
+
+def report_bad_cycle_array(errors,
+                           bad_cycles_csv,
+                           bad_tiles_csv=None,
+                           read_lengths=None):
+    """ Find and report bad cycles, straight from phiX error metrics.
+
+    Writes the same files as report_bad_cycles() would from quality.csv.
+    :param errors: a structured array like the one from read_error_array()
+    :param bad_cycles_csv: an open file to write the bad cycles to
+    :param bad_tiles_csv: an open file to write the bad cycle count for
+        each tile to, or None
+    :param read_lengths: a list of lengths for each type of read: forward,
+        indexes, and reverse
+    :return: the cycle masks from build_cycle_masks(), so reads can be
+        censored without reading bad_cycles_csv
+    """
+    tiles, error_rates, is_present = build_error_matrix(errors, read_lengths)
+    is_bad = find_bad_cycles(error_rates, is_present)
+    report_bad_cycle_matrix(tiles,
+                            error_rates,
+                            is_bad,
+                            bad_cycles_csv,
+                            bad_tiles_csv)
+    return build_cycle_masks(tiles, is_bad)
+
+
+def build_cycle_masks(tiles, is_bad):
+    """ Build masks of bad cycles that trim_fastqs.censor() can use.
+
+    :param tiles: an array of tile numbers from build_error_matrix()
+    :param is_bad: a matrix from find_bad_cycles()
+    :return: {(tile, is_forward): mask}, like trim_fastqs.build_cycle_masks()
+        returns: tile is a string, and mask is a boolean array that is True
+        at the index of each bad cycle. Index 0 is always False.
+    """
+    import numpy as np  # slow to import
+    cycle_masks = {}
+    for tile_index, direction in zip(*np.nonzero(is_bad.any(axis=2))):
+        bad_indexes = np.flatnonzero(is_bad[tile_index, direction])
+        mask = np.zeros(bad_indexes[-1] + 2, dtype=bool)
+        mask[bad_indexes + 1] = True
+        cycle_masks[(str(tiles[tile_index]), bool(direction == 0))] = mask
+    return cycle_masks
+
+
 def main():
+    miseq_logging.init_logging_console_only(logging.DEBUG)
     args = parseArgs()
     with args.quality_csv, args.bad_cycles_csv:
         report_bad_cycles(args.quality_csv, args.bad_cycles_csv)
@@ -5,13 +5,16 @@ Shipyard-style bowtie2
 Run bowtie2 on paired-end FASTQ data sets with user-supplied *.bt2
 bowtie2 SAM format output to <stdout> for redirection via subprocess.Popen
 Sort outputs by refname.
-Convert to CSV format and write to file.
+Convert to CSV format and write to file, or write a SAM file and read counts
+that remap can use directly.
 """
 
 import argparse
+from collections import defaultdict
 import csv
 import logging
 import os
+import re
 import sys
 
 from micall.core import miseq_logging
@@ -27,8 +30,21 @@ READ_GAP_OPEN = 10
 READ_GAP_EXTEND = 3
 REF_GAP_OPEN = 10
 REF_GAP_EXTEND = 3
-
-logger = miseq_logging.init_logging_console_only(logging.DEBUG)
+MAX_PRIMER_LENGTH = 50  # shorter matches don't count as mapped
+SAM_FLAG_IS_UNMAPPED = 0x4
+PRELIM_FIELDS = ['qname',
+                 'flag',
+                 'rname',
+                 'pos',
+                 'mapq',
+                 'cigar',
+                 'rnext',
+                 'pnext',
+                 'tlen',
+                 'seq',
+                 'qual']
+
+logger = logging.getLogger(__name__)
 line_counter = LineCounter()
 
 
@@ -41,13 +57,16 @@ def prelim_map(fastq1,
                stderr=sys.stderr,
                gzip=False,
                work_path='',
-               excluded_seeds=None):
+               excluded_seeds=None,
+               prelim_sam=None,
+               prelim_counts_csv=None):
     """ Run the preliminary mapping step.
 
     @param fastq1: the file name for the forward reads in FASTQ format
     @param fastq2: the file name for the reverse reads in FASTQ format
     @param prelim_csv: an open file object for the output file - all the reads
-        mapped to references in CSV version of the SAM format
+        mapped to references in CSV version of the SAM format, or None if
+        only prelim_sam is needed
     @param nthreads: the number of threads to use.
     @param rdgopen: a penalty for opening a gap in the read sequence.
     @param rfgopen: a penalty for opening a gap in the reference sequence.
@@ -55,6 +74,12 @@ def prelim_map(fastq1,
     @param gzip: True if FASTQ files are in gzip format
     @param work_path:  optional path to store working files
     @param excluded_seeds: a list of seed names to exclude from mapping
+    @param prelim_sam: an open file object to write the same reads to in
+        SAM format, with a header, so remap can use it without converting
+        prelim_csv, or None
+    @param prelim_counts_csv: an open file object to write the number of
+        reads mapped to each reference, or None. Only written with
+        prelim_sam.
     """
     try:
         bowtie2 = Bowtie2(BOWTIE_VERSION, BOWTIE_PATH)
@@ -79,19 +104,14 @@ def prelim_map(fastq1,
     reffile_template = os.path.join(work_path, 'reference')
     bowtie2_build.build(ref_path, reffile_template)
 
-    fieldnames = ['qname',
-                  'flag',
-                  'rname',
-                  'pos',
-                  'mapq',
-                  'cigar',
-                  'rnext',
-                  'pnext',
-                  'tlen',
-                  'seq',
-                  'qual']
-    writer = csv.writer(prelim_csv, lineterminator=os.linesep)
-    writer.writerow(fieldnames)
+    if prelim_csv is None:
+        writer = None
+    else:
+        writer = csv.writer(prelim_csv, lineterminator=os.linesep)
+        writer.writerow(PRELIM_FIELDS)
+    if prelim_sam is not None:
+        write_sam_header(prelim_sam, projects)
+    ref_counts = defaultdict(lambda: [0, 0])  # {rname: [filtered_count, count]}
 
     # do preliminary mapping
     read_gap_open_penalty = rdgopen
@@ -111,8 +131,82 @@ def prelim_map(fastq1,
                    '-X', '1200',
                    '-p', str(nthreads)]
 
-    for i, line in enumerate(bowtie2.yield_output(bowtie_args, stderr=stderr)):
-        writer.writerow(line.split('\t')[:11])  # discard optional items
+    for lines in bowtie2.yield_output_batches(bowtie_args, stderr=stderr):
+        # discard optional items
+        rows = [line.split('\t')[:11] for line in lines]
+        if writer is not None:
+            writer.writerows(rows)
+        if prelim_sam is not None:
+            prelim_sam.writelines('\t'.join(fields) + '\n' for fields in rows)
+            for fields in rows:
+                count_prelim_read(ref_counts, fields[2], fields[1], fields[5])
+    if prelim_sam is not None and prelim_counts_csv is not None:
+        write_prelim_counts(prelim_counts_csv, ref_counts)
+
+
+def write_sam_header(sam_file, projects):
+    """ Write a SAM header that lists all the seed references. """
+    conseqs = projects.getAllReferences()
+    sam_file.write('@HD\tVN:1.0\tSO:unsorted\n')
+    for rname in sorted(conseqs.keys()):
+        refseq = conseqs[rname]
+        sam_file.write('@SQ\tSN:%s\tLN:%d\n' % (rname, len(refseq)))
+    sam_file.write('@PG\tID:bowtie2\tPN:bowtie2\tVN:2.2.3\tCL:""\n')
+
+
+def is_unmapped_read(flag):
+    """
+    Interpret bitwise flag from SAM field.
+    Returns True if the read is unmapped.
+    """
+    return (int(flag) & SAM_FLAG_IS_UNMAPPED) != 0
+
+
+def is_short_read(read_row, max_primer_length):
+    """
+    Return length of matched intervals in read
+    :param read_row:
+    :param max_primer_length:
+    :return:
+    """
+    cigar = read_row['cigar']
+    sizes = re.findall(r'(\d+)M', cigar)
+    match_length = max(map(int, sizes))
+    return match_length <= max_primer_length
+
+
+def count_prelim_read(ref_counts, rname, flag, cigar):
+    """ Count a read, and whether it passed the filter, for its reference.
+
+    :param ref_counts: {rname: [filtered_count, count]} to update
+    :param rname: the reference name from the SAM row
+    :param flag: the bitwise flag from the SAM row
+    :param cigar: the CIGAR string from the SAM row
+    """
+    counts = ref_counts[rname]
+    counts[1] += 1  # full count
+    if is_unmapped_read(flag):
+        return
+    if is_short_read(dict(cigar=cigar), max_primer_length=MAX_PRIMER_LENGTH):
+        return
+    counts[0] += 1  # filtered count
+
+
+def write_prelim_counts(prelim_counts_csv, ref_counts):
+    writer = csv.writer(prelim_counts_csv, lineterminator=os.linesep)
+    writer.writerow(['rname', 'count', 'filtered_count'])
+    for rname, (filtered_count, count) in sorted(ref_counts.items()):
+        writer.writerow([rname, count, filtered_count])
+
+
+def read_prelim_counts(prelim_counts_csv):
+    """ Read the counts written by prelim_map().
+
+    :param prelim_counts_csv: an open CSV file with the counts
+    :return: {rname: [filtered_count, count]}
+    """
+    return {row['rname']: [int(row['filtered_count']), int(row['count'])]
+            for row in csv.DictReader(prelim_counts_csv)}
 
 
 def check_fastq(filename, gzip=False):
@@ -130,6 +224,7 @@ def check_fastq(filename, gzip=False):
 
 
 def main():
+    miseq_logging.init_logging_console_only(logging.DEBUG)
     parser = argparse.ArgumentParser(
         description='Map contents of FASTQ R1 and R2 data sets to references using bowtie2.')
 
@@ -19,20 +19,20 @@ import sys
 
 # noinspection PyUnresolvedReferences
 from gotoh import align_it
-import Levenshtein
 
 from micall.core import miseq_logging, project_config
 from micall.core.sam2aln import apply_cigar, merge_pairs, merge_inserts
 from micall.core.prelim_map import BOWTIE_BUILD_PATH, \
     BOWTIE_PATH, BOWTIE_VERSION, READ_GAP_OPEN, READ_GAP_EXTEND, REF_GAP_OPEN, \
-    REF_GAP_EXTEND, check_fastq
+    REF_GAP_EXTEND, MAX_PRIMER_LENGTH, SAM_FLAG_IS_UNMAPPED, check_fastq, \
+    is_unmapped_read, is_short_read, read_prelim_counts, write_sam_header
 from micall.utils.externals import Bowtie2, Bowtie2Build, LineCounter
+from micall.utils.fastq_parser import load_record_count
 from micall.utils.translation import reverse_and_complement
 
 CONSENSUS_Q_CUTOFF = 20         # Min Q for base to contribute to conseq (pileup2conseq)
 MIN_MAPPING_EFFICIENCY = 0.95   # Fraction of fastq reads mapped needed
 MAX_REMAPS = 3                  # Number of remapping attempts if mapping efficiency unsatisfied
-SAM_FLAG_IS_UNMAPPED = 0x4
 SAM_FLAG_IS_MATE_UNMAPPED = 0x8
 SAM_FLAG_IS_FIRST_SEGMENT = 0x40
 
@@ -53,7 +53,7 @@ SAM_FIELDS = [
 
 cigar_re = re.compile('[0-9]+[MIDNSHPX=]')  # CIGAR token
 
-logger = miseq_logging.init_logging_console_only(logging.DEBUG)
+logger = logging.getLogger(__name__)
 indel_re = re.compile('[+-][0-9]+')
 line_counter = LineCounter()
 
@@ -66,27 +66,6 @@ def is_first_read(flag):
     return (int(flag) & SAM_FLAG_IS_FIRST_SEGMENT) != 0
 
 
-def is_unmapped_read(flag):
-    """
-    Interpret bitwise flag from SAM field.
-    Returns True if the read is unmapped.
-    """
-    return (int(flag) & SAM_FLAG_IS_UNMAPPED) != 0
-
-
-def is_short_read(read_row, max_primer_length):
-    """
-    Return length of matched intervals in read
-    :param read_row:
-    :param max_primer_length:
-    :return:
-    """
-    cigar = read_row['cigar']
-    sizes = re.findall(r'(\d+)M', cigar)
-    match_length = max(map(int, sizes))
-    return match_length <= max_primer_length
-
-
 def merge_reads(quality_cutoff, read_pair):
     """ Merge a pair of reads.
 
@@ -242,6 +221,8 @@ def sam_to_conseqs(samfile,
     gap_open_penalty = 15
     gap_extend_penalty = 3
     use_terminal_gap_penalty = 1
+    if is_filtering:
+        import Levenshtein  # slow to import, and only needed for filtering
     while is_filtering and len(new_conseqs) > 1:
         drifted_seeds = []  # [(count, name)]
         if relevant_conseqs is None:
@@ -434,13 +415,16 @@ def remap(fastq1,
           rfgopen=REF_GAP_OPEN,
           stderr=sys.stderr,
           gzip=False,
-          debug_file_prefix=None):
+          debug_file_prefix=None,
+          prelim_sam=None,
+          prelim_counts_csv=None):
     """
     Iterative re-map reads from raw paired FASTQ files to a reference sequence set that
     is being updated as the consensus of the reads that were mapped to the last set.
     @param fastq1: input R1 FASTQ
     @param fastq2: input R2 FASTQ
-    @param prelim_csv: input CSV output from prelim_csv()
+    @param prelim_csv: input CSV output from prelim_map(), or None if
+        prelim_sam and prelim_counts_csv are given
     @param remap_csv:  output CSV, contents of bowtie2 SAM output
     @param remap_counts_csv:  output CSV, counts of reads mapped to regions
     @param remap_conseq_csv:  output CSV, sample- and region-specific consensus sequences
@@ -458,6 +442,10 @@ def remap(fastq1,
     @param debug_file_prefix: the prefix for the file path to write debug files.
         If not None, this will be used to write a copy of the reference FASTA
         files and the output SAM files.
+    @param prelim_sam: the SAM file name written by prelim_map(), used
+        instead of converting prelim_csv
+    @param prelim_counts_csv: input CSV of read counts written by
+        prelim_map() along with prelim_sam
     """
 
     reffile = os.path.join(work_path, 'temp.fasta')
@@ -481,8 +469,12 @@ def remap(fastq1,
     projects = project_config.ProjectConfig.loadDefault()
     seeds = projects.getAllReferences()
 
-    # record the raw read count
-    raw_count = line_counter.count(fastq1, gzip=gzip) // 2  # 4 lines per record in FASTQ, paired
+    # record the raw read count, 2 reads in each pair
+    record_count = load_record_count(fastq1)
+    if record_count is not None:
+        raw_count = record_count * 2
+    else:
+        raw_count = line_counter.count(fastq1, gzip=gzip) // 2  # 4 lines per record in FASTQ, paired
 
     remap_counts_writer = csv.DictWriter(
         remap_counts_csv,
@@ -491,17 +483,26 @@ def remap(fastq1,
     remap_counts_writer.writeheader()
     remap_counts_writer.writerow(dict(type='raw', count=raw_count))
 
-    # convert preliminary CSV to SAM, count reads
-    with open(samfile, 'w') as f:
-        # transfer filtered counts to map counts for remap loop
-        map_counts = convert_prelim(prelim_csv,
-                                    f,
-                                    remap_counts_writer,
-                                    count_threshold,
-                                    projects)
+    if prelim_sam is not None:
+        # prelim_map already wrote the SAM file and counted the reads
+        prelim_samfile = prelim_sam
+        map_counts = select_prelim_seeds(read_prelim_counts(prelim_counts_csv),
+                                         remap_counts_writer,
+                                         count_threshold,
+                                         projects)
+    else:
+        # convert preliminary CSV to SAM, count reads
+        prelim_samfile = samfile
+        with open(samfile, 'w') as f:
+            # transfer filtered counts to map counts for remap loop
+            map_counts = convert_prelim(prelim_csv,
+                                        f,
+                                        remap_counts_writer,
+                                        count_threshold,
+                                        projects)
 
     # regenerate consensus sequences based on preliminary map
-    prelim_conseqs = build_conseqs(samfile, seeds=seeds)
+    prelim_conseqs = build_conseqs(prelim_samfile, seeds=seeds)
 
     # exclude references with low counts (post filtering)
     conseqs = {rname: prelim_conseqs[rname]
@@ -639,13 +640,7 @@ def convert_prelim(prelim_csv,
     :param projects: project definitions
     :return dict: { refname: count }
     """
-    conseqs = projects.getAllReferences()
-    # write SAM header
-    target.write('@HD\tVN:1.0\tSO:unsorted\n')
-    for rname in sorted(conseqs.keys()):
-        refseq = conseqs[rname]
-        target.write('@SQ\tSN:%s\tLN:%d\n' % (rname, len(refseq)))
-    target.write('@PG\tID:bowtie2\tPN:bowtie2\tVN:2.2.3\tCL:""\n')
+    write_sam_header(target, projects)
     # iterate through prelim CSV and record counts, transfer rows to SAM
     ref_counts = defaultdict(lambda: [0, 0])  # {rname: [filtered_count, count]}
     reader = csv.DictReader(prelim_csv)
@@ -658,12 +653,30 @@ def convert_prelim(prelim_csv,
 
         if is_unmapped_read(row['flag']):
             continue
-        if is_short_read(row, max_primer_length=50):
+        if is_short_read(row, max_primer_length=MAX_PRIMER_LENGTH):
             # exclude short reads
             continue
 
         counts[0] += 1  # filtered count
 
+    return select_prelim_seeds(ref_counts,
+                               remap_counts_writer,
+                               count_threshold,
+                               projects)
+
+
+def select_prelim_seeds(ref_counts,
+                        remap_counts_writer,
+                        count_threshold,
+                        projects):
+    """ Report the preliminary counts, and pick the best seed in each group.
+
+    :param ref_counts: {rname: [filtered_count, count]}
+    :param remap_counts_writer: open CSV writer for counts
+    :param count_threshold: minimum read count to be returned
+    :param projects: project definitions
+    :return dict: { refname: count }
+    """
     refgroups = {}  # { group_name: (refname, count) }
     for refname, (filtered_count, count) in sorted(ref_counts.items()):
         # report preliminary counts to file
@@ -761,23 +774,26 @@ def map_to_reference(fastq1,
         f.write('@PG\tID:bowtie2\tPN:bowtie2\tVN:2.2.3\tCL:""\n')
 
         # capture stdout stream to count reads before writing to file
-        for i, line in enumerate(bowtie2.yield_output(bowtie_args, stderr=stderr)):
-            if callback and i % 1000 == 0:
-                callback(progress=i)  # progress monitoring in GUI
-
-            f.write(line)
-
-            items = line.split('\t')
-            qname, bitflag, rname, _, _, _, _, _, _, seq, qual = items[:11]
-
-            if is_unmapped_read(bitflag):
-                # did not map to any reference
-                unmapped_file = unmapped1 if is_first_read(bitflag) else unmapped2
-                unmapped_file.write('@%s\n%s\n+\n%s\n' % (qname, seq, qual))
-                unmapped_count += 1
-                continue
-
-            new_counts[rname] += 1
+        line_count = 0
+        for lines in bowtie2.yield_output_batches(bowtie_args, stderr=stderr):
+            if callback:
+                callback(progress=line_count)  # progress monitoring in GUI
+            line_count += len(lines)
+
+            f.writelines(line + '\n' for line in lines)
+
+            for line in lines:
+                items = line.split('\t')
+                qname, bitflag, rname, _, _, _, _, _, _, seq, qual = items[:11]
+
+                if is_unmapped_read(bitflag):
+                    # did not map to any reference
+                    unmapped_file = unmapped1 if is_first_read(bitflag) else unmapped2
+                    unmapped_file.write('@%s\n%s\n+\n%s\n' % (qname, seq, qual))
+                    unmapped_count += 1
+                    continue
+
+                new_counts[rname] += 1
         if callback:
             callback(progress=raw_count)
     if debug_file_prefix is not None:
@@ -925,6 +941,7 @@ def find_top_token(base_counts):
 
 
 def main():
+    miseq_logging.init_logging_console_only(logging.DEBUG)
     parser = argparse.ArgumentParser(
         description='Iterative remapping of bowtie2 by reference.')
 
@@ -3,20 +3,24 @@
 """ Censor reads based on phiX quality data, and also trim adapter sequences. """
 
 import argparse
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait
 import csv
 from gzip import GzipFile
-import itertools
-import math
 import os
-
-from io import TextIOWrapper
+import subprocess
+from tempfile import TemporaryDirectory
 
 from micall.utils.externals import CutAdapt
+from micall.utils.fastq_parser import open_fastq, read_record_batches, \
+    save_record_counts
 
 # version of bowtie2, used for version control
 CUT_ADAPT_VERSION = '1.11'
 # path to executable, so you can install more than one version
 CUT_ADAPT_PATH = 'cutadapt-' + CUT_ADAPT_VERSION
+MAX_PENDING_BATCHES = 4  # batches from each file that can be trimming at once
+SUMMARY_FIELDS = ['avg_quality', 'base_count']
 
 
 def parse_args():
@@ -37,6 +41,10 @@ def parse_args():
                         '-u',
                         action='store_true',
                         help='Set if the original FASTQ files are not compressed')
+    parser.add_argument('--builtin_trimmer',
+                        '-b',
+                        action='store_true',
+                        help='Trim adapters in this process instead of with cutadapt')
 
     return parser.parse_args()
 
@@ -45,7 +53,11 @@ def trim(original_fastq_filenames,
          bad_cycles_filename,
          trimmed_fastq_filenames,
          use_gzip=True,
-         summary_file=None):
+         summary_file=None,
+         use_fifos=None,
+         use_cutadapt=True,
+         cycle_masks=None,
+         trim_workers=None):
     """
 
     :param original_fastq_filenames: sequence of two filenames, containing
@@ -56,52 +68,235 @@ def trim(original_fastq_filenames,
         censored bases will be written as 'N' with a quality '#'.
     :param use_gzip: True if the original file should be unzipped
     :param summary_file: an open CSV file to write to: write one row
-        with the average read quality for each file
+        with the average read quality for each file. The number of reads in
+        each trimmed file is saved with save_record_counts().
+    :param use_fifos: True if censored reads should stream to cutadapt
+        through named pipes, False if they should be written to temporary
+        files first, or None to use named pipes when the system has them.
+    :param use_cutadapt: True if adapters should be trimmed by cutadapt,
+        False if they should be trimmed in this process by AdapterTrimmer,
+        which writes the trimmed files directly while censoring.
+    :param cycle_masks: bad cycle masks from build_cycle_masks() or
+        load_cycle_masks(), shared by all the samples in a run. If this is
+        given, bad_cycles_filename is not read.
+    :param trim_workers: the number of processes that AdapterTrimmer uses
+        when use_cutadapt is False, or None for one per CPU. With 1, adapters
+        are trimmed in the censoring threads.
     """
     if summary_file is None:
         summary_writer = None
     else:
         summary_writer = csv.DictWriter(summary_file,
-                                        ['avg_quality', 'base_count'],
-                                        lineterminator=os.linesep)
+                                        SUMMARY_FIELDS,
+                                        lineterminator=os.linesep,
+                                        extrasaction='ignore')
         summary_writer.writeheader()
-    cut_adapt = CutAdapt(CUT_ADAPT_VERSION, CUT_ADAPT_PATH)
+    if use_fifos is None:
+        use_fifos = hasattr(os, 'mkfifo')
 
-    censored_filenames = [filename + '.censored.fastq'
-                          for filename in trimmed_fastq_filenames]
-    if not os.path.exists(bad_cycles_filename):
+    if cycle_masks is not None:
+        bad_cycles = []
+    elif not os.path.exists(bad_cycles_filename):
         bad_cycles = []
     else:
         with open(bad_cycles_filename, 'rU') as bad_cycles:
             bad_cycles = list(csv.DictReader(bad_cycles))
-    for src_name, dest_name in zip(original_fastq_filenames, censored_filenames):
-        with open(src_name, 'rb') as src, open(dest_name, 'w') as dest:
-            censor(src, bad_cycles, dest, use_gzip, summary_writer)
 
-    script_path = os.path.dirname(__file__)
-    adapter_files = [os.path.join(script_path, 'adapters_read{}.fasta'.format(i))
-                     for i in (1, 2)]
-    cutadapt_args = ['-a', 'file:' + adapter_files[0],
-                     '-A', 'file:' + adapter_files[1],
-                     '-o', trimmed_fastq_filenames[0],
-                     '-p', trimmed_fastq_filenames[1],
-                     '--quiet',
-                     censored_filenames[0],
-                     censored_filenames[1]]
-    cut_adapt.check_output(cutadapt_args)
-    for filename in censored_filenames:
+    if not use_cutadapt:
+        # AdapterTrimmer uses NumPy, which is slow to import.
+        from micall.utils.adapter_trimmer import AdapterTrimmer
+        adapter_trimmers = [AdapterTrimmer.from_fasta(filename)
+                            for filename in get_adapter_files()]
+        if trim_workers is None:
+            trim_workers = os.cpu_count() or 1
+        if trim_workers > 1:
+            trim_pool = ProcessPoolExecutor(trim_workers)
+            # Start the workers before any threads, because forking a
+            # process while other threads hold locks can deadlock.
+            trim_pool.submit(int).result()
+        else:
+            trim_pool = None
         try:
-            os.remove(filename)
-        except OSError:
-            # We tried to tidy up a temporary file, but it's not critical.
-            pass
+            summaries = censor_files(original_fastq_filenames,
+                                     bad_cycles,
+                                     trimmed_fastq_filenames,
+                                     use_gzip,
+                                     adapter_trimmers=adapter_trimmers,
+                                     cycle_masks=cycle_masks,
+                                     trim_pool=trim_pool)
+        finally:
+            if trim_pool is not None:
+                trim_pool.shutdown()
+    elif use_fifos:
+        cut_adapt = CutAdapt(CUT_ADAPT_VERSION, CUT_ADAPT_PATH)
+        with TemporaryDirectory() as fifo_path:
+            censored_filenames = [
+                os.path.join(fifo_path, 'censored{}.fastq'.format(i))
+                for i in (1, 2)]
+            for filename in censored_filenames:
+                os.mkfifo(filename)
+            cutadapt_args = build_cutadapt_args(censored_filenames,
+                                                trimmed_fastq_filenames)
+            process = cut_adapt.create_process(cutadapt_args,
+                                               stdout=subprocess.DEVNULL)
+            is_censored = False
+            try:
+                summaries = censor_files(original_fastq_filenames,
+                                         bad_cycles,
+                                         censored_filenames,
+                                         use_gzip,
+                                         process,
+                                         cycle_masks=cycle_masks)
+                is_censored = True
+            finally:
+                if not is_censored and process.poll() is None:
+                    # Censoring failed, so cutadapt would wait forever.
+                    process.kill()
+                    process.wait()
+                elif process.wait():
+                    # Report cutadapt's failure, even if it broke a pipe.
+                    raise subprocess.CalledProcessError(
+                        process.returncode,
+                        cut_adapt.build_args(cutadapt_args))
+    else:
+        cut_adapt = CutAdapt(CUT_ADAPT_VERSION, CUT_ADAPT_PATH)
+        censored_filenames = [filename + '.censored.fastq'
+                              for filename in trimmed_fastq_filenames]
+        summaries = censor_files(original_fastq_filenames,
+                                 bad_cycles,
+                                 censored_filenames,
+                                 use_gzip,
+                                 cycle_masks=cycle_masks)
+        cutadapt_args = build_cutadapt_args(censored_filenames,
+                                            trimmed_fastq_filenames)
+        cut_adapt.check_output(cutadapt_args)
+        for filename in censored_filenames:
+            try:
+                os.remove(filename)
+            except OSError:
+                # We tried to tidy up a temporary file, but it's not critical.
+                pass
+    if summary_writer is not None:
+        summary_writer.writerows(summaries)
+    # Cutadapt doesn't filter any reads, so the counts are the same.
+    save_record_counts({filename: summary['read_count']
+                        for filename, summary in zip(trimmed_fastq_filenames,
+                                                     summaries)})
+
+
+def get_adapter_files():
+    script_path = os.path.dirname(__file__)
+    return [os.path.join(script_path, 'adapters_read{}.fasta'.format(i))
+            for i in (1, 2)]
+
+
+def build_cutadapt_args(censored_filenames, trimmed_fastq_filenames):
+    adapter_files = get_adapter_files()
+    return ['-a', 'file:' + adapter_files[0],
+            '-A', 'file:' + adapter_files[1],
+            '-o', trimmed_fastq_filenames[0],
+            '-p', trimmed_fastq_filenames[1],
+            '--quiet',
+            censored_filenames[0],
+            censored_filenames[1]]
+
+
+def censor_files(original_fastq_filenames,
+                 bad_cycles,
+                 censored_filenames,
+                 use_gzip=True,
+                 reader_process=None,
+                 adapter_trimmers=None,
+                 cycle_masks=None,
+                 trim_pool=None):
+    """ Censor read 1 and read 2 at the same time, in two threads.
+
+    Compressed files are also decompressed in their own threads, so
+    decompression overlaps with censoring.
+
+    :param original_fastq_filenames: sequence of two filenames, containing
+        read 1 and read 2 in FASTQ format
+    :param bad_cycles: a list of bad cycle entries: {'tile': tile,
+        'cycle': cycle}
+    :param censored_filenames: sequence of two filenames or named pipes to
+        write the censored reads to
+    :param use_gzip: True if the original files should be unzipped
+    :param reader_process: the process that reads from the named pipes, or
+        None if censored_filenames are regular files. If it stops early,
+        the threads that are waiting to write to it get unblocked.
+    :param adapter_trimmers: a list of two AdapterTrimmer objects for read 1
+        and read 2, or None if adapters shouldn't be trimmed
+    :param cycle_masks: bad cycle masks from build_cycle_masks(), or None
+        to build them from bad_cycles
+    :param trim_pool: a process pool to trim adapters in, or None to trim
+        them in the censoring threads
+    :return: a list of two summaries, in the same order as read 1 and
+        read 2, with avg_quality, base_count, and read_count
+    """
+    if adapter_trimmers is None:
+        adapter_trimmers = [None, None]
+    if cycle_masks is None:
+        cycle_masks = build_cycle_masks(bad_cycles)
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        futures = [executor.submit(censor_file,
+                                   src_name,
+                                   bad_cycles,
+                                   dest_name,
+                                   use_gzip,
+                                   adapter_trimmer,
+                                   cycle_masks,
+                                   trim_pool)
+                   for src_name, dest_name, adapter_trimmer in zip(
+                       original_fastq_filenames,
+                       censored_filenames,
+                       adapter_trimmers)]
+        not_done = futures
+        while not_done:
+            _, not_done = wait(not_done, timeout=0.5)
+            if not_done and reader_process is not None and \
+                    reader_process.poll() is not None:
+                for filename in censored_filenames:
+                    unblock_fifo(filename)
+        return [future.result() for future in futures]
+
+
+def censor_file(src_name,
+                bad_cycles,
+                dest_name,
+                use_gzip=True,
+                adapter_trimmer=None,
+                cycle_masks=None,
+                trim_pool=None):
+    with open_fastq(src_name, use_gzip, read_ahead=True) as src, \
+            open(dest_name, 'w') as dest:
+        return censor(src,
+                      bad_cycles,
+                      dest,
+                      False,
+                      adapter_trimmer=adapter_trimmer,
+                      cycle_masks=cycle_masks,
+                      trim_pool=trim_pool)
+
+
+def unblock_fifo(filename):
+    """ Let a writer that is waiting for a named pipe's reader continue.
+
+    The reader closes immediately, so the writer will get a broken pipe.
+    """
+    try:
+        os.close(os.open(filename, os.O_RDONLY | os.O_NONBLOCK))
+    except OSError:
+        pass
 
 
 def censor(original_file,
            bad_cycles_reader,
            censored_file,
            use_gzip=True,
-           summary_writer=None):
+           summary_writer=None,
+           adapter_trimmer=None,
+           cycle_masks=None,
+           trim_pool=None):
     """ Censor bases from a FASTQ file that were read in bad cycles.
 
     @param original_file: an open FASTQ file to read from
@@ -112,57 +307,156 @@ def censor(original_file,
     @param use_gzip: True if the original file should be unzipped
     @param summary_writer: an open CSV DictWriter to write to: write a single row
         with the average read quality for the whole sample
+    @param adapter_trimmer: an AdapterTrimmer to trim the censored reads
+        with, or None if adapters shouldn't be trimmed
+    @param cycle_masks: bad cycle masks from build_cycle_masks(), or None
+        to build them from bad_cycles_reader
+    @param trim_pool: a process pool to trim adapters in, up to
+        MAX_PENDING_BATCHES batches ahead of writing, or None to trim them
+        in this thread
+    @return: the summary row: {'avg_quality': avg_quality,
+        'base_count': base_count, 'read_count': read_count}, where only the
+        fields in SUMMARY_FIELDS are written to summary_writer
     """
-    bad_cycles = set()
-    for cycle in bad_cycles_reader:
-        bad_cycles.add((cycle['tile'], int(cycle['cycle'])))
+    import numpy as np  # slow to import
+    if cycle_masks is None:
+        cycle_masks = build_cycle_masks(bad_cycles_reader)
 
     src = original_file
     dest = censored_file
     base_count = 0
-    score_sum = 0.0
+    score_sum = 0
+    read_count = 0
     if use_gzip:
         src = GzipFile(fileobj=original_file)
-    src = TextIOWrapper(src)
-
-    for ident, seq, opt, qual in itertools.zip_longest(src, src, src, src):
-        # returns an aggregate of 4 lines per call
-        ident_fields, read_fields = map(str.split, ident.split(' '), '::')
-        tile = ident_fields[4]
-        read_direction = read_fields[0]
-        cycle_sign = 1 if read_direction == '1' else -1
-        dest.write(ident)
-        bad_count = 0
-        for cycle, base in enumerate(seq.rstrip(), start=1):
-            cycle = math.copysign(cycle, cycle_sign)
-            if (tile, cycle) in bad_cycles:
-                bad_count += 1
-            else:
-                if bad_count:
-                    dest.write('N' * bad_count)
-                    bad_count = 0
-                dest.write(base)
-        dest.write('\n')
-        dest.write(opt)
-        bad_count = 0
-        for cycle, score in enumerate(qual.rstrip(), start=1):
-            float_score = ord(score) - 33
-            score_sum += float_score
-            base_count += 1
-            cycle = math.copysign(cycle, cycle_sign)
-            if (tile, cycle) in bad_cycles:
-                bad_count += 1
-            else:
-                if bad_count:
-                    dest.write('#' * bad_count)
-                    bad_count = 0
-                dest.write(score)
-        dest.write('\n')
+
+    pending_batches = deque()  # futures from trim_pool, in file order
+    for batch in read_record_batches(src):
+        read_count += len(batch)
+        censored_records = []
+        batch_quals = []
+        for ident, seq, opt, qual in batch:
+            seq = seq.rstrip()
+            qual = qual.rstrip()
+            batch_quals.append(qual)
+            ident_fields, read_fields = map(str.split, ident.split(' '), '::')
+            cycle_mask = cycle_masks.get((ident_fields[4], read_fields[0] == '1'))
+            if cycle_mask is not None:
+                seq = censor_line(seq, cycle_mask, b'N')
+                qual = censor_line(qual, cycle_mask, b'#')
+            censored_records.append((ident, seq, opt, qual))
+        if adapter_trimmer is None:
+            write_records(dest, censored_records)
+        elif trim_pool is None:
+            write_records(dest, adapter_trimmer.trim_records(censored_records))
+        else:
+            pending_batches.append(trim_pool.submit(
+                adapter_trimmer.trim_records,
+                censored_records))
+            if len(pending_batches) >= MAX_PENDING_BATCHES:
+                write_records(dest, pending_batches.popleft().result())
+        qual_bytes = np.frombuffer(''.join(batch_quals).encode('ascii'),
+                                   dtype=np.uint8)
+        base_count += qual_bytes.size
+        score_sum += int(qual_bytes.sum(dtype=np.int64)) - 33*qual_bytes.size
+    while pending_batches:
+        write_records(dest, pending_batches.popleft().result())
+    avg_quality = score_sum/base_count if base_count > 0 else None
+    summary = dict(base_count=base_count,
+                   avg_quality=avg_quality,
+                   read_count=read_count)
     if summary_writer is not None:
-        avg_quality = score_sum/base_count if base_count > 0 else None
-        summary = dict(base_count=base_count,
-                       avg_quality=avg_quality)
-        summary_writer.writerow(summary)
+        summary_writer.writerow({field: summary[field]
+                                 for field in SUMMARY_FIELDS})
+    return summary
+
+
+def write_records(dest, records):
+    """ Write (header, bases, separator, quality) records to a FASTQ file. """
+    lines = [line for record in records for line in record]
+    lines.append('')
+    dest.write('\n'.join(lines))
+
+
+def build_cycle_masks(bad_cycles_reader):
+    """ Build a mask of bad cycles for each tile and direction.
+
+    @param bad_cycles_reader: an iterable collection of bad cycle entries:
+        {'tile': tile, 'cycle': cycle}, where reverse cycles are negative
+    @return: {(tile, is_forward): mask}, where mask is a boolean array that
+        is True at the index of each bad cycle. Index 0 is always False.
+    """
+    import numpy as np  # slow to import
+    bad_cycles = defaultdict(list)
+    for cycle in bad_cycles_reader:
+        cycle_number = int(cycle['cycle'])
+        bad_cycles[(cycle['tile'], cycle_number > 0)].append(abs(cycle_number))
+    cycle_masks = {}
+    for key, cycles in bad_cycles.items():
+        mask = np.zeros(max(cycles) + 1, dtype=bool)
+        mask[cycles] = True
+        cycle_masks[key] = mask
+    return cycle_masks
+
+
+def save_cycle_masks(cycle_masks, filename):
+    """ Save bad cycle masks, so every sample in a run can share them.
+
+    @param cycle_masks: {(tile, is_forward): mask} from build_cycle_masks()
+    @param filename: the .npy file to write
+    """
+    import numpy as np  # slow to import
+    width = max((mask.size for mask in cycle_masks.values()), default=0)
+    records = np.zeros(len(cycle_masks), dtype=[('tile', '<u2'),
+                                                ('is_forward', '?'),
+                                                ('length', '<u2'),
+                                                ('mask', '?', width)])
+    for i, ((tile, is_forward), mask) in enumerate(sorted(cycle_masks.items())):
+        records['tile'][i] = int(tile)
+        records['is_forward'][i] = is_forward
+        records['length'][i] = mask.size
+        records['mask'][i, :mask.size] = mask
+    np.save(filename, records)
+
+
+def load_cycle_masks(filename):
+    """ Load bad cycle masks that were written by save_cycle_masks().
+
+    The file is memory-mapped, so all the samples share one copy.
+    @param filename: the .npy file to read
+    @return: {(tile, is_forward): mask}, like build_cycle_masks()
+    """
+    import numpy as np  # slow to import
+    records = np.load(filename, mmap_mode='r')
+    return {(str(tile), bool(is_forward)): records['mask'][i, :length]
+            for i, (tile, is_forward, length) in enumerate(zip(
+                records['tile'].tolist(),
+                records['is_forward'].tolist(),
+                records['length'].tolist()))}
+
+
+def censor_line(line, cycle_mask, censor_char):
+    """ Censor the characters of a sequence or quality line in bad cycles.
+
+    Bad cycles in the middle are replaced with censor_char, and bad cycles at
+    the end are trimmed off.
+    @param line: the bases or quality scores of one read
+    @param cycle_mask: a boolean array from build_cycle_masks()
+    @param censor_char: a single byte to replace censored characters
+    @return: the censored line
+    """
+    read_mask = cycle_mask[1:len(line)+1]
+    if not read_mask.any():
+        return line
+    import numpy as np  # slow to import
+    if read_mask.size < len(line):
+        keep_length = len(line)  # cycles past the end of the mask are good
+    else:
+        good_indexes = np.flatnonzero(~read_mask)
+        keep_length = good_indexes[-1] + 1 if good_indexes.size else 0
+    line_bytes = np.frombuffer(line.encode('ascii'), dtype=np.uint8).copy()
+    line_bytes[:read_mask.size][read_mask] = ord(censor_char)
+    return line_bytes[:keep_length].tobytes().decode('ascii')
 
 
 if __name__ == '__main__':
@@ -171,7 +465,8 @@ if __name__ == '__main__':
     trim((args.original1_fastq, args.original2_fastq),
          args.bad_cycles_csv,
          (args.trimmed1_fastq, args.trimmed2_fastq),
-         use_gzip=not args.unzipped)
+         use_gzip=not args.unzipped,
+         use_cutadapt=not args.builtin_trimmer)
 elif __name__ == '__live_coding__':
     import unittest
     from micall.tests.trim_fastqs_test import CensorTest
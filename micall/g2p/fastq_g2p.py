@@ -1,9 +1,11 @@
 #! /usr/bin/env python3.4
 
 import argparse
+from bisect import bisect_right
 from collections import Counter
 import csv
-from itertools import takewhile
+from itertools import takewhile, compress
+from operator import itemgetter
 import os
 import re
 
@@ -12,6 +14,8 @@ from gotoh import align_it, align_it_aa
 
 from micall.core.sam2aln import merge_pairs, SAM2ALN_Q_CUTOFFS
 from micall.utils.big_counter import BigCounter
+from micall.utils.fastq_parser import read_records, FastqError, \
+    save_record_counts
 from micall.utils.translation import translate, reverse_and_complement
 from micall.core.project_config import ProjectConfig, G2P_SEED_NAME
 
@@ -27,6 +31,7 @@ MIN_PAIR_ALIGNMENT_SCORE = 20
 MIN_VALID = 7500
 MIN_VALID_PERCENT = 75.0
 COORDINATE_REF_NAME = "V3LOOP"
+MAX_CACHE_SIZE = 100000  # read 2 reads waiting for their read 1
 # PSSM_AREF = 'CTRPNXNNTXXRKSIRIXXXGPGQXXXAFYATXXXXGDIIGDIXXRQAHC'.replace('X', '')
 
 
@@ -77,7 +82,11 @@ def fastq_g2p(pssm,
     reader = FastqReader(fastq1, fastq2)
     merged_reads = merge_reads(reader)
     trimmed_reads = trim_reads(merged_reads, v3loop_ref)
-    mapped_reads = write_unmapped_reads(trimmed_reads, unmapped1, unmapped2)
+    unmapped_counts = Counter()
+    mapped_reads = write_unmapped_reads(trimmed_reads,
+                                        unmapped1,
+                                        unmapped2,
+                                        unmapped_counts)
     read_counts = count_reads(mapped_reads, count_prefix)
     if aligned_csv is not None:
         read_counts = write_aligned_reads(read_counts,
@@ -92,6 +101,20 @@ def fastq_g2p(pssm,
                min_count,
                min_valid=min_valid,
                min_valid_percent=min_valid_percent)
+    save_unmapped_counts(unmapped1, unmapped2, unmapped_counts['unmapped'])
+
+
+def save_unmapped_counts(unmapped1, unmapped2, unmapped_count):
+    """ Save the number of unmapped reads, so remap doesn't count them. """
+    unmapped_files = [unmapped1, unmapped2]
+    filenames = [getattr(unmapped_file, 'name', None)
+                 for unmapped_file in unmapped_files]
+    if not all(isinstance(filename, str) and os.path.isfile(filename)
+               for filename in filenames):
+        return
+    for unmapped_file in unmapped_files:
+        unmapped_file.flush()
+    save_record_counts({filename: unmapped_count for filename in filenames})
 
 
 def write_rows(pssm,
@@ -127,10 +150,7 @@ def write_rows(pssm,
     g2p_writer.writeheader()
     top_reads, skip_count = get_top_counts(read_counts, min_count)
     counts = Counter()
-    for (ref, s), count in top_reads:
-        seq = s.replace('-', '')
-
-        row = _build_row(seq, count, counts, pssm)
+    for row in _build_rows(top_reads, counts, pssm):
         g2p_writer.writerow(row)
     if skip_count:
         counts['mapped'] += skip_count
@@ -165,55 +185,91 @@ def write_rows(pssm,
                                  valid_pct_display])
 
 
-def _build_row(seq, count, counts, pssm):
-    counts['rank'] += 1
-    counts['mapped'] += count
-    row = {'rank': counts['rank'],
-           'count': count}
+def _build_rows(top_reads, counts, pssm):
+    """ Build result rows for all the top reads as one batch.
+
+    Each distinct sequence is translated and checked once, then all the
+    sequences that pass the checks are scored together by
+    Pssm.run_g2p_batch().
+    :param top_reads: [((aligned_ref, aligned_seq), count)] in rank order
+    :param counts: Counter to update with rank, mapped, valid, and x4 counts
+    :param pssm: PSSM library to calculate scores
+    :return: a list of rows in rank order
+    """
+    rows = []
+    survivors = []  # [(row, seq)] that passed the sanity checks
+    checked = {}  # {seq: (error, prot)}
+    for (ref, s), count in top_reads:
+        seq = s.replace('-', '')
+        counts['rank'] += 1
+        counts['mapped'] += count
+        row = {'rank': counts['rank'],
+               'count': count}
+        rows.append(row)
+        check = checked.get(seq)
+        if check is None:
+            check = checked[seq] = _check_sequence(seq)
+        error, prot = check
+        if prot is not None:
+            row['seq'] = prot
+        if error is None:
+            survivors.append((row, seq))
+        else:
+            row['error'] = error
+
+    results = pssm.run_g2p_batch(seq for row, seq in survivors)
+    for (row, seq), (score, aligned) in zip(survivors, results):
+        _score_row(row, score, aligned, counts, pssm)
+    return rows
+
+
+def _check_sequence(seq):
+    """ Translate a sequence and run the sanity checks on it.
+
+    :param seq: nucleotide sequence with gaps removed
+    :return: (error, prot) where error is None if the sequence passed all the
+        checks, and prot is None if it failed before translation
+    """
     seqlen = len(seq)
     if seq.upper().count('N') > (0.5*seqlen):
         # if more than 50% of the sequence is garbage
-        row['error'] = 'low quality'
-        return row
+        return 'low quality', None
 
     if seqlen == 0:
-        row['error'] = 'zerolength'
-        return row
+        return 'zerolength', None
 
     stats = {}
     prot = translate(seq,
                      ambig_char='X',
                      stats=stats)
-    row['seq'] = prot
 
     if seqlen % 3 != 0:
-        row['error'] = 'notdiv3'
-        return row
+        return 'notdiv3', prot
 
     # sanity check 1 - bounded by cysteines
     if not prot.startswith('C') or not prot.endswith('C'):
-        row['error'] = 'cysteines'
-        return row
+        return 'cysteines', prot
 
     # sanity check 2 - too many ambiguous codons
     if stats['ambiguous'] > 1 or stats['max_aminos'] > 2:
-        row['error'] = '> 2 ambiguous'
-        return row
+        return '> 2 ambiguous', prot
 
     # sanity check 3 - no stop codons
     if prot.count('*') > 0:
-        row['error'] = 'stop codons'
-        return row
+        return 'stop codons', prot
 
     # sanity check 4 - V3 length in range 32-40 inclusive
     if stats['length'] < 32 or stats['length'] > 40:
-        row['error'] = 'length'
-        return row
+        return 'length', prot
+
+    return None, prot
 
-    score, aligned = pssm.run_g2p(seq)
+
+def _score_row(row, score, aligned, counts, pssm):
+    count = row['count']
     if score is None:
         row['error'] = 'failed to align'
-        return row
+        return
 
     aligned2 = ''.join([aa_list[0]
                         if len(aa_list) == 1 else '[%s]' % ''.join(aa_list)
@@ -232,22 +288,22 @@ def _build_row(seq, count, counts, pssm):
     row['seq'] = aligned2.replace('-', '')
     row['aligned'] = aligned2
     row['comment'] = 'ambiguous' if '[' in aligned2 else ''
-    return row
-
-
-class FastqError(Exception):
-    pass
 
 
 class FastqReader:
-    def __init__(self, fastq1, fastq2):
+    def __init__(self, fastq1, fastq2, max_cache_size=MAX_CACHE_SIZE):
         """ Creates an iterator over the reads in a FASTQ file.
 
         Iterator items:
         (pair_name, (read1_name, bases, quality), (read2_name, bases, quality))
+        :param fastq1: open FASTQ file with read 1 reads
+        :param fastq2: open FASTQ file with read 2 reads
+        :param max_cache_size: maximum number of read 2 reads to hold while
+            looking for a read 2 that is out of order
         """
         self.fastq1 = fastq1
         self.fastq2 = fastq2
+        self.max_cache_size = max_cache_size
 
     def __iter__(self):
         cache = {}  # {pair_name: (read_name, bases, qual)}
@@ -260,17 +316,20 @@ class FastqReader:
                 except StopIteration:
                     raise FastqError('No match for read {}.'.format(pair_name))
                 if pair_name2 != pair_name:
+                    if len(cache) >= self.max_cache_size:
+                        raise FastqError(
+                            'No match for read {} in the next {} reads.'.format(
+                                pair_name,
+                                self.max_cache_size))
                     cache[pair_name2] = read2
                     read2 = None
             yield pair_name, read1, read2
 
     @staticmethod
     def get_reads(fastq):
-        for header, bases, sep, quality in zip(fastq, fastq, fastq, fastq):
-            assert header.startswith('@'), header
-            assert sep.startswith('+'), sep
+        for header, bases, _, quality in read_records(fastq):
             pair_name, read_name = header[1:].split()
-            yield pair_name, (read_name, bases.rstrip('\n'), quality.rstrip('\n'))
+            yield pair_name, (read_name, bases, quality)
 
 
 def extract_target(seed_ref, coordinate_ref):
@@ -389,7 +448,7 @@ def trim_reads(reads, v3loop_ref, score_counts=None):
                                         trimmed_aligned_seq)
 
 
-def write_unmapped_reads(reads, unmapped1, unmapped2):
+def write_unmapped_reads(reads, unmapped1, unmapped2, counts=None):
     """ Write reads that failed to merge or align with V3LOOP reference.
 
     :param reads: a generator with these items (aligned_ref and aligned_seq
@@ -400,6 +459,8 @@ def write_unmapped_reads(reads, unmapped1, unmapped2):
      (aligned_ref, aligned_seq))
     :param unmapped1: open FASTQ file that the failed reads will be written to
     :param unmapped2: open FASTQ file that the failed reads will be written to
+    :param counts: a Counter that 'unmapped' gets added to for each pair of
+    reads that gets written
     :return: a generator with (aligned_ref, aligned_seq) for the reads that
     didn't fail.
     """
@@ -409,6 +470,8 @@ def write_unmapped_reads(reads, unmapped1, unmapped2):
         elif unmapped1 is not None and unmapped2 is not None:
             write_fastq_read(unmapped1, pair_name, read1)
             write_fastq_read(unmapped2, pair_name, read2)
+            if counts is not None:
+                counts['unmapped'] += 1
 
 
 def write_fastq_read(fastq, pair_name, read):
@@ -443,20 +506,25 @@ def count_reads(reads, file_prefix):
 def get_top_counts(read_counts, min_count=1):
     """ Report most common reads, in descending order.
 
+    Reads below min_count are only added to the ignored count, so they never
+    have to be held in memory.
     :param read_counts: a generator with items ((aligned_ref, aligned_seq), count)
+        where each read only appears once, like from count_reads()
     :param min_count: the minimum count to be included in the result
     :return: [((aligned_ref, aligned_seq), count)], ignored_count where the
         items are by descending count, and the ignored_count is the total of
         all counts less than min_count
     """
-    counts = Counter()
+    top_counts = []
     ignored_count = 0
     for read, count in read_counts:
         if count < min_count:
             ignored_count += count
         else:
-            counts[read] += count
-    return counts.most_common(), ignored_count
+            top_counts.append((read, count))
+    # Stable sort, so ties stay in the order they arrived.
+    top_counts.sort(key=itemgetter(1), reverse=True)
+    return top_counts, ignored_count
 
 
 def write_aligned_reads(counts, aligned_csv, hiv_seed, v3loop_ref):
@@ -481,33 +549,13 @@ def write_aligned_reads(counts, aligned_csv, hiv_seed, v3loop_ref):
 
     # Count dashes at start of aligned_v3loop
     v3_offset = sum(1 for _ in takewhile(lambda c: c == '-', v3_vs_seed))
-    seed_positions = list(zip(seed_vs_v3[v3_offset:], v3_vs_seed[v3_offset:]))
+    projection = build_projection(seed_vs_v3[v3_offset:],
+                                  v3_vs_seed[v3_offset:])
 
     for rank, read_count in enumerate(counts):
         yield read_count
         (v3_vs_read, read_vs_v3), count = read_count
-        is_started = False
-        seq_offset = 0
-        seq = ''
-        read_positions = iter(zip(v3_vs_read, read_vs_v3))
-        for seed_char, v3_vs_seed_char in seed_positions:
-            if v3_vs_seed_char == '-':
-                seq += '-'
-                continue
-            try:
-                while True:
-                    v3_vs_read_char, read_char = next(read_positions)
-                    if v3_vs_read_char != '-':
-                        break
-            except StopIteration:
-                break
-            if seed_char != '-':
-                if read_char == '-' and not is_started:
-                    seq_offset += 1
-                else:
-                    is_started = True
-                    seq += read_char
-        seq = seq.rstrip('-')
+        seq_offset, seq = project_read(projection, v3_vs_read, read_vs_v3)
         writer.writerow(dict(refname=G2P_SEED_NAME,
                              qcut=Q_CUTOFF,
                              rank=rank,
@@ -516,6 +564,61 @@ def write_aligned_reads(counts, aligned_csv, hiv_seed, v3loop_ref):
                              seq=seq))
 
 
+def build_projection(seed_vs_v3, v3_vs_seed):
+    """ Map each output position in seed coordinates to a V3LOOP position.
+
+    :param seed_vs_v3: seed sequence, aligned to the V3LOOP reference
+    :param v3_vs_seed: V3LOOP reference, aligned to the seed sequence
+    :return: (v3_indexes, limits, seed_gap_counts) where v3_indexes has the
+        V3LOOP position for each output position, or -1 where the V3LOOP
+        reference has a deletion relative to the seed, limits has the number
+        of V3LOOP positions a read must cover to reach each output position,
+        and seed_gap_counts[i] is the number of -1 entries in v3_indexes[:i].
+    """
+    v3_indexes = []
+    limits = []
+    seed_gap_counts = [0]
+    v3_index = -1
+    for seed_char, v3_char in zip(seed_vs_v3, v3_vs_seed):
+        if v3_char == '-':
+            v3_indexes.append(-1)
+            limits.append(v3_index + 1)
+            seed_gap_counts.append(seed_gap_counts[-1] + 1)
+            continue
+        v3_index += 1
+        if seed_char != '-':
+            v3_indexes.append(v3_index)
+            limits.append(v3_index + 1)
+            seed_gap_counts.append(seed_gap_counts[-1])
+    return v3_indexes, limits, seed_gap_counts
+
+
+def project_read(projection, v3_vs_read, read_vs_v3):
+    """ Project a read from V3LOOP coordinates to seed coordinates.
+
+    :param projection: the result from build_projection()
+    :param v3_vs_read: V3LOOP reference, aligned to the read
+    :param read_vs_v3: read, aligned to the V3LOOP reference
+    :return: (seq_offset, seq) where seq_offset is the number of leading
+        positions the read didn't cover, and seq is the projected read
+    """
+    v3_indexes, limits, seed_gap_counts = projection
+    if '-' in v3_vs_read:
+        # Drop insertions relative to V3LOOP.
+        read_chars = ''.join(compress(read_vs_v3,
+                                      map('-'.__ne__, v3_vs_read)))
+    else:
+        read_chars = read_vs_v3
+    end = bisect_right(limits, len(read_chars))
+    # An index of -1 picks up the extra dash for deletions from V3LOOP.
+    read_chars += '-'
+    projected = ''.join(map(read_chars.__getitem__, v3_indexes[:end]))
+    start = len(projected) - len(projected.lstrip('-'))
+    seed_gap_count = seed_gap_counts[start]
+    seq = '-'*seed_gap_count + projected[start:]
+    return start - seed_gap_count, seq.rstrip('-')
+
+
 def main():
     args = parse_args()
     from micall.g2p.pssm_lib import Pssm
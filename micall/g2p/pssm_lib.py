@@ -11,7 +11,7 @@ import os
 
 import gotoh
 
-from micall.utils.translation import translate
+from micall.utils.translation import translate, translate_batch
 
 
 class Pssm(object):
@@ -244,3 +244,42 @@ class Pssm(object):
             return scores[0], aa_aligned
         else:
             return scores, None
+
+    def run_g2p_batch(self, seqs):
+        """
+        Calculate g2p scores and alignments for many nucleotide sequences.
+
+        Sequences that translate to the same amino acids are only aligned and
+        scored once, so synonymous variants are nearly free.
+        @param seqs: an iterable of nucleotide sequences (str)
+        @return: a list of (score, aligned) tuples in the same order as seqs,
+            with the same values that run_g2p() returns for a single sequence.
+            Results for synonymous sequences share the same aligned list, so
+            don't modify it.
+        """
+        seqs = list(seqs)
+        # The same QA checks as align_aminos().
+        is_valid = [len(seq) % 3 == 0 and
+                    len(seq) >= 96 and
+                    not seq.startswith('----') and
+                    not seq.endswith('----')
+                    for seq in seqs]
+        translations = iter(translate_batch(
+            [seq for seq, seq_is_valid in zip(seqs, is_valid) if seq_is_valid],
+            offset=0,
+            resolve=False,
+            return_list=True,
+            ambig_char='X'))
+        results = []
+        cache = {}  # {amino_key: (score, aligned)}
+        for seq, seq_is_valid in zip(seqs, is_valid):
+            if not seq_is_valid:
+                results.append((None, -1))
+                continue
+            aa_lists = next(translations)
+            amino_key = tuple(tuple(aa_list) for aa_list in aa_lists)
+            result = cache.get(amino_key)
+            if result is None:
+                result = cache[amino_key] = self.run_g2p(seq)
+            results.append(result)
+        return results
@@ -34,8 +34,14 @@ drug.comments  #list of comments associated with this drug
 """
 
 from collections import defaultdict
+import hashlib
+from io import BytesIO
+import os
+import pickle
 import re
-import xml.dom.minidom as minidom
+from tempfile import NamedTemporaryFile
+
+from micall.hivdb.asi_compiler import compile_condition, compile_comment
 
 # utility code ---------------------------------------------------------------
 # random useful junk that should probably be in a util file.  Mostly translated
@@ -108,6 +114,57 @@ def raw_translator(nucs):
     return aa
 
 
+# Increment this when the attributes of AsiAlgorithm or the compiled condition
+# classes change, so old cache files get ignored.
+ASI_CACHE_VERSION = 2
+loaded_algorithms = {}  # {cache_name: AsiAlgorithm}, shared within a process
+
+
+def load_asi(rules_path, cache_dir=None):
+    """ Load an ASI algorithm, reusing a cached copy if the rules match.
+
+    Parsing the XML is slow, so the loaded algorithm is pickled to a cache
+    file that is named after a hash of the XML. Changing the XML changes the
+    hash, so the old cache file is ignored.
+    :param rules_path: the path to an ASI2 algorithm XML file
+    :param cache_dir: the folder to write cache files in, or None to use a
+        __pycache__ folder next to the XML file
+    :return: an AsiAlgorithm object that may be shared with other callers,
+        so don't modify it.
+    """
+    with open(rules_path, 'rb') as rules_file:
+        rules_xml = rules_file.read()
+    rules_hash = hashlib.sha1(rules_xml).hexdigest()
+    cache_name = 'asi_{}_v{}.pickle'.format(rules_hash, ASI_CACHE_VERSION)
+    asi = loaded_algorithms.get(cache_name)
+    if asi is not None:
+        return asi
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(os.path.abspath(rules_path)),
+                                 '__pycache__')
+    cache_path = os.path.join(cache_dir, cache_name)
+    try:
+        with open(cache_path, 'rb') as cache_file:
+            asi = pickle.load(cache_file)
+    except Exception:
+        # Missing, unreadable, or out of date, so parse the XML instead.
+        asi = None
+    if not isinstance(asi, AsiAlgorithm):
+        asi = AsiAlgorithm(BytesIO(rules_xml))
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            with NamedTemporaryFile('wb',
+                                    dir=cache_dir,
+                                    suffix='.tmp',
+                                    delete=False) as temp_file:
+                pickle.dump(asi, temp_file, pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_file.name, cache_path)
+        except OSError:
+            pass  # Can't write the cache, but we still have the algorithm.
+    loaded_algorithms[cache_name] = asi
+    return asi
+
+
 # BNF Support code: ----------------------------------------------------------
 class BNFVal:
     def __init__(self, cond, truth=False, score=0, mutations=None):
@@ -163,11 +220,16 @@ class AsiAlgorithm:
         self.drug_class = {}  # {code: [drug_code]}
         self.global_range = []  # [ ['-INF', '9', '1'] , ...]  #first two are the range, the third one is the res level
         self.comment_def = {}  # {code: comment_text}
+        self.comment_templates = {}  # {code: CommentTemplate or None}
 
         self.drugs = {}  # {code: (name, [condition, [(action_type, action_value)]])}
         self.mutation_comments = []  # maybe skip for now?  We don't really use this atm.
         self.mutations = []  # only for hivdb.  This is technically a hack that isn't part of the alg
+        self.compiled_conditions = {}  # {condition_text: compiled_condition}
+        self.position_index = {}  # {region: {position: {condition_text}}}
+        self.wild_type_results = {}  # {region: {condition_text: [truth, score, mutations]}}
 
+        import xml.dom.minidom as minidom  # not needed for cached copies
         dom = minidom.parse(file)
 
         # algorithm info
@@ -197,7 +259,7 @@ class AsiAlgorithm:
             global_range_text = defs.getElementsByTagName('GLOBALRANGE')[0].childNodes[0].nodeValue
             global_range_items = global_range_text.strip(")( \n").split(',')
             self.global_range = list(map(
-                lambda item: (list(re.match('\s*(\S+)\s*TO\s*(\S+)\s*=>\s*(\S+)\s*',
+                lambda item: (list(re.match(r'\s*(\S+)\s*TO\s*(\S+)\s*=>\s*(\S+)\s*',
                                             item.strip("\n \t")).groups())),
                 global_range_items))
         if defs.getElementsByTagName('COMMENT_DEFINITIONS'):
@@ -213,6 +275,7 @@ class AsiAlgorithm:
                 #  self.mutations.append([tmp.group(1), tmp.group(2), tmp.group(3), tmp.group(4)])
 
                 self.comment_def[comment_id] = (b, c)
+                self.comment_templates[comment_id] = compile_comment(b)
 
         # done with the definitions, on to more interesting pastures...
         for drug_node in dom.getElementsByTagName('DRUG'):
@@ -223,7 +286,7 @@ class AsiAlgorithm:
             rules = []
             for rule_node in drug_node.getElementsByTagName('RULE'):
                 condition = rule_node.getElementsByTagName('CONDITION')[0].childNodes[0].nodeValue
-                condition = re.sub('\s+', ' ', condition)
+                condition = re.sub(r'\s+', ' ', condition)
                 actions = []
 
                 for action_node in rule_node.getElementsByTagName('ACTIONS'):
@@ -241,7 +304,7 @@ class AsiAlgorithm:
                     elif action_node.getElementsByTagName('SCORERANGE'):
                         srange = action_node.getElementsByTagName('SCORERANGE')[0].childNodes[0].nodeValue
                         srange = srange.strip(")( \n").split(',')
-                        srange = [re.match('\s*(\S+)\s*TO\s*(\S+)\s*=>\s*(\S+)\s*',
+                        srange = [re.match(r'\s*(\S+)\s*TO\s*(\S+)\s*=>\s*(\S+)\s*',
                                            item.strip("\n \t")).groups()
                                   for item in srange]
                         actions.append(('scorerange', srange))
@@ -258,7 +321,7 @@ class AsiAlgorithm:
                 for rule_node in gene_node.getElementsByTagName('RULE'):
                     # Yeah, rules!
                     condition = rule_node.getElementsByTagName('CONDITION')[0].childNodes[0].nodeValue
-                    condition = re.sub('\s+', ' ', condition)
+                    condition = re.sub(r'\s+', ' ', condition)
                     actions = []
                     # Need to turn condition into science?
 
@@ -269,9 +332,161 @@ class AsiAlgorithm:
                     rules.append([condition, actions])  # hrmm
                 self.mutation_comments.append([gene_name, rules])
 
+        # Parse each condition once, instead of every time it's interpreted.
+        for _, rules in self.drugs.values():
+            for condition, _ in rules:
+                self.compile_condition(condition)
+        for _, rules in self.mutation_comments:
+            for condition, _ in rules:
+                self.compile_condition(condition)
+        for region in self.gene_def:
+            if region in self.stds:
+                self.index_region(region)
+
+    def compile_condition(self, cond):
+        """ Compile a condition, or find it in the cache of compiled ones.
+
+        :param str cond: the condition text
+        :return: the compiled condition, with an evaluate(aaseq) method
+        """
+        compiled = self.compiled_conditions.get(cond)
+        if compiled is None:
+            compiled = self.compiled_conditions[cond] = compile_condition(cond)
+        return compiled
+
     # This is going to be harder than I thought.  Darn you BNF!
     # starts the crazy BNF Parsing
     def interp_condition(self, cond, aaseq):
+        truth, score, mutations = self.compile_condition(cond).evaluate(aaseq)
+        if truth:
+            return [True, score, mutations]
+        return [False, score, mutations]
+
+    def get_region_rules(self, region):
+        """ Yield (condition, actions) for the drug rules and mutation
+        comments that apply to a region.
+        """
+        for drug_class in self.gene_def.get(region, []):
+            for drug_code in self.drug_class[drug_class]:
+                _, rules = self.drugs[drug_code]
+                yield from rules
+        for gene_name, rules in self.mutation_comments:
+            if gene_name == region:
+                yield from rules
+
+    def get_referenced_positions(self, region):
+        """ Find all the positions that interpret() might look at.
+
+        That includes positions in the region's rule conditions, and in the
+        comments that those rules can add.
+        :param str region: the region to check, like 'RT'
+        :return: a set of positions, starting at 1
+        """
+        positions = set()
+        for condition, actions in self.get_region_rules(region):
+            positions |= self.compile_condition(condition).get_positions()
+            for action_type, action_value in actions:
+                if action_type != 'comment':
+                    continue
+                comment, _ = self.comment_def[action_value]
+                for match in re.finditer(r'\$(?:listMutsIn|numberOfMutsIn)\{([^}]+)\}',
+                                         comment):
+                    positions.update(int(position)
+                                     for position in re.findall(r'\d+',
+                                                                match.group(1)))
+        return positions
+
+    def index_region(self, region):
+        """ Record the positions and wild-type results for a region's rules.
+
+        Most positions in a sample match the wild type, so interpret() only
+        has to evaluate the conditions that reference a position that doesn't
+        match. The rest get their wild-type results.
+        :param str region: the region to index, like 'RT'
+        """
+        conditions = {condition for condition, _ in self.get_region_rules(region)}
+
+        wild_type = [[amino] for amino in self.stds[region]]
+        positions = defaultdict(set)
+        results = {}
+        for condition in conditions:
+            compiled = self.compile_condition(condition)
+            truth, score, mutations = compiled.evaluate(wild_type)
+            results[condition] = [bool(truth), score, mutations]
+            for position in compiled.get_positions():
+                positions[position].add(condition)
+        self.position_index[region] = dict(positions)
+        self.wild_type_results[region] = results
+
+    def find_touched_conditions(self, aaseq, region):
+        """ Find the conditions that reference a non-wild-type position.
+
+        :param aaseq: the list of amino acid lists for each position
+        :param str region: the region that aaseq came from
+        :return: a set of condition texts, or None if the region isn't
+            indexed, so all conditions have to be evaluated.
+        """
+        positions = self.position_index.get(region)
+        if positions is None:
+            return None
+        std = self.stds[region]
+        seq_length = len(aaseq)
+        std_length = len(std)
+        touched_conditions = set()
+        for position, conditions in positions.items():
+            if position <= seq_length and position <= std_length:
+                aas = aaseq[position - 1]
+                wild_amino = std[position - 1]
+                if len(aas) == 1 and wild_amino in aas:
+                    continue
+                if set(aas) == {wild_amino}:
+                    continue
+            touched_conditions |= conditions
+        return touched_conditions
+
+    def interp_indexed_condition(self, cond, aaseq, region, touched_conditions):
+        """ Interpret a condition, unless it only references wild type.
+
+        :param str cond: the condition text
+        :param aaseq: the list of amino acid lists for each position
+        :param str region: the region that aaseq came from
+        :param touched_conditions: the result of find_touched_conditions()
+        """
+        if touched_conditions is None or cond in touched_conditions:
+            return self.interp_condition(cond, aaseq)
+        truth, score, mutations = self.wild_type_results[region][cond]
+        return [truth, score, set(mutations)]
+
+    def render_comment(self, comment_id, aaseq, region, is_mutation_comment):
+        """ Fill in the placeholders in a comment, like $listMutsIn{...}.
+
+        :param comment_id: the comment to render
+        :param aaseq: the list of amino acid lists for each position
+        :param str region: the region that aaseq came from
+        :param bool is_mutation_comment: True if this is for the mutation
+            comments, which always get cleaned up, or False if this is for a
+            drug rule, which only gets cleaned up if it has placeholders.
+        """
+        comment, _ = self.comment_def[comment_id]
+        template = self.comment_templates.get(comment_id)
+        if template is None:
+            # Too tricky to compile, so do it the slow way.
+            if is_mutation_comment:
+                return self.comment_filter(comment, aaseq, region)
+            while (re.search(r'\$numberOfMutsIn{', comment) or
+                   re.search(r'\$listMutsIn{', comment)):
+                comment = self.comment_filter(comment, aaseq, region)
+            return comment
+        if not (is_mutation_comment or template.has_placeholders):
+            return comment
+        return template.render(aaseq, self.stds.get(region))
+
+    def interp_condition_bnf(self, cond, aaseq):
+        """ Interpret a condition by parsing it with the BNF methods.
+
+        This is much slower than interp_condition(), but it's useful for
+        checking the compiled conditions.
+        """
         bnf = self.bnf_statement(cond + '|', aaseq)
         assert bnf.cond
         if bnf.truth:
@@ -341,7 +556,7 @@ class AsiAlgorithm:
                 rpi = -1
                 cnt = 0
                 # immediate break if it doesn't match this regexp:
-                if not re.match('^\s*\(', cond):
+                if not re.match(r'^\s*\(', cond):
                     continue
 
                 # Search for parens
@@ -380,12 +595,12 @@ class AsiAlgorithm:
     # and | or
     @staticmethod
     def bnf_logicsymbol(cond):
-        if re.search('^\s*AND\s*', cond, flags=re.I):
-            bnf = BNFVal(re.sub('^\s*AND\s*', '', cond))
+        if re.search(r'^\s*AND\s*', cond, flags=re.I):
+            bnf = BNFVal(re.sub(r'^\s*AND\s*', '', cond))
             bnf.logic = 'AND'
             return bnf
-        elif re.search('^\s*OR\s*', cond, flags=re.I):
-            bnf = BNFVal(re.sub('^\s*OR\s*', '', cond))
+        elif re.search(r'^\s*OR\s*', cond, flags=re.I):
+            bnf = BNFVal(re.sub(r'^\s*OR\s*', '', cond))
             bnf.logic = 'OR'  # I think this works????
             return bnf
         return BNFVal(False)
@@ -397,13 +612,13 @@ class AsiAlgorithm:
     def bnf_residue(cond, aaseq):  # this looks hard yo
         # I think we'll have to go the regexp route here.  Haha.
         mo_a = re.search(
-            '^\s*[ARNDCEQGHILKMFPSTWYVid]?\s*(\d+)\s*([ARNDCEQGHILKMFPSTWYVid]+)(.*)',
+            r'^\s*[ARNDCEQGHILKMFPSTWYVid]?\s*(\d+)\s*([ARNDCEQGHILKMFPSTWYVid]+)(.*)',
             cond)
         mo_b = re.search(
-            '^\s*(?:NOT|EXCLUDE)\s*[ARNDCEQGHILKMFPSTWYVid]?\s*(\d+)\s*([ARNDCEQGHILKMFPSTWYVid]+)(.*)',
+            r'^\s*(?:NOT|EXCLUDE)\s*[ARNDCEQGHILKMFPSTWYVid]?\s*(\d+)\s*([ARNDCEQGHILKMFPSTWYVid]+)(.*)',
             cond)
         mo_c = re.search(
-            '^\s*[ARNDCEQGHILKMFPSTWYVid]?\s*(\d+)\s*\(\s*NOT\s*([ARNDCEQGHILKMFPSTWYVid]+)\s*\)(.*)',
+            r'^\s*[ARNDCEQGHILKMFPSTWYVid]?\s*(\d+)\s*\(\s*NOT\s*([ARNDCEQGHILKMFPSTWYVid]+)\s*\)(.*)',
             cond)
         truth = False
         mutations = None
@@ -435,8 +650,8 @@ class AsiAlgorithm:
 
     # select selectstatement2
     def bnf_selectstatement(self, cond, aaseq):
-        if re.search('^\s*SELECT\s*', cond, flags=re.I):
-            bnf = self.bnf_selectstatement2(re.sub('^\s*SELECT\s*', '', cond), aaseq)
+        if re.search(r'^\s*SELECT\s*', cond, flags=re.I):
+            bnf = self.bnf_selectstatement2(re.sub(r'^\s*SELECT\s*', '', cond), aaseq)
             if bnf.cond:
                 return bnf
         return BNFVal(False)
@@ -474,9 +689,9 @@ class AsiAlgorithm:
         bnflist = self.bnf_selectlist(cond[lparen + 1:rparen] + ' |', aaseq)
 
         mo_a = re.search(
-            '^\s*(EXACTLY\s*(\d+)|ATLEAST\s*(\d+)\s*(AND|OR)\s*'
-            'NOTMORETHAN\s*(\d+)|ATLEAST\s*(\d+)|NOTMORETHAN\s*(\d+))\s*'
-            'from\s*\(\s*(.+)\s*\)',
+            r'^\s*(EXACTLY\s*(\d+)|ATLEAST\s*(\d+)\s*(AND|OR)\s*'
+            r'NOTMORETHAN\s*(\d+)|ATLEAST\s*(\d+)|NOTMORETHAN\s*(\d+))\s*'
+            r'from\s*\(\s*(.+)\s*\)',
             cond, flags=re.I)
         cnt = 0
         select_type = mo_a.group(1)
@@ -486,7 +701,7 @@ class AsiAlgorithm:
                 cnt += 1
                 result.mutations |= bnf.mutations
 
-        if re.search('^\s*ATLEAST\s*(\d+)\s*(AND|OR)\s*NOTMORETHAN',
+        if re.search(r'^\s*ATLEAST\s*(\d+)\s*(AND|OR)\s*NOTMORETHAN',
                      select_type,
                      flags=re.I):
             atleastn = int(mo_a.group(3))
@@ -496,15 +711,15 @@ class AsiAlgorithm:
                 result.truth = atleastn <= cnt <= atmostn
             else:
                 result.truth = atleastn <= cnt or cnt <= atmostn
-        elif re.search('^\s*EXACTLY', select_type, flags=re.I):
+        elif re.search(r'^\s*EXACTLY', select_type, flags=re.I):
             # print 'exactly'
             exactlyn = int(mo_a.group(2))
             result.truth = cnt == exactlyn
-        elif re.search('^\s*ATLEAST', select_type, flags=re.I):
+        elif re.search(r'^\s*ATLEAST', select_type, flags=re.I):
             # print 'atleastn'
             atleastn = int(mo_a.group(6))
             result.truth = cnt >= atleastn
-        elif re.search('^\s*NOTMORETHAN', select_type, flags=re.I):
+        elif re.search(r'^\s*NOTMORETHAN', select_type, flags=re.I):
             # print 'notmorethan'
             atmostn = int(mo_a.group(7))
             result.truth = cnt <= atmostn
@@ -519,7 +734,7 @@ class AsiAlgorithm:
             newcond = bnf.cond
             bnflist.append(bnf)
             while True:
-                newcond = re.sub('^\s*,\s*', '', newcond)
+                newcond = re.sub(r'^\s*,\s*', '', newcond)
                 bnf = self.bnf_residue(newcond, aaseq)
                 if bnf.cond:
                     bnflist.append(bnf)
@@ -532,7 +747,7 @@ class AsiAlgorithm:
 
     # score from l_par scorelist r_par
     def bnf_scorecondition(self, cond, aaseq):
-        tmp = re.search('^\s*score\s*from\s*\((.+)\)\s*|', cond, flags=re.I)
+        tmp = re.search(r'^\s*score\s*from\s*\((.+)\)\s*|', cond, flags=re.I)
         if tmp and tmp.group(1):
             score = 0.0
             bnf_list = self.bnf_scorelist(tmp.group(1) + '|', aaseq)
@@ -564,9 +779,9 @@ class AsiAlgorithm:
             while newcond:
                 # check for comma?
                 # print "test:  " + newcond
-                tmp = re.search('^\s*,\s*', newcond)
+                tmp = re.search(r'^\s*,\s*', newcond)
                 if tmp:
-                    newcond = re.sub('^\s*,\s*', '', newcond)
+                    newcond = re.sub(r'^\s*,\s*', '', newcond)
                     bnf = self.bnf_scoreitem(newcond, aaseq)
                     if not bnf.cond:
                         break
@@ -583,10 +798,10 @@ class AsiAlgorithm:
         # mo_a has 4 groups, the booleanconditon, an optional pointless MIN,
         # and the score, and then the rest of the string
         # I think we need to match a dash for negative numbers yo
-        mo_a = re.search('^\s*([^=>]+)\s*=>\s*(min)?\s*(-?\d+\.?\d*)\s*(.+)$', cond, flags=re.I)
+        mo_a = re.search(r'^\s*([^=>]+)\s*=>\s*(min)?\s*(-?\d+\.?\d*)\s*(.+)$', cond, flags=re.I)
 
         # Trickier than we think, as the subexpressions could have parens.  Need to do the counting game.  Sadly.
-        mo_b = re.search('^\s*MAX\s*\(', cond, flags=re.I)
+        mo_b = re.search(r'^\s*MAX\s*\(', cond, flags=re.I)
         if mo_b:
             # print "to mob, or not to mob?"
             lparen = -1
@@ -639,16 +854,16 @@ class AsiAlgorithm:
     # handles a couple undocumented comment filtering things.
     def comment_filter(self, comment, aaseq, region=None):
         # listMutsIn
-        tmp = re.match('^.*\$listMutsIn\{([^\}]+)\}.*$', comment)
+        tmp = re.match(r'^.*\$listMutsIn\{([^\}]+)\}.*$', comment)
         if tmp:
             tmporig = tmp.group(1)
-            tmporig = tmporig.replace('(', '\(').replace(')', '\)')
+            tmporig = tmporig.replace('(', r'\(').replace(')', r'\)')
             muts = tmp.group(1).split(',')
             final = []
             for mut in muts:
                 # If it matches \d+\(NOT \w+\), then we got to do something fancy
-                tmpa = re.match('[a-z]?(\d+)\(NOT\s+([a-z]+)\)', mut, flags=re.I)
-                tmpb = re.match('[a-z]?(\d+)([a-z]+)', mut, flags=re.I)
+                tmpa = re.match(r'[a-z]?(\d+)\(NOT\s+([a-z]+)\)', mut, flags=re.I)
+                tmpb = re.match(r'[a-z]?(\d+)([a-z]+)', mut, flags=re.I)
                 match = ''
                 loc = ''
                 if tmpa:
@@ -675,24 +890,24 @@ class AsiAlgorithm:
                     else:
                         final.append(loc + subs)
 
-            comment = re.sub('\$listMutsIn\{' + tmporig + '\}', ', '.join(final), comment)
-            comment = re.sub(' \(\)', '', comment)  # get rid of empty brackets.
+            comment = re.sub(r'\$listMutsIn\{' + tmporig + r'\}', ', '.join(final), comment)
+            comment = re.sub(r' \(\)', '', comment)  # get rid of empty brackets.
 
         # numberOfMutsIn
-        tmp = re.match('^.+\$numberOfMutsIn\{([^\}]+)\}.+$', comment)
+        tmp = re.match(r'^.+\$numberOfMutsIn\{([^\}]+)\}.+$', comment)
         if tmp:
             tmpmatch = tmp.group(1)
             muts = tmp.group(1).split(',')
             cnt = 0
             for mut in muts:
-                tmp = re.match('^(\d+)([a-z]+)$', mut, flags=re.I)
+                tmp = re.match(r'^(\d+)([a-z]+)$', mut, flags=re.I)
                 aas = aaseq[int(tmp.group(1)) - 1]
                 for aa in aas:
                     if aa in tmp.group(2):
                         cnt += 1
                         # break
 
-            comment = re.sub('\$numberOfMutsIn\{' + tmpmatch + '\}', str(cnt), comment)
+            comment = re.sub(r'\$numberOfMutsIn\{' + tmpmatch + r'\}', str(cnt), comment)
 
         comment = re.sub('  ', ' ', comment)  # Make spacing more like sierra
         unicod = u'\uf0b1'
@@ -709,6 +924,10 @@ class AsiAlgorithm:
         drug_classes = self.gene_def[region]
         default_level = 1
         default_level_name = self.level_def['1']
+        touched_conditions = self.find_touched_conditions(aaseq, region)
+        # Drug rules and mutation comments can share conditions and comments.
+        condition_results = {}  # {cond: interp}
+        rendered_comments = {}  # {(comment_id, is_mutation_comment): comment}
         for drug_class in drug_classes:
             for drug_code in self.drug_class[drug_class]:
                 drug_name, drug_rules = self.drugs[drug_code]
@@ -722,7 +941,13 @@ class AsiAlgorithm:
                 for rule in drug_rules:
                     cond = rule[0]
                     actions = rule[1]
-                    interp = self.interp_condition(cond, aaseq)
+                    interp = condition_results.get(cond)
+                    if interp is None:
+                        interp = condition_results[cond] = \
+                            self.interp_indexed_condition(cond,
+                                                          aaseq,
+                                                          region,
+                                                          touched_conditions)
 
                     score = interp[1]
                     truth = interp[0]
@@ -735,10 +960,11 @@ class AsiAlgorithm:
                                 drug_result.level = int(act[1])
                                 drug_result.level_name = self.level_def[act[1]]
                         elif act[0] == 'comment':
-                            comment, _ = self.comment_def[act[1]]
-                            while (re.search('\$numberOfMutsIn{', comment) or
-                                   re.search('\$listMutsIn{', comment)):
-                                comment = self.comment_filter(comment, aaseq, region)
+                            comment_key = (act[1], False)
+                            comment = rendered_comments.get(comment_key)
+                            if comment is None:
+                                comment = rendered_comments[comment_key] = \
+                                    self.render_comment(act[1], aaseq, region, False)
                             drug_result.comments.append(comment)
                         elif act[0] == 'scorerange':
                             drug_result.score = score
@@ -781,11 +1007,20 @@ class AsiAlgorithm:
                 cond = mut[0]
                 actions = mut[1]
 
-                interp = self.interp_condition(cond, aaseq)
+                interp = condition_results.get(cond)
+                if interp is None:
+                    interp = condition_results[cond] = \
+                        self.interp_indexed_condition(cond,
+                                                      aaseq,
+                                                      region,
+                                                      touched_conditions)
                 if interp[0]:
                     for act in actions:
-                        comment_template, _ = self.comment_def[act[1]]
-                        comment = self.comment_filter(comment_template, aaseq, region)
+                        comment_key = (act[1], True)
+                        comment = rendered_comments.get(comment_key)
+                        if comment is None:
+                            comment = rendered_comments[comment_key] = \
+                                self.render_comment(act[1], aaseq, region, True)
                         result.mutation_comments.append(comment)
 
         return result
@@ -0,0 +1,609 @@
+"""
+Compiles ASI rule conditions into trees of nodes that can be evaluated many
+times without parsing the condition text again.
+
+The compiler follows the same grammar, and the same quirks, as the BNF
+parsing methods in AsiAlgorithm, so a compiled condition gives the same
+results as AsiAlgorithm.interp_condition(). Each node's evaluate() method
+returns (truth, score, mutations), like the truth, score, and mutations
+fields of a BNFVal.
+
+compiled = compile_condition('SCORE FROM(41L => 15, 215FY => 10)')
+truth, score, mutations = compiled.evaluate(aaseq)
+
+Each node's get_positions() method returns the set of positions that can
+affect its result.
+
+Comment templates are compiled, too, so their $listMutsIn{...} and
+$numberOfMutsIn{...} placeholders can be filled in with a single pass.
+"""
+
+import re
+
+AMINO_PATTERN = '[ARNDCEQGHILKMFPSTWYVid]'
+
+
+class CompileError(Exception):
+    pass
+
+
+class ResidueNode:
+    """ Amino acid at a position matches one of a list of aminos. """
+    def __init__(self, position, aminos):
+        self.position = position
+        self.aminos = frozenset(aminos)
+
+    def __repr__(self):
+        return 'ResidueNode({!r}, {!r})'.format(self.position,
+                                               ''.join(sorted(self.aminos)))
+
+    def get_positions(self):
+        return {self.position}
+
+    def evaluate(self, aaseq):
+        position = self.position
+        if len(aaseq) < position:
+            return False, 0, set()
+        aminos = self.aminos
+        mutations = {str(position) + aa
+                     for aa in aaseq[position - 1]
+                     if aa in aminos}
+        return bool(mutations), 0, mutations
+
+
+class NotResidueNode:
+    """ Amino acid at a position doesn't match any of a list of aminos. """
+    def __init__(self, position, aminos):
+        self.position = position
+        self.aminos = frozenset(aminos)
+
+    def __repr__(self):
+        return 'NotResidueNode({!r}, {!r})'.format(
+            self.position,
+            ''.join(sorted(self.aminos)))
+
+    def get_positions(self):
+        return {self.position}
+
+    def evaluate(self, aaseq):
+        position = self.position
+        if len(aaseq) < position:
+            return False, 0, set()
+        aminos = self.aminos
+        truth = not any(aa in aminos for aa in aaseq[position - 1])
+        return truth, 0, set()
+
+
+class BooleanNode:
+    """ Conditions joined by AND or OR, evaluated from left to right. """
+    def __init__(self, terms):
+        """ Initialize.
+
+        :param terms: [(logic, node)] where logic is 'AND' or 'OR', and is
+            ignored for the first term.
+        """
+        self.terms = terms
+
+    def __repr__(self):
+        return 'BooleanNode({!r})'.format(self.terms)
+
+    def get_positions(self):
+        return set().union(*(node.get_positions() for _, node in self.terms))
+
+    def evaluate(self, aaseq):
+        terms = iter(self.terms)
+        _, first_node = next(terms)
+        left_truth, _, mutations = first_node.evaluate(aaseq)
+        for logic, node in terms:
+            truth, _, node_mutations = node.evaluate(aaseq)
+            # Not quite proper logic order, but same as AsiAlgorithm.
+            if logic == 'AND':
+                left_truth = left_truth and truth
+                if left_truth:
+                    mutations |= node_mutations
+                else:
+                    mutations.clear()
+            elif logic == 'OR':
+                left_truth = left_truth or truth
+                mutations |= node_mutations
+        return left_truth, 0, mutations
+
+
+class SelectNode:
+    """ Count how many residues match, and compare to limits. """
+    def __init__(self, residues, at_least=None, at_most=None, logic='AND'):
+        """ Initialize.
+
+        :param residues: a list of residue nodes to count
+        :param at_least: minimum count, or None
+        :param at_most: maximum count, or None
+        :param logic: 'AND' if both limits must pass, 'OR' if either can
+        """
+        self.residues = residues
+        self.at_least = at_least
+        self.at_most = at_most
+        self.logic = logic
+
+    def __repr__(self):
+        return 'SelectNode({!r}, {!r}, {!r}, {!r})'.format(self.residues,
+                                                           self.at_least,
+                                                           self.at_most,
+                                                           self.logic)
+
+    def get_positions(self):
+        return set().union(*(node.get_positions() for node in self.residues))
+
+    def evaluate(self, aaseq):
+        count = 0
+        mutations = set()
+        for residue in self.residues:
+            truth, _, residue_mutations = residue.evaluate(aaseq)
+            if truth:
+                count += 1
+                mutations |= residue_mutations
+        at_least = self.at_least
+        at_most = self.at_most
+        if at_least is None and at_most is None:
+            truth = False
+        elif at_most is None:
+            truth = count >= at_least
+        elif at_least is None:
+            truth = count <= at_most
+        elif self.logic == 'AND':
+            truth = at_least <= count <= at_most
+        else:
+            truth = at_least <= count or count <= at_most
+        return truth, 0, mutations
+
+
+class ScoreItemNode:
+    """ A score that is added when a boolean condition is true. """
+    def __init__(self, condition, score):
+        self.condition = condition
+        self.score = score
+
+    def __repr__(self):
+        return 'ScoreItemNode({!r}, {!r})'.format(self.condition, self.score)
+
+    def get_positions(self):
+        return self.condition.get_positions()
+
+    def evaluate(self, aaseq):
+        truth, _, mutations = self.condition.evaluate(aaseq)
+        return truth, self.score if truth else 0, mutations
+
+
+class MaxNode:
+    """ The biggest non-zero score from a list of score items. """
+    def __init__(self, items):
+        self.items = items
+
+    def __repr__(self):
+        return 'MaxNode({!r})'.format(self.items)
+
+    def get_positions(self):
+        return set().union(*(node.get_positions() for node in self.items))
+
+    def evaluate(self, aaseq):
+        score = -999  # close enough to infinity.
+        mutations = set()
+        for item in self.items:
+            _, item_score, item_mutations = item.evaluate(aaseq)
+            mutations |= item_mutations
+            if item_score > score and item_score != 0.0:
+                score = item_score
+        if score == -999:
+            score = 0.0
+        return False, score, mutations
+
+
+class ScoreNode:
+    """ The total score from a list of score items. """
+    def __init__(self, items):
+        self.items = items
+
+    def __repr__(self):
+        return 'ScoreNode({!r})'.format(self.items)
+
+    def get_positions(self):
+        return set().union(*(node.get_positions() for node in self.items))
+
+    def evaluate(self, aaseq):
+        score = 0.0
+        mutations = set()
+        for item in self.items:
+            _, item_score, item_mutations = item.evaluate(aaseq)
+            score += item_score
+            mutations |= item_mutations
+        return False, score, mutations
+
+
+def compile_condition(cond):
+    """ Compile a condition from an ASI rule.
+
+    :param str cond: the condition text, with white space collapsed
+    :return: the root node of the compiled condition
+    """
+    cond += '|'
+    for func in (compile_booleancondition, compile_scorecondition):
+        node, rest = func(cond)
+        if rest:
+            return node
+    raise CompileError('Unable to compile condition {!r}.'.format(cond))
+
+
+# Each of the following functions returns (node, rest), where rest is the
+# text left over after parsing. Parsing failed if rest is empty.
+
+# condition condition2*;
+def compile_booleancondition(cond):
+    node, rest = compile_condition_term(cond)
+    if not rest:
+        return None, ''
+    terms = [(None, node)]
+    while True:
+        logic, node, next_rest = compile_condition2(rest)
+        if not next_rest:
+            break
+        terms.append((logic, node))
+        rest = next_rest
+    return BooleanNode(terms), rest
+
+
+# l_par booleancondition r_par | residue | excludestatement | selectstatement
+def compile_condition_term(cond):
+    if re.match(r'^\s*\(', cond):
+        lpi = -1
+        rpi = -1
+        cnt = 0
+        for i in range(0, len(cond)):
+            if cond[i] == '(':
+                if lpi == -1:
+                    lpi = i
+                cnt += 1
+            elif cond[i] == ')':
+                cnt -= 1
+                if cnt == 0:
+                    rpi = i
+                    break
+
+        assert lpi >= 0 and rpi >= 0, (lpi, rpi)
+
+        # Like AsiAlgorithm, parsing continues with what's left inside the
+        # parentheses.
+        node, rest = compile_booleancondition(cond[lpi + 1: rpi] + ' |')
+        if rest:
+            return node, rest
+    for func in (compile_residue, compile_selectstatement):
+        node, rest = func(cond)
+        if rest:
+            return node, rest
+    return None, ''
+
+
+# logicsymbol condition;
+def compile_condition2(cond):
+    if re.search(r'^\s*AND\s*', cond, flags=re.I):
+        logic = 'AND'
+        rest = re.sub(r'^\s*AND\s*', '', cond)
+    elif re.search(r'^\s*OR\s*', cond, flags=re.I):
+        logic = 'OR'
+        rest = re.sub(r'^\s*OR\s*', '', cond)
+    else:
+        return None, None, ''
+    if not rest:
+        return None, None, ''
+    node, rest = compile_condition_term(rest)
+    return logic, node, rest
+
+
+# [originalaminoacid]:amino_acid? integer [mutatedaminoacid]:amino_acid+ |
+# not [originalaminoacid]:amino_acid? Integer [mutatedaminoacid]:amino_acid+ |
+# [originalaminoacid]:amino_acid? integer l_par not [mutatedaminoacid]:amino_acid+ r_par
+def compile_residue(cond):
+    mo_a = re.search(
+        r'^\s*{0}?\s*(\d+)\s*({0}+)(.*)'.format(AMINO_PATTERN),
+        cond)
+    if mo_a:
+        return (ResidueNode(int(mo_a.group(1)), mo_a.group(2)),
+                mo_a.group(3))
+    match = (re.search(
+        r'^\s*(?:NOT|EXCLUDE)\s*{0}?\s*(\d+)\s*({0}+)(.*)'.format(AMINO_PATTERN),
+        cond) or
+        re.search(
+        r'^\s*{0}?\s*(\d+)\s*\(\s*NOT\s*({0}+)\s*\)(.*)'.format(AMINO_PATTERN),
+        cond))
+    if match:
+        return (NotResidueNode(int(match.group(1)), match.group(2)),
+                match.group(3))
+    return None, ''
+
+
+# select selectstatement2
+def compile_selectstatement(cond):
+    if re.search(r'^\s*SELECT\s*', cond, flags=re.I):
+        return compile_selectstatement2(re.sub(r'^\s*SELECT\s*', '', cond))
+    return None, ''
+
+
+# exactly integer from l_par selectlist r_par |
+# atleast integer from l_par selectlist r_par |
+# notmorethan integer from l_par selectlist r_par |
+# atleast [atleastnumber]:integer logicsymbol notmorethan [notmorethannumber]:integer from l_par selectlist r_par
+def compile_selectstatement2(cond):
+    lparen = -1
+    rparen = -1
+    cnt = 0
+    for i in range(0, len(cond)):
+        if cond[i] == '(' and cnt == 0:
+            lparen = i
+            cnt += 1
+        elif cond[i] == '(':
+            cnt += 1
+        elif cond[i] == ')' and cnt == 1:
+            rparen = i
+            cnt -= 1
+            break
+        elif cond[i] == ')':
+            cnt -= 1
+
+    if lparen == -1 or rparen == -1:
+        return None, ''
+
+    residues = compile_selectlist(cond[lparen + 1:rparen] + ' |')
+
+    mo_a = re.search(
+        r'^\s*(EXACTLY\s*(\d+)|ATLEAST\s*(\d+)\s*(AND|OR)\s*'
+        r'NOTMORETHAN\s*(\d+)|ATLEAST\s*(\d+)|NOTMORETHAN\s*(\d+))\s*'
+        r'from\s*\(\s*(.+)\s*\)',
+        cond, flags=re.I)
+    if mo_a is None:
+        raise CompileError('Invalid select statement {!r}.'.format(cond))
+    select_type = mo_a.group(1)
+    if re.search(r'^\s*ATLEAST\s*(\d+)\s*(AND|OR)\s*NOTMORETHAN',
+                 select_type,
+                 flags=re.I):
+        node = SelectNode(residues,
+                          at_least=int(mo_a.group(3)),
+                          at_most=int(mo_a.group(5)),
+                          logic=mo_a.group(4).upper())
+    elif re.search(r'^\s*EXACTLY', select_type, flags=re.I):
+        exactly = int(mo_a.group(2))
+        node = SelectNode(residues, at_least=exactly, at_most=exactly)
+    elif re.search(r'^\s*ATLEAST', select_type, flags=re.I):
+        node = SelectNode(residues, at_least=int(mo_a.group(6)))
+    elif re.search(r'^\s*NOTMORETHAN', select_type, flags=re.I):
+        node = SelectNode(residues, at_most=int(mo_a.group(7)))
+    else:
+        node = SelectNode(residues)
+    return node, cond[rparen + 1:]
+
+
+# residue listitems*
+def compile_selectlist(cond):
+    residues = []
+    node, rest = compile_residue(cond)
+    while rest:
+        residues.append(node)
+        rest = re.sub(r'^\s*,\s*', '', rest)
+        node, rest = compile_residue(rest)
+    return residues
+
+
+# score from l_par scorelist r_par
+def compile_scorecondition(cond):
+    tmp = re.search(r'^\s*score\s*from\s*\((.+)\)\s*|', cond, flags=re.I)
+    if tmp and tmp.group(1):
+        items = compile_scorelist(tmp.group(1) + '|')
+        if items:
+            nodes = [node for node, _ in items]
+            _, rest = items[-1]
+            return ScoreNode(nodes), rest
+    return None, ''
+
+
+# Should actually have a comma before each scoreitem*
+# scoreitem scoreitems*
+# Returns [(node, rest)] for each item.
+def compile_scorelist(cond):
+    items = []
+    node, rest = compile_scoreitem(cond)
+    if rest:
+        items.append((node, rest))
+        while rest:
+            if not re.search(r'^\s*,\s*', rest):
+                break
+            rest = re.sub(r'^\s*,\s*', '', rest)
+            node, rest = compile_scoreitem(rest)
+            if not rest:
+                break
+            items.append((node, rest))
+    return items
+
+
+# booleancondition mapper min? number |
+# max l_par scorelist r_par
+def compile_scoreitem(cond):
+    mo_a = re.search(r'^\s*([^=>]+)\s*=>\s*(min)?\s*(-?\d+\.?\d*)\s*(.+)$',
+                     cond,
+                     flags=re.I)
+    mo_b = re.search(r'^\s*MAX\s*\(', cond, flags=re.I)
+    if mo_b:
+        lparen = -1
+        rparen = -1
+        cnt = 0
+        for i in range(0, len(cond)):
+            if cond[i] == '(' and cnt == 0:
+                lparen = i
+                cnt += 1
+            elif cond[i] == '(':
+                cnt += 1
+            elif cond[i] == ')' and cnt == 1:
+                rparen = i
+                cnt -= 1
+                break
+            elif cond[i] == ')':
+                cnt -= 1
+
+        if lparen == -1 or rparen == -1:
+            return None, ''
+        items = compile_scorelist(cond[lparen + 1: rparen])
+        if items:
+            return MaxNode([node for node, _ in items]), cond[rparen + 1:]
+    elif mo_a:
+        node, rest = compile_booleancondition(mo_a.group(1))
+        if rest:
+            return ScoreItemNode(node, float(mo_a.group(3))), mo_a.group(4)
+    return None, ''
+
+
+class ListMutationsToken:
+    """ A $listMutsIn{...} placeholder in a comment template. """
+    def __init__(self, mutations):
+        """ Initialize.
+
+        :param mutations: [(position_text, aminos)] where aminos is a string
+            of the aminos to list at that position
+        """
+        self.mutations = mutations
+
+    def __repr__(self):
+        return 'ListMutationsToken({!r})'.format(self.mutations)
+
+    def render(self, aaseq, std):
+        final = []
+        for position_text, aminos in self.mutations:
+            position = int(position_text)
+            subs = ''.join(sorted(aa
+                                  for aa in aaseq[position - 1]
+                                  if aa in aminos))
+            if subs:
+                if std is not None:
+                    final.append(std[position - 1] + position_text + subs)
+                else:
+                    final.append(position_text + subs)
+        return ', '.join(final)
+
+
+class CountMutationsToken:
+    """ A $numberOfMutsIn{...} placeholder in a comment template. """
+    def __init__(self, mutations):
+        """ Initialize.
+
+        :param mutations: [(position, aminos)] where aminos is a string of
+            the aminos to count at that position
+        """
+        self.mutations = mutations
+
+    def __repr__(self):
+        return 'CountMutationsToken({!r})'.format(self.mutations)
+
+    def render(self, aaseq, std):
+        count = sum(1
+                    for position, aminos in self.mutations
+                    for aa in aaseq[position - 1]
+                    if aa in aminos)
+        return str(count)
+
+
+class CommentTemplate:
+    """ A comment that is split into literal text and placeholders. """
+    def __init__(self, tokens):
+        """ Initialize.
+
+        :param tokens: a list of literal strings and placeholder tokens
+        """
+        self.tokens = tokens
+        self.has_placeholders = not all(isinstance(token, str)
+                                        for token in tokens)
+        self.has_list = any(isinstance(token, ListMutationsToken)
+                            for token in tokens)
+
+    def __repr__(self):
+        return 'CommentTemplate({!r})'.format(self.tokens)
+
+    def render(self, aaseq, std=None):
+        """ Fill in the placeholders, and clean up the text.
+
+        Gives the same text as AsiAlgorithm.comment_filter().
+        :param aaseq: the list of amino acid lists for each position
+        :param std: the wild-type amino sequence for the region, or None
+        """
+        comment = ''.join(token if isinstance(token, str)
+                          else token.render(aaseq, std)
+                          for token in self.tokens)
+        if self.has_list:
+            comment = comment.replace(' ()', '')  # get rid of empty brackets.
+        comment = comment.replace('  ', ' ')
+        return comment.replace('\uf0b1', '+/-')  # Fixing crazy unicode characters
+
+
+PLACEHOLDER_PATTERN = r'\$(listMutsIn|numberOfMutsIn)\{([^}]+)\}'
+ALL_AMINOS = 'ARNDCEQGHILKMFPSTWYVid'
+
+
+def compile_comment(comment):
+    """ Split a comment template into literal text and placeholders.
+
+    :param str comment: the comment text from the ASI rules
+    :return: a CommentTemplate, or None if the template has something that
+        AsiAlgorithm.comment_filter() can't fill in with a single pass, like
+        two different $listMutsIn{...} placeholders. Those comments have to
+        be rendered with comment_filter().
+    """
+    tokens = []
+    placeholders = {'listMutsIn': set(), 'numberOfMutsIn': set()}
+    start = 0
+    for match in re.finditer(PLACEHOLDER_PATTERN, comment):
+        placeholder_type, content = match.groups()
+        placeholders[placeholder_type].add(content)
+        if placeholder_type == 'listMutsIn':
+            token = compile_list_mutations(content)
+        else:
+            if match.start() == 0 or match.end() == len(comment):
+                return None  # comment_filter() needs text on both sides.
+            token = compile_count_mutations(content)
+        if token is None:
+            return None
+        tokens.append(comment[start:match.start()])
+        tokens.append(token)
+        start = match.end()
+    tokens.append(comment[start:])
+    for token in tokens:
+        if isinstance(token, str) and re.search(r'\$(listMutsIn|numberOfMutsIn)\{',
+                                                token):
+            return None  # Unfinished placeholder
+    if len(tokens) > 1 and '\n' in comment:
+        return None
+    if any(len(contents) > 1 for contents in placeholders.values()):
+        return None
+    return CommentTemplate([token for token in tokens if token != ''])
+
+
+def compile_list_mutations(content):
+    if not re.match(r'^[\w(), ]+$', content):
+        return None  # comment_filter() would treat it as a regex.
+    mutations = []
+    for mutation in content.split(','):
+        not_match = re.match(r'[a-z]?(\d+)\(NOT\s+([a-z]+)\)', mutation, flags=re.I)
+        amino_match = re.match(r'[a-z]?(\d+)([a-z]+)', mutation, flags=re.I)
+        if not_match:
+            aminos = ALL_AMINOS
+            for amino in not_match.group(2):
+                aminos = aminos.replace(amino, '')
+            mutations.append((not_match.group(1), aminos))
+        elif amino_match:
+            mutations.append(amino_match.groups())
+        else:
+            return None
+    return ListMutationsToken(mutations)
+
+
+def compile_count_mutations(content):
+    mutations = []
+    for mutation in content.split(','):
+        match = re.match(r'^(\d+)([a-z]+)$', mutation, flags=re.I)
+        if not match:
+            return None
+        mutations.append((int(match.group(1)), match.group(2)))
+    return CountMutationsToken(mutations)
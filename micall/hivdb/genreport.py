@@ -7,16 +7,14 @@ import os
 from argparse import ArgumentParser, FileType
 import csv
 from collections import defaultdict
-
-import yaml
-
-try:
-    import pdfreport
-except ImportError:
-    import micall.hivdb.pdfreport as pdfreport
+import hashlib
+from itertools import starmap
 
 REPORT_CONFIG_PATH = os.path.join(os.path.dirname(__file__), 'genreport.yaml')
 
+# configurations that were already read in this process: {git_version: cfg_dct}
+loaded_configs = {}
+
 
 def parse_args():
     parser = ArgumentParser(
@@ -35,8 +33,18 @@ resistance call file and a mutations call file, both in csv format""")
     return parser.parse_args()
 
 
+def import_pdfreport():
+    """Import the PDF module on first use, because ReportLab is slow to import."""
+    try:
+        import pdfreport
+    except ImportError:
+        import micall.hivdb.pdfreport as pdfreport
+    return pdfreport
+
+
 def read_config(git_version):
     """Read in a configuration file for generating reports."""
+    import yaml
     cfg_name = REPORT_CONFIG_PATH
     cfg_dct = None
     with open(cfg_name, "r") as fi:
@@ -143,6 +151,19 @@ single dict class, but found a {}""".format(REPORT_CONFIG_PATH, type(cfg_dct)))
     return cfg_dct
 
 
+def get_config(git_version):
+    """Read the configuration file once per process, and return a copy of it.
+    The copy is shallow, because each report only adds its own keys to it.
+    """
+    cfg_dct = loaded_configs.get(git_version)
+    if cfg_dct is None:
+        cfg_dct = read_config(git_version)
+        pdfreport = import_pdfreport()
+        cfg_dct["level_coltab"] = pdfreport.build_level_colours(cfg_dct)
+        loaded_configs[git_version] = cfg_dct
+    return dict(cfg_dct)
+
+
 def read_mutations(cfg_dct, csv_file):
     """Read in a resistence call file from CSV.
     Returns a list of dictionaries.
@@ -263,7 +284,8 @@ def gen_report(resistance_csv,
                mutations_csv,
                res_report_pdf,
                sample_name=None,
-               git_version=None):
+               git_version=None,
+               keywords=''):
     """ Generate a PDF report file.
 
     :param resistance_csv: open CSV file with resistance calls
@@ -271,12 +293,99 @@ def gen_report(resistance_csv,
     :param res_report_pdf: PDF file name to write to
     :param sample_name: name to describe the sample on the report
     :param git_version: source code version to display
+    :param keywords: text to store in the PDF's metadata
     """
-    cfg_dct = read_config(git_version)
+    cfg_dct = get_config(git_version)
     res_lst = read_resistance(cfg_dct, resistance_csv)
     mut_lst = read_mutations(cfg_dct, mutations_csv)
 
-    pdfreport.write_report_one_column(cfg_dct, res_lst, mut_lst, res_report_pdf, sample_name)
+    pdfreport = import_pdfreport()
+    pdfreport.write_report_one_column(cfg_dct,
+                                      res_lst,
+                                      mut_lst,
+                                      res_report_pdf,
+                                      sample_name,
+                                      keywords)
+
+
+def calculate_report_hash(resistance_path,
+                          mutations_path,
+                          sample_name=None,
+                          git_version=None):
+    """ Calculate a hash of everything that goes into a report. """
+    report_hash = hashlib.sha1()
+    for path in (REPORT_CONFIG_PATH, resistance_path, mutations_path):
+        with open(path, 'rb') as f:
+            report_hash.update(f.read())
+        report_hash.update(b'\0')
+    report_hash.update(repr((sample_name, git_version)).encode('utf8'))
+    return report_hash.hexdigest()
+
+
+def is_report_current(report_path, report_hash):
+    """ Check if a report was generated from inputs with the same hash. """
+    try:
+        with open(report_path, 'rb') as report_pdf:
+            return report_hash.encode('ascii') in report_pdf.read()
+    except FileNotFoundError:
+        return False
+
+
+def gen_report_file(resistance_path,
+                    mutations_path,
+                    report_path,
+                    sample_name=None,
+                    git_version=None,
+                    skip_unchanged=False):
+    """ Generate a PDF report file from file paths.
+
+    The hash of the inputs is stored in the PDF's keywords, so the report can
+    be skipped next time if the inputs haven't changed.
+    :return: True if the report was written, False if it was skipped.
+    """
+    report_hash = calculate_report_hash(resistance_path,
+                                        mutations_path,
+                                        sample_name,
+                                        git_version)
+    if skip_unchanged and is_report_current(report_path, report_hash):
+        return False
+    with open(resistance_path) as resistance_csv, \
+            open(mutations_path) as mutations_csv, \
+            open(report_path, 'wb') as report_pdf:
+        gen_report(resistance_csv,
+                   mutations_csv,
+                   report_pdf,
+                   sample_name,
+                   git_version,
+                   keywords=report_hash)
+    return True
+
+
+def gen_reports(report_paths, git_version=None, pool=None, skip_unchanged=False):
+    """ Generate PDF reports for many samples, like all the samples in a run.
+
+    :param report_paths: a list of (resistance_path, mutations_path,
+        report_path, sample_name) for each report
+    :param git_version: source code version to display
+    :param pool: a multiprocessing pool to generate reports in parallel, or
+        None to generate them in this process
+    :param skip_unchanged: True if reports should be left alone when their
+        inputs haven't changed since they were generated
+    :return: the number of reports that were written
+    """
+    args = [(resistance_path,
+             mutations_path,
+             report_path,
+             sample_name,
+             git_version,
+             skip_unchanged)
+            for resistance_path, mutations_path, report_path, sample_name
+            in report_paths]
+    if pool is None:
+        results = list(starmap(gen_report_file, args))
+    else:
+        results = pool.starmap(gen_report_file, args)
+    return sum(results)
 
 
 def main():
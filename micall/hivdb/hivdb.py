@@ -1,17 +1,21 @@
 #! /usr/bin/env python3.4
 import os
 from argparse import ArgumentParser, FileType
+from collections import defaultdict
 from csv import DictReader, DictWriter
 from itertools import groupby
 from operator import itemgetter
 
-from micall.hivdb.asi_algorithm import AsiAlgorithm
+from micall.hivdb.asi_algorithm import load_asi
 from micall.core.aln2counts import AMINO_ALPHABET
 
 MIN_FRACTION = 0.05  # prevalence of mutations to report
 MIN_COVERAGE_SCORE = 4
 REPORTED_REGIONS = {'PR': 'PR', 'RT': 'RT', 'INT': 'IN'}
 RULES_PATH = os.path.join(os.path.dirname(__file__), 'HIVDB_8.3.xml')
+# amino.csv columns to report in amino profiles, and their names in profiles.
+PROFILE_COLUMNS = [amino for amino in AMINO_ALPHABET if amino != '*'] + ['del', 'ins']
+PROFILE_NAMES = PROFILE_COLUMNS[:-2] + ['d', 'i']
 
 
 def parse_args():
@@ -38,8 +42,13 @@ def select_reported_regions(choices, reported_regions):
 
 
 def find_good_regions(original_regions, coverage_scores_csv):
+    return find_good_regions_in_rows(original_regions,
+                                     DictReader(coverage_scores_csv))
+
+
+def find_good_regions_in_rows(original_regions, coverage_rows):
     good_regions = {region: [name, False] for region, name in original_regions.items()}
-    for row in DictReader(coverage_scores_csv):
+    for row in coverage_rows:
         score = int(row['on.score'])
         region_code = row['region']
         region = good_regions.get(region_code)
@@ -48,15 +57,39 @@ def find_good_regions(original_regions, coverage_scores_csv):
     return good_regions
 
 
-def read_aminos(amino_csv, min_fraction, reported_regions=None):
-    coverage_columns = list(AMINO_ALPHABET) + ['del']
-    report_names = coverage_columns[:]
-    report_names[-1] = 'd'
+def read_aminos(amino_csv,
+                min_fraction,
+                reported_regions=None,
+                region_positions=None):
+    return read_amino_rows(DictReader(amino_csv),
+                           min_fraction,
+                           reported_regions,
+                           region_positions)
+
+
+def read_amino_rows(amino_rows,
+                    min_fraction,
+                    reported_regions=None,
+                    region_positions=None):
+    """ Build amino profiles for each region from amino.csv rows.
+
+    :param amino_rows: dictionaries with the columns of amino.csv
+    :param min_fraction: the minimum fraction of coverage for an amino to
+        be reported
+    :param reported_regions: {region: [translated_region, is_reported]}, or
+        None to report all regions with their original names
+    :param region_positions: {translated_region: positions} to build
+        profiles for, or None for all positions. Other positions just get
+        empty dictionaries, so only pass the positions that get used, like
+        AsiAlgorithm.get_referenced_positions().
+    :return: a generator of (translated_region, aminos), where aminos is a
+        list of {amino: fraction} for each position, or None if the region
+        isn't reported.
+    """
     missing_regions = set()
     if reported_regions:
         missing_regions.update(reported_regions.keys())
-    for region, rows in groupby(DictReader(amino_csv),
-                                itemgetter('region')):
+    for region, rows in groupby(amino_rows, itemgetter('region')):
         if reported_regions is None:
             translated_region = region
         else:
@@ -68,19 +101,13 @@ def read_aminos(amino_csv, min_fraction, reported_regions=None):
             if not is_reported:
                 yield translated_region, None
                 continue
-        aminos = []
-        for row in rows:
-            counts = list(map(int, (row[f] for f in coverage_columns)))
-            coverage = int(row['coverage'])
-            min_count = max(1, coverage * min_fraction)  # needs at least 1
-            pos_aminos = {report_names[i]: count/coverage
-                          for i, count in enumerate(counts)
-                          if count >= min_count and report_names[i] != '*'}
-            ins_count = int(row['ins'])
-            if ins_count >= min_count:
-                pos_aminos['i'] = ins_count / coverage
-            aminos.append(pos_aminos)
-        yield translated_region, aminos
+        if region_positions is None:
+            positions = None
+        else:
+            positions = region_positions.get(translated_region)
+        yield translated_region, build_amino_profiles(list(rows),
+                                                      min_fraction,
+                                                      positions)
     for region in missing_regions:
         if reported_regions is None:
             translated_region = region
@@ -89,53 +116,133 @@ def read_aminos(amino_csv, min_fraction, reported_regions=None):
         yield translated_region, None
 
 
-def write_insufficient_data(resistance_writer, region, asi):
+def build_amino_profiles(rows, min_fraction, positions=None):
+    """ Calculate the fractions of each amino in a region's rows.
+
+    :param rows: dictionaries with the columns of amino.csv, one per position
+    :param min_fraction: the minimum fraction of coverage for an amino to
+        be reported
+    :param positions: the positions to build profiles for, starting at 1,
+        or None for all positions. Other positions get empty dictionaries.
+    :return: a list of {amino: fraction} for each position, where deletions
+        are 'd' and insertions are 'i'.
+    """
+    aminos = [{} for _ in rows]
+    if not rows:
+        return aminos
+    import numpy as np  # slow to import, and only needed for profiles
+    counts = np.array(list(map(itemgetter(*PROFILE_COLUMNS), rows)),
+                      dtype=np.int64)
+    coverage = np.array(list(map(itemgetter('coverage'), rows)),
+                        dtype=np.int64)
+    min_counts = np.maximum(1, coverage * min_fraction)  # needs at least 1
+    is_reported = counts >= min_counts[:, None]
+    if positions is not None:
+        is_selected = np.zeros(len(rows), dtype=bool)
+        is_selected[[position - 1
+                     for position in positions
+                     if position <= len(rows)]] = True
+        is_reported &= is_selected[:, None]
+    row_indexes, amino_indexes = np.nonzero(is_reported)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        fractions = counts[row_indexes, amino_indexes] / coverage[row_indexes]
+    for i, j, fraction in zip(row_indexes.tolist(),
+                              amino_indexes.tolist(),
+                              fractions.tolist()):
+        aminos[i][PROFILE_NAMES[j]] = fraction
+    return aminos
+
+
+def get_insufficient_data(region, asi):
     drug_classes = asi.gene_def[region]
     for drug_class in drug_classes:
         for drug_code in asi.drug_class[drug_class]:
             drug_name = asi.drugs[drug_code][0]
-            resistance_writer.writerow(dict(region=region,
-                                            drug_class=drug_class,
-                                            drug=drug_code,
-                                            drug_name=drug_name,
-                                            level_name='Insufficient data available',
-                                            level=0,
-                                            score=0.0))
+            yield dict(region=region,
+                       drug_class=drug_class,
+                       drug=drug_code,
+                       drug_name=drug_name,
+                       level_name='Insufficient data available',
+                       level=0,
+                       score=0.0)
 
 
-def write_resistance(aminos, resistance_csv, mutations_csv):
-    resistance_writer = DictWriter(
-        resistance_csv,
-        ['region', 'drug_class', 'drug', 'drug_name', 'level', 'level_name', 'score'],
-        lineterminator=os.linesep)
-    resistance_writer.writeheader()
-    mutations_writer = DictWriter(mutations_csv,
-                                  ['drug_class', 'mutation', 'prevalence'],
-                                  lineterminator=os.linesep)
-    mutations_writer.writeheader()
-    asi = AsiAlgorithm(RULES_PATH)
+def calculate_resistance(aminos, asi):
+    """ Make resistance calls for one sample's regions.
+
+    :param aminos: a sequence of (region, amino_seq) pairs, from read_aminos()
+    :param asi: the AsiAlgorithm to interpret the amino sequences with
+    :return: (resistance_rows, mutation_rows), two lists of dictionaries
+        that match the columns of resistance.csv and mutations.csv
+    """
+    resistance_rows = []
+    mutation_rows = []
     for region, amino_seq in aminos:
         if amino_seq is None:
-            write_insufficient_data(resistance_writer, region, asi)
+            resistance_rows.extend(get_insufficient_data(region, asi))
             continue
         result = asi.interpret(amino_seq, region)
         for drug_result in result.drugs:
-            resistance_writer.writerow(dict(region=region,
-                                            drug_class=drug_result.drug_class,
-                                            drug=drug_result.code,
-                                            drug_name=drug_result.name,
-                                            level_name=drug_result.level_name,
-                                            level=drug_result.level,
-                                            score=drug_result.score))
+            resistance_rows.append(dict(region=region,
+                                        drug_class=drug_result.drug_class,
+                                        drug=drug_result.code,
+                                        drug_name=drug_result.name,
+                                        level_name=drug_result.level_name,
+                                        level=drug_result.level,
+                                        score=drug_result.score))
         for drug_class, class_mutations in result.mutations.items():
             for mutation in class_mutations:
                 amino = mutation[-1]
                 pos = int(mutation[1:-1])
                 pos_aminos = amino_seq[pos-1]
                 prevalence = pos_aminos[amino]
-                mutations_writer.writerow(dict(drug_class=drug_class,
-                                               mutation=mutation,
-                                               prevalence=prevalence))
+                mutation_rows.append(dict(drug_class=drug_class,
+                                          mutation=mutation,
+                                          prevalence=prevalence))
+    return resistance_rows, mutation_rows
+
+
+def create_writers(resistance_csv, mutations_csv, extra_columns=()):
+    resistance_writer = DictWriter(
+        resistance_csv,
+        list(extra_columns) + ['region', 'drug_class', 'drug', 'drug_name',
+                               'level', 'level_name', 'score'],
+        lineterminator=os.linesep)
+    resistance_writer.writeheader()
+    mutations_writer = DictWriter(
+        mutations_csv,
+        list(extra_columns) + ['drug_class', 'mutation', 'prevalence'],
+        lineterminator=os.linesep)
+    mutations_writer.writeheader()
+    return resistance_writer, mutations_writer
+
+
+def write_resistance(aminos, resistance_csv, mutations_csv):
+    resistance_writer, mutations_writer = create_writers(resistance_csv,
+                                                         mutations_csv)
+    asi = load_asi(RULES_PATH)
+    resistance_rows, mutation_rows = calculate_resistance(aminos, asi)
+    resistance_writer.writerows(resistance_rows)
+    mutations_writer.writerows(mutation_rows)
+
+
+def calculate_sample_resistance(sample_aminos):
+    """ Make resistance calls for one sample in a run.
+
+    This is a top-level function so it can run in a process pool. Each
+    process loads the rules once, and shares them between samples.
+    :param sample_aminos: (sample_name, aminos), where aminos is a list of
+        (region, amino_seq) pairs, from read_aminos()
+    :return: (resistance_rows, mutation_rows), with a sample column
+    """
+    sample_name, aminos = sample_aminos
+    asi = load_asi(RULES_PATH)
+    resistance_rows, mutation_rows = calculate_resistance(aminos, asi)
+    for row in resistance_rows:
+        row['sample'] = sample_name
+    for row in mutation_rows:
+        row['sample'] = sample_name
+    return resistance_rows, mutation_rows
 
 
 def hivdb(amino_csv,
@@ -148,10 +255,71 @@ def hivdb(amino_csv,
     else:
         selected_regions = select_reported_regions(region_choices, REPORTED_REGIONS)
     good_regions = find_good_regions(selected_regions, coverage_scores_csv)
-    aminos = read_aminos(amino_csv, MIN_FRACTION, good_regions)
+    aminos = read_aminos(amino_csv,
+                         MIN_FRACTION,
+                         good_regions,
+                         get_referenced_positions())
     write_resistance(aminos, resistance_csv, mutations_csv)
 
 
+def get_referenced_positions():
+    """ Find the positions that the resistance rules use in each region. """
+    asi = load_asi(RULES_PATH)
+    return {region: asi.get_referenced_positions(region)
+            for region in asi.gene_def}
+
+
+def hivdb_run(amino_csv,
+              coverage_scores_csv,
+              resistance_csv,
+              mutations_csv,
+              region_choices=None,
+              pool=None):
+    """ Make resistance calls for all the samples in a run.
+
+    The input files are the run-level files that have a sample column, and
+    the output files get a sample column, too. This can recalculate the
+    resistance calls for old runs when the rules change.
+    :param amino_csv: amino counts for all samples, grouped by sample
+    :param coverage_scores_csv: coverage scores for all samples
+    :param resistance_csv: open file to write resistance calls to
+    :param mutations_csv: open file to write relevant mutations to
+    :param region_choices: regions to report for all samples, or None to
+        report all regions
+    :param pool: a multiprocessing pool to calculate samples in parallel, or
+        None to calculate them in this process
+    """
+    if region_choices is None:
+        selected_regions = REPORTED_REGIONS
+    else:
+        selected_regions = select_reported_regions(region_choices, REPORTED_REGIONS)
+    coverage_rows = defaultdict(list)
+    for row in DictReader(coverage_scores_csv):
+        coverage_rows[row['sample']].append(row)
+    region_positions = get_referenced_positions()
+    all_sample_aminos = (
+        (sample_name,
+         list(read_amino_rows(
+             rows,
+             MIN_FRACTION,
+             find_good_regions_in_rows(selected_regions,
+                                       coverage_rows[sample_name]),
+             region_positions)))
+        for sample_name, rows in groupby(DictReader(amino_csv),
+                                         itemgetter('sample')))
+    if pool is None:
+        sample_results = map(calculate_sample_resistance, all_sample_aminos)
+    else:
+        sample_results = pool.imap(calculate_sample_resistance,
+                                   all_sample_aminos)
+    resistance_writer, mutations_writer = create_writers(resistance_csv,
+                                                         mutations_csv,
+                                                         ['sample'])
+    for resistance_rows, mutation_rows in sample_results:
+        resistance_writer.writerows(resistance_rows)
+        mutations_writer.writerows(mutation_rows)
+
+
 def main():
     args = parse_args()
     hivdb(args.aminos_csv,
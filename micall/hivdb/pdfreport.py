@@ -31,6 +31,17 @@ mut_txt_style = ParagraphStyle("sconormal",
                                leading=TAB_FONT_SIZE,
                                fontName='Helvetica-Oblique')
 
+# The rest of the styles are also the same for every report, so build them once.
+small_print_style = ParagraphStyle("small",
+                                   fontSize=SMALL_PRINT_FONT_SIZE,
+                                   leading=SMALL_PRINT_FONT_SIZE-1)
+test_details_style = ParagraphStyle("small",
+                                    fontSize=TAB_FONT_SIZE,
+                                    leading=TAB_FONT_SIZE-1)
+title_style = ParagraphStyle("scotitle", alignment=TA_CENTER, fontSize=20)
+research_style = ParagraphStyle("scored", fontSize=15, textColor=colors.red,
+                                spaceBefore=5 * mm, spaceAfter=5 * mm)
+
 
 def get_now_string():
     """Return the date and time in the configured time zone as a string"""
@@ -42,18 +53,31 @@ def get_now_string():
 
 def bottom_para(txt):
     "Set the provided text into a form for the small print"
-    small_style = ParagraphStyle("small",
-                                 fontSize=SMALL_PRINT_FONT_SIZE,
-                                 leading=SMALL_PRINT_FONT_SIZE-1)
-    return plat.Paragraph(txt, small_style)
+    return plat.Paragraph(txt, small_print_style)
 
 
 def test_details_para(txt):
     "Set the provided text into a form for the test details"
-    small_style = ParagraphStyle("small",
-                                 fontSize=TAB_FONT_SIZE,
-                                 leading=TAB_FONT_SIZE-1)
-    return plat.Paragraph(txt, small_style)
+    return plat.Paragraph(txt, test_details_style)
+
+
+def build_level_colours(cfg_dct):
+    """Convert the configured resistance level colours into ReportLab colours.
+    Returns a dict: level -> (background colour, foreground colour)
+    """
+    col_tab = cfg_dct["resistance_level_colours"]
+    return dict([(k, (colors.HexColor(v[1]), colors.HexColor(v[2])))
+                 for k, v in col_tab.items()])
+
+
+def get_level_colours(cfg_dct):
+    """Return the level colours that were already built for this configuration,
+    or build them now.
+    """
+    level_coltab = cfg_dct.get("level_coltab")
+    if level_coltab is None:
+        level_coltab = build_level_colours(cfg_dct)
+    return level_coltab
 
 
 def headertab_style(row_offset, colnum, dospan):
@@ -149,26 +173,23 @@ def top_table(sample_name, table_width):
                       hAlign="CENTRE")
 
 
-def write_report_two_columns(cfg_dct, res_lst, mut_lst, fname, sample_name=None):
+def write_report_two_columns(cfg_dct, res_lst, mut_lst, fname, sample_name=None, keywords=''):
     """Generate a PDF report to a given output file name
+    keywords: stored in the PDF's metadata
     """
-    col_tab = cfg_dct["resistance_level_colours"]
-    level_coltab = dict([(k, (colors.HexColor(v[1]), colors.HexColor(v[2])))
-                         for k, v in col_tab.items()])
+    level_coltab = get_level_colours(cfg_dct)
     doc = plat.SimpleDocTemplate(
         fname,
         pagesize=letter,
         title="basespace HIV drug resistance genotype report",
-        author="BCCfE in HIV/AIDS")
+        author="BCCfE in HIV/AIDS",
+        keywords=keywords)
     # get the actual text width, (not the page width):
     txt_w = page_w - doc.leftMargin - doc.rightMargin
     w_half, top_table_col_width = txt_w * 0.5, txt_w / 3.3333
     doc_els = [plat.Spacer(1, 1.5 * cm)]
-    ti_style = ParagraphStyle("scotitle", alignment=TA_CENTER, fontSize=20)
-    doc_els.append(plat.Paragraph(cfg_dct["report_title"], ti_style))
-    re_style = ParagraphStyle("scored", fontSize=15, textColor=colors.red,
-                              spaceBefore=5 * mm, spaceAfter=5 * mm)
-    doc_els.append(plat.Paragraph("For research use only", re_style))
+    doc_els.append(plat.Paragraph(cfg_dct["report_title"], title_style))
+    doc_els.append(plat.Paragraph("For research use only", research_style))
     # -- top table
     doc_els.append(top_table(sample_name, top_table_col_width))
     lc, rc = 0, 1
@@ -207,27 +228,24 @@ def write_report_two_columns(cfg_dct, res_lst, mut_lst, fname, sample_name=None)
     doc.build(doc_els)
 
 
-def write_report_one_column(cfg_dct, res_lst, mut_lst, fname, sample_name=None):
+def write_report_one_column(cfg_dct, res_lst, mut_lst, fname, sample_name=None, keywords=''):
     """Generate a PDF report to a given output file name
+    keywords: stored in the PDF's metadata
     """
-    col_tab = cfg_dct["resistance_level_colours"]
-    level_coltab = dict([(k, (colors.HexColor(v[1]), colors.HexColor(v[2])))
-                         for k, v in col_tab.items()])
+    level_coltab = get_level_colours(cfg_dct)
     doc = plat.SimpleDocTemplate(
         fname,
         pagesize=letter,
         topMargin=1 * cm,
         title="basespace drug resistance report",
-        author="BCCfE")
+        author="BCCfE",
+        keywords=keywords)
     # get the actual text width, (not the page width):
     txt_w = page_w - doc.leftMargin - doc.rightMargin
     table_width = txt_w - 1 * cm
     doc_els = []
-    ti_style = ParagraphStyle("scotitle", alignment=TA_CENTER, fontSize=20)
-    doc_els.append(plat.Paragraph(cfg_dct["report_title"], ti_style))
-    re_style = ParagraphStyle("scored", fontSize=15, textColor=colors.red,
-                              spaceBefore=5 * mm, spaceAfter=5 * mm)
-    doc_els.append(plat.Paragraph("For research use only", re_style))
+    doc_els.append(plat.Paragraph(cfg_dct["report_title"], title_style))
+    doc_els.append(plat.Paragraph("For research use only", research_style))
     # -- top table
     doc_els.append(top_table(sample_name, table_width))
     # now drug classes tables, two per line
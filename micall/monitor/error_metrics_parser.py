@@ -1,10 +1,22 @@
 from struct import unpack
 import csv
+from io import UnsupportedOperation
+import mmap
 import os
-from operator import itemgetter
 import sys
-import math
-from itertools import groupby
+
+import numpy as np
+
+# Fields at the start of each error metrics record, later versions add more.
+ERROR_FIELDS = [('lane', '<u2'),
+                ('tile', '<u2'),
+                ('cycle', '<u2'),
+                ('error_rate', '<f4'),
+                ('num_0_errors', '<u4'),
+                ('num_1_error', '<u4'),
+                ('num_2_errors', '<u4'),
+                ('num_3_errors', '<u4'),
+                ('num_4_errors', '<u4')]
 
 
 def read_records(data_file, min_version):
@@ -36,6 +48,85 @@ def read_records(data_file, min_version):
         yield data
 
 
+def read_record_array(data_file, min_version, fields):
+    """ Read all the records from an Illumina Interop file into an array.
+
+    Regular files are memory-mapped, so the records are decoded without
+    copying them.
+    :param file data_file: an open file-like object. Needs to have a two-byte
+    header with the file version and the length of each record, followed by the
+    records.
+    :param int min_version: the minimum accepted file version.
+    :param fields: a list of (name, dtype) fields at the start
+    of each record. Any other bytes at the end of each record are ignored.
+    :return: a structured NumPy array with one entry for each record
+    """
+    header = data_file.read(2)
+    version, record_length = unpack('!BB', header)
+    file_name = getattr(data_file, 'name', None)
+    if version < min_version:
+        raise IOError(
+            'File version {} is less than minimum version {} in {}.'.format(
+                version,
+                min_version,
+                file_name))
+    record_type = np.dtype(fields)
+    if record_type.itemsize > record_length:
+        raise IOError('Record length {} is less than {} in {}.'.format(
+            record_length,
+            record_type.itemsize,
+            file_name))
+    record_type = np.dtype(dict(names=record_type.names,
+                                formats=[record_type.fields[name][0]
+                                         for name in record_type.names],
+                                offsets=[record_type.fields[name][1]
+                                         for name in record_type.names],
+                                itemsize=record_length))
+    try:
+        file_size = os.fstat(data_file.fileno()).st_size
+    except (AttributeError, UnsupportedOperation):
+        file_size = None
+    if file_size is None or file_size <= len(header):
+        data = data_file.read()
+        offset = 0
+    else:
+        # The array keeps a reference to the map, so it stays open.
+        data = mmap.mmap(data_file.fileno(), 0, access=mmap.ACCESS_READ)
+        offset = len(header)
+    data_length = len(data) - offset
+    partial_length = data_length % record_length
+    if partial_length:
+        raise IOError('Partial record of length {} found in {}.'.format(
+            partial_length,
+            file_name))
+    return np.frombuffer(data,
+                         dtype=record_type,
+                         count=data_length // record_length,
+                         offset=offset)
+
+
+def build_record_array(records, fields):
+    """ Build a record array from dictionaries, like those from read_errors().
+
+    :param records: a sequence of dictionaries
+    :param fields: a list of (name, dtype) fields to copy from each record
+    :return: a structured NumPy array with one entry for each record
+    """
+    names = [field[0] for field in fields]
+    return np.array([tuple(record[name] for name in names)
+                     for record in records],
+                    dtype=fields)
+
+
+def read_error_array(data_file):
+    """ Read error rate data from a phiX data file into an array.
+
+    :param file data_file: an open file-like object, like for read_errors()
+    :return: a structured NumPy array with the fields in ERROR_FIELDS
+    """
+    return read_record_array(data_file, min_version=3, fields=ERROR_FIELDS)
+
+
 def read_errors(data_file):
     """ Read error rate data from a phiX data file.
 
@@ -54,37 +145,9 @@ def read_errors(data_file):
     - num_3_errors [uint32]
     - num_4_errors [uint32]
     """
-    PARSED_LENGTH = 30
-    for data in read_records(data_file, min_version=3):
-        fields = unpack('<HHHfLLLLL', data[:PARSED_LENGTH])
-        yield dict(lane=fields[0],
-                   tile=fields[1],
-                   cycle=fields[2],
-                   error_rate=fields[3],
-                   num_0_errors=fields[4],
-                   num_1_error=fields[5],
-                   num_2_errors=fields[6],
-                   num_3_errors=fields[7],
-                   num_4_errors=fields[8])
-
-
-def _yield_cycles(records, read_lengths):
-    sorted_records = sorted(map(itemgetter('tile', 'cycle', 'error_rate'),
-                                records))
-    max_forward_cycle = read_lengths and read_lengths[0] or sys.maxsize
-    min_reverse_cycle = read_lengths and sum(read_lengths[:-1])+1 or sys.maxsize
-    for record in sorted_records:
-        cycle = record[1]
-        if cycle >= min_reverse_cycle:
-            cycle = min_reverse_cycle - cycle - 1
-            yield record[0], cycle, record[2]
-        elif cycle <= max_forward_cycle:
-            yield record
-
-
-def _record_grouper(record):
-    # Group by tile and sign of cycle (forward or reverse).
-    return (record[0], int(math.copysign(1, record[1])))
+    names = [name for name, _ in ERROR_FIELDS]
+    for fields in read_error_array(data_file).tolist():
+        yield dict(zip(names, fields))
 
 
 def write_phix_csv(out_file, records, read_lengths=None, summary=None):
@@ -100,33 +163,88 @@ def write_phix_csv(out_file, records, read_lengths=None, summary=None):
     :param dict summary: a dictionary to hold the summary values:
     error_rate_fwd and error_rate_rev.
     """
+    errors = build_record_array(records, [('tile', '<u2'),
+                                          ('cycle', '<u2'),
+                                          ('error_rate', '<f8')])
+    write_phix_array(out_file, errors, read_lengths, summary)
+
+
+def map_cycles(errors, read_lengths=None):
+    """ Sort error records, and number reverse cycles from -1.
+
+    :param errors: a structured array like the one from read_error_array()
+    :param read_lengths: a list of lengths for each type of read: forward,
+    indexes, and reverse. Index cycles are left out.
+    :return: (tiles, cycles, error_rates), three arrays sorted by tile and
+    original cycle, where reverse cycles are negative.
+    """
+    tiles = errors['tile']
+    cycles = errors['cycle'].astype(np.int64)
+    error_rates = errors['error_rate']
+    sort_order = np.lexsort((error_rates, cycles, tiles))
+    tiles = tiles[sort_order]
+    cycles = cycles[sort_order]
+    error_rates = error_rates[sort_order]
+
+    max_forward_cycle = read_lengths and read_lengths[0] or sys.maxsize
+    min_reverse_cycle = read_lengths and sum(read_lengths[:-1])+1 or sys.maxsize
+    is_reverse = cycles >= min_reverse_cycle
+    is_kept = is_reverse | (cycles <= max_forward_cycle)
+    cycles[is_reverse] = min_reverse_cycle - cycles[is_reverse] - 1
+    return tiles[is_kept], cycles[is_kept], error_rates[is_kept]
+
+
+def write_phix_array(out_file, errors, read_lengths=None, summary=None):
+    """ Write phiX error rate data from an array to a CSV file.
+
+    Same as write_phix_csv(), but the records are a structured array like
+    the one from read_error_array(). Only the tile, cycle, and error_rate
+    fields are used.
+    """
     writer = csv.writer(out_file, lineterminator=os.linesep)
     writer.writerow(['tile', 'cycle', 'errorrate'])
 
-    error_sums = [0.0, 0.0]
-    error_counts = [0, 0]
-    for (_tile, sign), group in groupby(_yield_cycles(records, read_lengths),
-                                        _record_grouper):
+    tiles, cycles, error_rates = map_cycles(errors, read_lengths)
+    signs = np.where(cycles < 0, -1, 1)
+
+    # Group by tile and sign of cycle (forward or reverse).
+    group_starts = np.flatnonzero(np.concatenate((
+        [tiles.size > 0],
+        (tiles[1:] != tiles[:-1]) | (signs[1:] != signs[:-1]))))
+    group_ends = np.append(group_starts[1:], tiles.size)
+    tiles = tiles.tolist()
+    cycles = cycles.tolist()
+    error_rates_list = error_rates.tolist()
+    for start, end in zip(group_starts.tolist(), group_ends.tolist()):
+        sign = 1 if cycles[start] >= 0 else -1
         previous_cycle = 0
-        for record in group:
-            cycle = record[1]
+        for tile, cycle, error_rate in zip(tiles[start:end],
+                                           cycles[start:end],
+                                           error_rates_list[start:end]):
             previous_cycle += sign
-            while previous_cycle*sign < cycle*sign:
-                writer.writerow((record[0], previous_cycle))
-                previous_cycle += sign
-            writer.writerow(record)
-            summary_index = (sign+1) // 2
-            error_sums[summary_index] += record[2]
-            error_counts[summary_index] += 1
+            if previous_cycle*sign < cycle*sign:
+                writer.writerows((tile, missing_cycle)
+                                 for missing_cycle in range(previous_cycle,
+                                                            cycle,
+                                                            sign))
+                previous_cycle = cycle
+            writer.writerow((tile, cycle, error_rate))
         if read_lengths:
             read_length = read_lengths[0] if sign == 1 else -read_lengths[-1]
-            while previous_cycle*sign < read_length*sign:
-                previous_cycle += sign
-                writer.writerow((record[0], previous_cycle))
-    if error_counts[1] > 0 and summary is not None:
-        summary['error_rate_fwd'] = error_sums[1]/error_counts[1]
-    if error_counts[0] > 0 and summary is not None:
-        summary['error_rate_rev'] = error_sums[0]/error_counts[0]
+            if previous_cycle*sign < read_length*sign:
+                writer.writerows((tile, missing_cycle)
+                                 for missing_cycle in range(
+                                     previous_cycle + sign,
+                                     read_length + sign,
+                                     sign))
+    if summary is not None:
+        is_forward = signs > 0
+        if is_forward.any():
+            summary['error_rate_fwd'] = float(
+                error_rates[is_forward].mean(dtype=np.float64))
+        if not is_forward.all():
+            summary['error_rate_rev'] = float(
+                error_rates[~is_forward].mean(dtype=np.float64))
 
 if __name__ == '__live_coding__':
     import unittest
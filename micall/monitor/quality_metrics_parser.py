@@ -1,6 +1,21 @@
-from struct import unpack
+import numpy as np
 
-from micall.monitor.error_metrics_parser import read_records
+from micall.monitor.error_metrics_parser import read_record_array, \
+    build_record_array
+
+QUALITY_FIELDS = [('lane', '<u2'),
+                  ('tile', '<u2'),
+                  ('cycle', '<u2'),
+                  ('quality_bins', '<u4', 50)]
+
+
+def read_quality_array(data_file):
+    """ Read a quality metrics data file into an array.
+
+    :param file data_file: an open file-like object, like for read_quality()
+    :return: a structured NumPy array with the fields in QUALITY_FIELDS
+    """
+    return read_record_array(data_file, min_version=4, fields=QUALITY_FIELDS)
 
 
 def read_quality(data_file):
@@ -16,14 +31,16 @@ def read_quality(data_file):
     - cycle [uint16]
     - quality_bins [list of 50 uint32, representing quality 1 to 50]
     """
-    PARSED_LENGTH = 206
-    format_string = '<HHH' + 'L'*50
-    for data in read_records(data_file, min_version=4):
-        fields = unpack(format_string, data[:PARSED_LENGTH])
-        yield dict(lane=fields[0],
-                   tile=fields[1],
-                   cycle=fields[2],
-                   quality_bins=fields[3:])
+    records = read_quality_array(data_file)
+    for lane, tile, cycle, quality_bins in zip(
+            records['lane'].tolist(),
+            records['tile'].tolist(),
+            records['cycle'].tolist(),
+            records['quality_bins'].tolist()):
+        yield dict(lane=lane,
+                   tile=tile,
+                   cycle=cycle,
+                   quality_bins=tuple(quality_bins))
 
 
 def summarize_quality_records(records, summary, read_lengths=None):
@@ -36,24 +53,33 @@ def summarize_quality_records(records, summary, read_lengths=None):
     :param list read_lengths: a list of lengths for each type of read: forward,
     indexes, and reverse
     """
-    good_count = total_count = 0
-    good_reverse = total_reverse = 0
+    quality_records = build_record_array(records, [('cycle', '<u2'),
+                                                   ('quality_bins', '<u4', 50)])
+    summarize_quality_array(quality_records, summary, read_lengths)
+
+
+def summarize_quality_array(records, summary, read_lengths=None):
+    """ Calculate the portion of clusters and cycles with quality >= 30.
+
+    Same as summarize_quality_records(), but the records are a structured
+    array like the one from read_quality_array().
+    """
+    cycles = records['cycle']
+    quality_bins = records['quality_bins']
+    cycle_clusters = quality_bins.sum(axis=1, dtype=np.int64)
+    cycle_good = quality_bins[:, 29:].sum(axis=1, dtype=np.int64)
     if read_lengths is None:
-        last_forward_cycle = first_reverse_cycle = None
+        is_forward = np.ones(cycles.shape, dtype=bool)
+        is_reverse = np.zeros(cycles.shape, dtype=bool)
     else:
         last_forward_cycle = read_lengths[0]
         first_reverse_cycle = sum(read_lengths[:-1]) + 1
-    for record in records:
-        cycle = record['cycle']
-        cycle_clusters = sum(record['quality_bins'])
-        cycle_good = sum(record['quality_bins'][29:])
-
-        if last_forward_cycle is None or cycle <= last_forward_cycle:
-            total_count += cycle_clusters
-            good_count += cycle_good
-        elif cycle >= first_reverse_cycle:
-            total_reverse += cycle_clusters
-            good_reverse += cycle_good
+        is_forward = cycles <= last_forward_cycle
+        is_reverse = ~is_forward & (cycles >= first_reverse_cycle)
+    total_count = int(cycle_clusters[is_forward].sum())
+    good_count = int(cycle_good[is_forward].sum())
+    total_reverse = int(cycle_clusters[is_reverse].sum())
+    good_reverse = int(cycle_good[is_reverse].sum())
 
     if total_count > 0:
         summary['q30_fwd'] = good_count/float(total_count)
@@ -64,8 +90,8 @@ def summarize_quality_records(records, summary, read_lengths=None):
 def summarize_quality(filename, summary, read_lengths=None):
     """ Summarize the records from a quality metrics file. """
     with open(filename, 'rb') as data_file:
-        records = read_quality(data_file)
-        summarize_quality_records(records, summary, read_lengths)
+        records = read_quality_array(data_file)
+        summarize_quality_array(records, summary, read_lengths)
 
 if __name__ == '__live_coding__':
     import unittest
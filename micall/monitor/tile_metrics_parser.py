@@ -1,6 +1,12 @@
-from struct import unpack
+import numpy as np
 
-from micall.monitor.error_metrics_parser import read_records
+from micall.monitor.error_metrics_parser import read_record_array, \
+    build_record_array
+
+TILE_FIELDS = [('lane', '<u2'),
+               ('tile', '<u2'),
+               ('metric_code', '<u2'),
+               ('metric_value', '<f4')]
 
 
 class MetricCodes(object):
@@ -17,6 +23,15 @@ class MetricCodes(object):
     CLUSTER_COUNT_PASSING_FILTERS = 103
 
 
+def read_tile_array(data_file):
+    """ Read a tile metrics data file into an array.
+
+    :param file data_file: an open file-like object, like for read_tiles()
+    :return: a structured NumPy array with the fields in TILE_FIELDS
+    """
+    return read_record_array(data_file, min_version=2, fields=TILE_FIELDS)
+
+
 def read_tiles(data_file):
     """ Read a tile metrics data file.
 
@@ -30,14 +45,9 @@ def read_tiles(data_file):
     - metric_code [uint16]
     - metric_value [float32]
     """
-    PARSED_LENGTH = 10
-    format_string = '<HHHf'
-    for data in read_records(data_file, min_version=2):
-        fields = unpack(format_string, data[:PARSED_LENGTH])
-        yield dict(lane=fields[0],
-                   tile=fields[1],
-                   metric_code=fields[2],
-                   metric_value=fields[3])
+    names = [name for name, _ in TILE_FIELDS]
+    for fields in read_tile_array(data_file).tolist():
+        yield dict(zip(names, fields))
 
 
 def summarize_tile_records(records, summary):
@@ -47,20 +57,27 @@ def summarize_tile_records(records, summary):
     :param dict summary: a dictionary to hold the summary values:
     cluster_density and pass_rate.
     """
-    density_sum = 0.0
-    density_count = 0
-    total_clusters = 0.0
-    passing_clusters = 0.0
-    for record in records:
-        if record['metric_code'] == MetricCodes.CLUSTER_DENSITY:
-            density_sum += record['metric_value']
-            density_count += 1
-        elif record['metric_code'] == MetricCodes.CLUSTER_COUNT:
-            total_clusters += record['metric_value']
-        elif record['metric_code'] == MetricCodes.CLUSTER_COUNT_PASSING_FILTERS:
-            passing_clusters += record['metric_value']
-    if density_count > 0:
-        summary['cluster_density'] = density_sum/density_count
+    tile_records = build_record_array(records, [('metric_code', '<u2'),
+                                                ('metric_value', '<f8')])
+    summarize_tile_array(tile_records, summary)
+
+
+def summarize_tile_array(records, summary):
+    """ Summarize the records from a tile metrics file.
+
+    Same as summarize_tile_records(), but the records are a structured
+    array like the one from read_tile_array().
+    """
+    metric_codes = records['metric_code']
+    metric_values = records['metric_value']
+    densities = metric_values[metric_codes == MetricCodes.CLUSTER_DENSITY]
+    total_clusters = float(metric_values[
+        metric_codes == MetricCodes.CLUSTER_COUNT].sum(dtype=np.float64))
+    passing_clusters = float(metric_values[
+        metric_codes == MetricCodes.CLUSTER_COUNT_PASSING_FILTERS].sum(
+        dtype=np.float64))
+    if densities.size > 0:
+        summary['cluster_density'] = float(densities.mean(dtype=np.float64))
     if total_clusters > 0.0:
         summary['pass_rate'] = passing_clusters / total_clusters
 
@@ -68,8 +85,8 @@ def summarize_tile_records(records, summary):
 def summarize_tiles(filename, summary):
     """ Summarize the records from a tile metrics file. """
     with open(filename, 'rb') as data_file:
-        records = read_tiles(data_file)
-        summarize_tile_records(records, summary)
+        records = read_tile_array(data_file)
+        summarize_tile_array(records, summary)
 
 if __name__ == '__live_coding__':
     import unittest
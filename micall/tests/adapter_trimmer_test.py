@@ -0,0 +1,93 @@
+import pickle
+from tempfile import NamedTemporaryFile
+from unittest import TestCase
+
+from micall.utils.adapter_trimmer import AdapterTrimmer, read_adapters
+
+ADAPTER = 'CTGTCTCTTATACACATCT'
+
+
+class AdapterTrimmerTest(TestCase):
+    def setUp(self):
+        self.trimmer = AdapterTrimmer([ADAPTER])
+
+    def check_lengths(self, seqs, expected_lengths):
+        lengths = self.trimmer.find_trimmed_lengths(seqs)
+
+        self.assertEqual(expected_lengths, lengths.tolist())
+
+    def test_no_adapter(self):
+        self.check_lengths(['AAAAAAAAAA'], [10])
+
+    def test_full_adapter(self):
+        self.check_lengths(['AAAAA' + ADAPTER + 'GGGG'], [5])
+
+    def test_partial_adapter_at_end(self):
+        self.check_lengths(['AAAAA' + ADAPTER[:3]], [5])
+
+    def test_overlap_too_short(self):
+        self.check_lengths(['AAAAA' + ADAPTER[:2]], [7])
+
+    def test_mismatch_allowed(self):
+        seq = 'AAAAA' + ADAPTER[:10] + 'A' + ADAPTER[11:]
+
+        self.check_lengths([seq], [5])
+
+    def test_too_many_mismatches(self):
+        seq = 'AAAAA' + ADAPTER[:3] + 'A' + ADAPTER[4:9]  # 1 error in 9
+
+        self.check_lengths([seq], [len(seq)])
+
+    def test_whole_read_is_adapter(self):
+        self.check_lengths([ADAPTER], [0])
+
+    def test_batch(self):
+        self.check_lengths(['AAAAA' + ADAPTER,
+                            '',
+                            'CCCCCCCCCCCCCCCCCCCC',
+                            'GG' + ADAPTER[:5]],
+                           [5, 0, 20, 2])
+
+    def test_best_adapter(self):
+        other_adapter = 'AGATCGGAAGAGCACACGTC'
+        self.trimmer = AdapterTrimmer([ADAPTER, other_adapter])
+        seq = 'AAAAA' + other_adapter + 'TTTTT' + ADAPTER[:4]
+
+        self.check_lengths([seq], [5])
+
+    def test_trim_records(self):
+        records = [('@r1', 'AAAAA' + ADAPTER, '+', 'B' * 24),
+                   ('@r2', 'CCCC', '+', 'DDDD')]
+        expected_records = [('@r1', 'AAAAA', '+', 'BBBBB'),
+                            ('@r2', 'CCCC', '+', 'DDDD')]
+
+        trimmed_records = self.trimmer.trim_records(records)
+
+        self.assertEqual(expected_records, trimmed_records)
+
+    def test_pickle(self):
+        """ Worker processes get a copy of the trimmer. """
+        records = [('@r1', 'AAAAA' + ADAPTER[:10], '+', 'B' * 15)]
+        expected_records = [('@r1', 'AAAAA', '+', 'BBBBB')]
+        trimmer = pickle.loads(pickle.dumps(self.trimmer))
+
+        trimmed_records = trimmer.trim_records(records)
+
+        self.assertEqual(expected_records, trimmed_records)
+
+
+class ReadAdaptersTest(TestCase):
+    def test_read(self):
+        with NamedTemporaryFile('w', suffix='.fasta') as fasta:
+            fasta.write("""\
+>first
+ACGTAC
+gtac
+>second
+TTTT
+""")
+            fasta.flush()
+
+            adapters = read_adapters(fasta.name)
+
+        self.assertEqual(['ACGTACGTAC', 'TTTT'], adapters)
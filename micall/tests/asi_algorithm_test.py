@@ -1,9 +1,13 @@
 import os
 from io import StringIO
 from operator import attrgetter
+from tempfile import TemporaryDirectory
 from unittest import TestCase
 
-from micall.hivdb.asi_algorithm import AsiAlgorithm, translate_complete_to_array, BNFVal
+from micall.hivdb import asi_algorithm
+from micall.hivdb.asi_algorithm import AsiAlgorithm, translate_complete_to_array, BNFVal, \
+    load_asi
+from micall.hivdb.asi_compiler import compile_comment
 
 
 class AsiAlgorithmTest(TestCase):
@@ -130,6 +134,35 @@ class AsiAlgorithmTest(TestCase):
 
         self.assertEqual(expected_mutations, result.mutations)
 
+    def test_touched_conditions_wild_type(self):
+        aa_seq = [[amino] for amino in self.asi.stds['RT']]
+
+        touched_conditions = self.asi.find_touched_conditions(aa_seq, 'RT')
+
+        self.assertEqual(set(), touched_conditions)
+
+    def test_touched_conditions(self):
+        aa_seq = [[amino] for amino in self.asi.stds['RT']]
+        aa_seq[40] = ['L']
+        expected_conditions = self.asi.position_index['RT'][41]
+
+        touched_conditions = self.asi.find_touched_conditions(aa_seq, 'RT')
+
+        self.assertEqual(expected_conditions, touched_conditions)
+        self.assertTrue(all('41' in condition
+                            for condition in touched_conditions))
+
+    def test_touched_conditions_short_sequence(self):
+        aa_seq = [[amino] for amino in self.asi.stds['RT'][:100]]
+        expected_conditions = set()
+        for position, conditions in self.asi.position_index['RT'].items():
+            if position > 100:
+                expected_conditions |= conditions
+
+        touched_conditions = self.asi.find_touched_conditions(aa_seq, 'RT')
+
+        self.assertEqual(expected_conditions, touched_conditions)
+
     def test_drug_classes(self):
         aa_seq = [[]]
         compared_attrs = ('code', 'name', 'drug_class')
@@ -647,6 +680,43 @@ class AsiAlgorithmTinyRulesTest(TestCase):
         self.assertEqual(expected_score, bnr.score)
         self.assertEqual(expected_mutations, bnr.mutations)
 
+    def test_compiled_conditions_match_bnf(self):
+        conditions = [
+            '2R',
+            '2RFL',
+            'NOT 2R',
+            '2(NOT R)',
+            '1F AND 2R',
+            '1F OR 2R',
+            '(1F OR 2R) AND 1L',
+            'SELECT ATLEAST 1 FROM (1F, 2R)',
+            'SELECT EXACTLY 2 FROM (1F, 2R)',
+            'SELECT ATLEAST 1 AND NOTMORETHAN 1 FROM (1F, 2R)',
+            'SCORE FROM(1F => 10, 2R => 20)',
+            'SCORE FROM((1F OR 2R) => 10)',
+            'SCORE FROM(1F AND 2R => 10)',
+            'SCORE FROM(MAX ( 1F => 10, 2R => 20 ))',
+            'SCORE FROM(MAX ( 1F => 10, 2R => 20 ), 1F => -5)',
+            '3R']
+        sequences = [[['F'], ['R']],
+                     [['L'], ['R', 'F']],
+                     [['F', 'L'], ['K']],
+                     [[], ['R']]]
+
+        for cond in conditions:
+            for aminos in sequences:
+                expected = self.asi.interp_condition_bnf(cond, aminos)
+
+                result = self.asi.interp_condition(cond, aminos)
+
+                self.assertEqual(expected, result, (cond, aminos))
+
+    def test_compiled_condition_reused(self):
+        compiled1 = self.asi.compile_condition('1F OR 2R')
+        compiled2 = self.asi.compile_condition('1F OR 2R')
+
+        self.assertIs(compiled1, compiled2)
+
 
 class AsiAlgorithmNewRulesTest(TestCase):
     default_drugs = """\
@@ -667,7 +737,12 @@ class AsiAlgorithmNewRulesTest(TestCase):
 
     @staticmethod
     def create_asi(drugs=default_drugs, comments=default_comments):
-        xml = """\
+        xml = AsiAlgorithmNewRulesTest.create_xml(drugs, comments)
+        return AsiAlgorithm(StringIO(xml))
+
+    @staticmethod
+    def create_xml(drugs=default_drugs, comments=default_comments):
+        return """\
 <ALGORITHM>
   <ALGNAME>HIVDB</ALGNAME>
   <ALGVERSION>fake</ALGVERSION>
@@ -701,7 +776,6 @@ class AsiAlgorithmNewRulesTest(TestCase):
   </MUTATION_COMMENTS>
 </ALGORITHM>
 """.format(drugs=drugs, comments=comments)
-        return AsiAlgorithm(StringIO(xml))
 
     def test_interpret(self):
         asi = self.create_asi()
@@ -717,6 +791,12 @@ class AsiAlgorithmNewRulesTest(TestCase):
         self.assertEqual(expected_drugs, drugs)
         self.assertEqual(expected_mutation_comments, result.mutation_comments)
 
+    def test_conditions_compiled_at_load(self):
+        asi = self.create_asi()
+
+        self.assertEqual(['SCORE FROM(41L => 15)'],
+                         list(asi.compiled_conditions))
+
     def test_level_action(self):
         drugs = """\
   <DRUG>
@@ -958,6 +1038,163 @@ class AsiAlgorithmNewRulesTest(TestCase):
         self.assertEqual(expected_drugs, drugs)
         self.assertEqual(expected_mutation_comments, result.mutation_comments)
 
+    def test_referenced_positions(self):
+        drugs = """\
+  <DRUG>
+    <NAME>ABC</NAME>
+    <FULLNAME>abacavir</FULLNAME>
+    <RULE>
+      <CONDITION><![CDATA[41L AND 44(NOT E)]]></CONDITION>
+      <ACTIONS>
+        <COMMENT ref="RT41L"/>
+      </ACTIONS>
+    </RULE>
+  </DRUG>
+"""
+        comments = """\
+      <COMMENT_STRING id="RT41L">
+        <TEXT><![CDATA[Found $listMutsIn{210W,215(NOT T)}.]]></TEXT>
+        <SORT_TAG>1</SORT_TAG>
+      </COMMENT_STRING>
+"""
+        expected_positions = {41, 44, 210, 215}
+
+        asi = self.create_asi(drugs=drugs, comments=comments)
+        positions = asi.get_referenced_positions('RT')
+
+        self.assertEqual(expected_positions, positions)
+
+
+class CompileCommentTest(TestCase):
+    def setUp(self):
+        self.std = 'MKLWNT'
+        self.aa_seq = [[amino] for amino in self.std]
+        self.aa_seq[1] = ['R', 'K']
+        self.aa_seq[3] = ['F']
+
+    def test_literal(self):
+        template = compile_comment('Just  text.')
+
+        comment = template.render(self.aa_seq, self.std)
+
+        self.assertFalse(template.has_placeholders)
+        self.assertEqual('Just text.', comment)
+
+    def test_list_mutations(self):
+        template = compile_comment(
+            'Found $listMutsIn{2R,4(NOT W),5Y} ($listMutsIn{2R,4(NOT W),5Y}).')
+
+        comment = template.render(self.aa_seq, self.std)
+
+        self.assertTrue(template.has_placeholders)
+        self.assertEqual('Found K2R, W4F (K2R, W4F).', comment)
+
+    def test_list_mutations_empty(self):
+        template = compile_comment('Found ($listMutsIn{5Y}).')
+
+        comment = template.render(self.aa_seq, self.std)
+
+        self.assertEqual('Found.', comment)
+
+    def test_list_mutations_no_std(self):
+        template = compile_comment('Found $listMutsIn{2R}.')
+
+        comment = template.render(self.aa_seq)
+
+        self.assertEqual('Found 2R.', comment)
+
+    def test_count_mutations(self):
+        template = compile_comment('Found $numberOfMutsIn{2RK,4F,5Y} of them.')
+
+        comment = template.render(self.aa_seq, self.std)
+
+        self.assertEqual('Found 3 of them.', comment)
+
+    def test_different_placeholders(self):
+        """ comment_filter() only fills in the last one, so don't compile. """
+        template = compile_comment('Found $listMutsIn{2R} and $listMutsIn{4F}.')
+
+        self.assertIsNone(template)
+
+    def test_matches_comment_filter(self):
+        xml = "<ALGORITHM><DEFINITIONS/></ALGORITHM>"
+        asi = AsiAlgorithm(StringIO(xml))
+        asi.stds['XX'] = self.std
+        comment_templates = [
+            'Found $listMutsIn{2R,4(NOT W)} and $numberOfMutsIn{2RK,4F} more.',
+            'Found ($listMutsIn{5Y})  twice.',
+            'Found \uf0b1 $listMutsIn{2R}.']
+
+        for comment_template in comment_templates:
+            expected_comment = asi.comment_filter(comment_template,
+                                                  self.aa_seq,
+                                                  'XX')
+
+            comment = compile_comment(comment_template).render(self.aa_seq,
+                                                               self.std)
+
+            self.assertEqual(expected_comment, comment)
+
+
+class LoadAsiTest(TestCase):
+    def setUp(self):
+        asi_algorithm.loaded_algorithms.clear()
+        self.addCleanup(asi_algorithm.loaded_algorithms.clear)
+        temp_dir = TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.rules_path = os.path.join(temp_dir.name, 'rules.xml')
+        self.cache_dir = os.path.join(temp_dir.name, 'cache')
+        self.write_rules('41L => 15')
+
+    def write_rules(self, score_item):
+        drugs = AsiAlgorithmNewRulesTest.default_drugs.replace('41L => 15',
+                                                               score_item)
+        xml = AsiAlgorithmNewRulesTest.create_xml(drugs=drugs)
+        with open(self.rules_path, 'w') as rules_file:
+            rules_file.write(xml)
+
+    def test_shared_in_process(self):
+        asi1 = load_asi(self.rules_path, self.cache_dir)
+        asi2 = load_asi(self.rules_path, self.cache_dir)
+
+        self.assertIs(asi1, asi2)
+
+    def test_cache_file(self):
+        asi1 = load_asi(self.rules_path, self.cache_dir)
+        asi_algorithm.loaded_algorithms.clear()
+        asi2 = load_asi(self.rules_path, self.cache_dir)
+
+        self.assertEqual(1, len(os.listdir(self.cache_dir)))
+        self.assertIsNot(asi1, asi2)
+        self.assertEqual(asi1.drugs, asi2.drugs)
+        self.assertEqual(list(asi1.compiled_conditions),
+                         list(asi2.compiled_conditions))
+
+    def test_rules_changed(self):
+        aa_seq = [[]] * 40 + [['L']]
+        asi1 = load_asi(self.rules_path, self.cache_dir)
+        self.write_rules('41L => 5')
+        asi2 = load_asi(self.rules_path, self.cache_dir)
+
+        result1 = asi1.interpret(aa_seq, 'RT')
+        result2 = asi2.interpret(aa_seq, 'RT')
+
+        self.assertEqual(2, len(os.listdir(self.cache_dir)))
+        self.assertEqual(15.0, result1.drugs[0].score)
+        self.assertEqual(5.0, result2.drugs[0].score)
+
+    def test_corrupt_cache_file(self):
+        load_asi(self.rules_path, self.cache_dir)
+        asi_algorithm.loaded_algorithms.clear()
+        cache_name, = os.listdir(self.cache_dir)
+        with open(os.path.join(self.cache_dir, cache_name), 'wb') as f:
+            f.write(b'garbage')
+
+        asi = load_asi(self.rules_path, self.cache_dir)
+
+        self.assertEqual(['SCORE FROM(41L => 15)'],
+                         list(asi.compiled_conditions))
+
 
 class TranslateSequenceTest(TestCase):
     def test_translate(self):
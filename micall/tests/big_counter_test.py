@@ -37,4 +37,32 @@ class BigCounterTest(TestCase):
     def test_key_not_string(self):
         with BigCounter(FILE_PREFIX) as counter:
             with self.assertRaisesRegex(TypeError, 'Key was not a string: 23'):
-                counter[23] = 5
\ No newline at end of file
+                counter[23] = 5
+
+    def test_keep_frequent_keys(self):
+        expected_items = [('a', 3), ('b', 1), ('c', 1), ('d', 1)]
+
+        with BigCounter(FILE_PREFIX, max_size=2, keep_size=1) as counter:
+            counter['a'] += 1
+            counter['a'] += 1
+            counter['b'] += 1
+            counter['c'] += 1
+            kept_keys = sorted(counter.active_counts)
+            counter['a'] += 1
+            counter['d'] += 1
+            items = sorted(counter.items())
+
+        self.assertEqual(['a'], kept_keys)
+        self.assertEqual(expected_items, items)
+
+    def test_many_files(self):
+        keys = 'abcdefghij'
+        expected_items = [(key, 3) for key in keys]
+
+        with BigCounter(FILE_PREFIX, max_size=3) as counter:
+            for _ in range(3):
+                for key in keys:
+                    counter[key] += 1
+            items = list(counter.items())
+
+        self.assertEqual(expected_items, items)
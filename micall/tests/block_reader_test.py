@@ -0,0 +1,76 @@
+from io import BytesIO, StringIO
+from unittest import TestCase
+
+from micall.utils.block_reader import ReadAheadReader, read_lines
+
+
+class ReadAheadReaderTest(TestCase):
+    def test_read_sizes(self):
+        reader = ReadAheadReader(BytesIO(b'ABCDEFGHIJ'), block_size=3)
+
+        try:
+            parts = [reader.read(2), reader.read(5), reader.read(), reader.read()]
+        finally:
+            reader.close()
+
+        self.assertEqual([b'AB', b'CDEFG', b'HIJ', b''], parts)
+
+    def test_error(self):
+        class BrokenFile(object):
+            def read(self, size):
+                raise OSError('Bad data.')
+
+        reader = ReadAheadReader(BrokenFile())
+
+        try:
+            with self.assertRaisesRegex(OSError, 'Bad data.'):
+                reader.read(10)
+        finally:
+            reader.close()
+
+    def test_close_early(self):
+        reader = ReadAheadReader(BytesIO(b'ABCDEFGHIJ'),
+                                 block_size=1,
+                                 max_blocks=2)
+
+        first = reader.read(1)
+        reader.close()
+
+        self.assertEqual(b'A', first)
+        self.assertFalse(reader.thread.is_alive())
+
+    def test_text(self):
+        reader = ReadAheadReader(StringIO('ABCDE'), block_size=2)
+
+        try:
+            parts = [reader.read(3), reader.read()]
+        finally:
+            reader.close()
+
+        self.assertEqual(['ABC', 'DE'], parts)
+
+
+class ReadLinesTest(TestCase):
+    def test_blocks(self):
+        source = StringIO('a\nbc\nd\n')
+
+        batches = list(read_lines(source, block_size=4))
+
+        self.assertEqual([['a'], ['bc', 'd']], batches)
+
+    def test_line_endings(self):
+        source = BytesIO(b'a\r\nb')
+
+        batches = list(read_lines(source))
+
+        self.assertEqual([['a'], ['b']], batches)
+
+    def test_windows_line_endings_split_between_blocks(self):
+        text = b'@a\r\nACGT\r\n+\r\nIIII\r\n'
+        expected_lines = ['@a', 'ACGT', '+', 'IIII']
+
+        for block_size in range(1, len(text) + 1):
+            batches = list(read_lines(BytesIO(text), block_size))
+            lines = [line for batch in batches for line in batch]
+
+            self.assertEqual(expected_lines, lines, block_size)
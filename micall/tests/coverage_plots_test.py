@@ -1,4 +1,6 @@
-from unittest.mock import patch, call
+import os
+from tempfile import TemporaryDirectory
+from unittest.mock import patch, call, ANY
 from unittest import TestCase
 from io import StringIO
 from micall.core.coverage_plots import coverage_plot
@@ -87,10 +89,11 @@ R1-and-R2,R1,R1-seed,15,5,1,-1,1
 """
         scores_csv = StringIO()
         amino_csv.name = 'E1234.amino.csv'
-        expected_calls = [call('E1234.R1.R1.png'),
-                          call('E1234.R1.R1.details.png'),
-                          call('E1234.R1-and-R2.R1.png'),
-                          call('E1234.R1-and-R2.R1.details.png')]
+        metadata = {'Description': ANY}
+        expected_calls = [call('E1234.R1.R1.png', metadata=metadata),
+                          call('E1234.R1.R1.details.png', metadata=metadata),
+                          call('E1234.R1-and-R2.R1.png', metadata=metadata),
+                          call('E1234.R1-and-R2.R1.details.png', metadata=metadata)]
 
         coverage_plot(amino_csv,
                       coverage_scores_csv=scores_csv,
@@ -98,3 +101,36 @@ R1-and-R2,R1,R1-seed,15,5,1,-1,1
 
         self.assertEqual(expected_calls, savefig_mock.mock_calls)
         self.assertEqual(expected_scores, scores_csv.getvalue())
+
+    @patch('micall.core.project_config.ProjectConfig.loadScoring')
+    def test_skip_unchanged(self, config_mock):
+        config_mock.return_value = self.config
+        amino_text = """\
+seed,region,q-cutoff,query.aa.pos,refseq.aa.pos,\
+A,C,D,E,F,G,H,I,K,L,M,N,P,Q,R,S,T,V,W,Y,*,X,partial,del,ins,clip,v3_overlap
+R1-seed,R1,15,100,1,0,5,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0
+"""
+        changed_text = amino_text.replace(',5,', ',6,')
+        with TemporaryDirectory() as coverage_maps_path:
+            coverage_plot(StringIO(amino_text),
+                          coverage_scores_csv=None,
+                          coverage_maps_path=coverage_maps_path,
+                          excluded_projects=['R1-and-R2'])
+            with patch('matplotlib.pyplot.savefig') as savefig_mock:
+                paths = coverage_plot(StringIO(amino_text),
+                                      coverage_scores_csv=None,
+                                      coverage_maps_path=coverage_maps_path,
+                                      excluded_projects=['R1-and-R2'],
+                                      skip_unchanged=True)
+                skipped_calls = list(savefig_mock.mock_calls)
+                coverage_plot(StringIO(changed_text),
+                              coverage_scores_csv=None,
+                              coverage_maps_path=coverage_maps_path,
+                              excluded_projects=['R1-and-R2'],
+                              skip_unchanged=True)
+
+        self.assertEqual([], skipped_calls)
+        self.assertEqual([os.path.join(coverage_maps_path, 'R1.R1.png'),
+                          os.path.join(coverage_maps_path, 'R1.R1.details.png')],
+                         paths)
+        self.assertEqual(2, len(savefig_mock.mock_calls))
@@ -0,0 +1,150 @@
+from unittest.mock import patch
+from unittest import TestCase
+from io import StringIO
+
+import numpy as np
+
+from micall.core.coverage_scores import coverage_scores, calculate_score, \
+    get_counts, read_coverage_counts
+from micall.core.project_config import ProjectConfig
+
+
+class CoverageScoresTest(TestCase):
+    def setUp(self):
+        self.addTypeEqualityFunc(str, self.assertMultiLineEqual)
+        config_json = StringIO("""\
+{
+  "projects": {
+    "R1": {
+      "max_variants": 0,
+      "regions": [
+        {
+          "coordinate_region": "R1",
+          "coordinate_region_length": 3,
+          "key_positions": [],
+          "min_coverage1": 10,
+          "min_coverage2": 50,
+          "min_coverage3": 100,
+          "seed_region_names": [
+            "R1-seed"
+          ]
+        }
+      ]
+    },
+    "R1-and-R2": {
+      "max_variants": 0,
+      "regions": [
+        {
+          "coordinate_region": "R1",
+          "coordinate_region_length": 3,
+          "key_positions": [
+            {
+              "end_pos": null,
+              "start_pos": 2
+            },
+            {
+              "end_pos": null,
+              "start_pos": 3
+            }
+          ],
+          "min_coverage1": 10,
+          "min_coverage2": 50,
+          "min_coverage3": 100,
+          "seed_region_names": [
+            "R1-seed"
+          ]
+        },
+        {
+          "coordinate_region": "R2",
+          "coordinate_region_length": 1,
+          "key_positions": [],
+          "min_coverage1": 10,
+          "min_coverage2": 50,
+          "min_coverage3": 100,
+          "seed_region_names": [
+            "R2-seed"
+          ]
+        }
+      ]
+    }
+  }
+}
+""")
+        self.config = ProjectConfig()
+        self.config.load(config_json)
+
+    @patch('micall.core.project_config.ProjectConfig.loadScoring')
+    def test_simple(self, config_mock):
+        config_mock.return_value = self.config
+        amino_csv = StringIO("""\
+seed,region,q-cutoff,query.aa.pos,refseq.aa.pos,\
+A,C,D,E,F,G,H,I,K,L,M,N,P,Q,R,S,T,V,W,Y,*,X,partial,del,ins,clip,v3_overlap
+R1-seed,R1,15,100,1,0,5,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0
+R1-seed,R1,15,101,2,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,60,0,0,0,0,0,0,0,0,0,0
+R1-seed,R1,15,102,3,0,0,0,0,0,0,0,0,0,0,0,0,0,0,5,0,0,0,0,0,0,0,0,50,0,0,0
+""")
+        expected_scores = """\
+project,region,seed,q.cut,min.coverage,which.key.pos,off.score,on.score
+R1,R1,R1-seed,15,5,1,-2,1
+R1-and-R2,R1,R1-seed,15,55,3,-2,3
+"""
+        scores_csv = StringIO()
+
+        coverage_scores(amino_csv, scores_csv)
+
+        self.assertEqual(expected_scores, scores_csv.getvalue())
+
+    @patch('micall.core.project_config.ProjectConfig.loadScoring')
+    def test_excluded_project(self, config_mock):
+        config_mock.return_value = self.config
+        amino_csv = StringIO("""\
+seed,region,q-cutoff,query.aa.pos,refseq.aa.pos,\
+A,C,D,E,F,G,H,I,K,L,M,N,P,Q,R,S,T,V,W,Y,*,X,partial,del,ins,clip,v3_overlap
+R1-seed,R1,15,100,1,0,5,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0
+""")
+        expected_scores = """\
+project,region,seed,q.cut,min.coverage,which.key.pos,off.score,on.score
+R1-and-R2,R1,R1-seed,15,0,2,-1,1
+"""
+        scores_csv = StringIO()
+
+        coverage_scores(amino_csv, scores_csv, excluded_projects=['R1'])
+
+        self.assertEqual(expected_scores, scores_csv.getvalue())
+
+    def test_read_counts(self):
+        amino_csv = StringIO("""\
+seed,region,q-cutoff,query.aa.pos,refseq.aa.pos,\
+A,C,D,E,F,G,H,I,K,L,M,N,P,Q,R,S,T,V,W,Y,*,X,partial,del,ins,clip,v3_overlap
+R1-seed,R1,15,100,2,0,5,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,1,2,3,4,5,6,7
+R2-seed,R2,15,100,1,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0
+""")
+
+        regions = list(read_coverage_counts(amino_csv))
+
+        self.assertEqual(['R1', 'R2'], [region for _, region, _, _ in regions])
+        seed, region, qcut, counts = regions[0]
+        self.assertEqual('15', qcut)
+        self.assertEqual([0, 0, 10], counts['coverage'].tolist())
+        self.assertEqual([0, 0, 1], counts['stops'].tolist())
+        self.assertEqual([0, 0, 4], counts['deletions'].tolist())
+        self.assertEqual([0, 0, 2], counts['low_quality'].tolist())
+        self.assertEqual([0, 0, 7], counts['v3_overlap'].tolist())
+
+    def test_get_counts_past_end(self):
+        counts = np.array([0, 10, 20])
+
+        self.assertEqual([10, 20, 0, 0], get_counts(counts, 1, 4).tolist())
+
+    def test_score_key_positions_past_end(self):
+        project_region = dict(coordinate_region_length=5,
+                              key_positions=[dict(start_pos=1, end_pos=None),
+                                             dict(start_pos=4, end_pos=5)],
+                              min_coverage1=10,
+                              min_coverage2=50,
+                              min_coverage3=100)
+        coverage = np.array([0, 200, 150, 300])
+
+        score = calculate_score(project_region, coverage)
+
+        self.assertEqual((0, 4, -3, 1), score)
@@ -1,8 +1,13 @@
 from io import BytesIO, StringIO
+import os
 from struct import pack
+from tempfile import NamedTemporaryFile
 from unittest import TestCase
+
+import numpy as np
+
 from micall.monitor.error_metrics_parser import read_errors, write_phix_csv,\
-    read_records
+    read_records, read_record_array, read_error_array, write_phix_array
 
 
 class RecordsParserTest(TestCase):
@@ -59,6 +64,60 @@ class RecordsParserTest(TestCase):
             records.__next__)
 
 
+class RecordArrayParserTest(TestCase):
+    def setUp(self):
+        self.sample_data = pack('<BBHHHH', 1, 4, 1, 2, 3, 4)
+        self.fields = [('first', '<u2'), ('second', '<u2')]
+
+    def test_load(self):
+        expected_records = [(1, 2), (3, 4)]
+
+        records = read_record_array(BytesIO(self.sample_data),
+                                    min_version=1,
+                                    fields=self.fields)
+
+        self.assertEqual(expected_records, records.tolist())
+
+    def test_load_file(self):
+        with NamedTemporaryFile(delete=False) as f:
+            f.write(self.sample_data)
+        try:
+            with open(f.name, 'rb') as data_file:
+                records = read_record_array(data_file,
+                                            min_version=1,
+                                            fields=self.fields)
+            first_values = records['first'].tolist()
+        finally:
+            os.remove(f.name)
+
+        self.assertEqual([1, 3], first_values)
+
+    def test_ignore_extra_fields(self):
+        records = read_record_array(BytesIO(self.sample_data),
+                                    min_version=1,
+                                    fields=[('first', '<u2')])
+
+        self.assertEqual([1, 3], records['first'].tolist())
+
+    def test_partial_record(self):
+        data_file = BytesIO(self.sample_data[:-1])
+        data_file.name = 'test_file'
+
+        with self.assertRaisesRegex(
+                IOError,
+                'Partial record of length 3 found in test_file.'):
+            read_record_array(data_file, min_version=1, fields=self.fields)
+
+    def test_old_version(self):
+        data_file = BytesIO(self.sample_data)
+        data_file.name = 'test_file'
+
+        with self.assertRaisesRegex(
+                IOError,
+                'File version 1 is less than minimum version 3 in test_file.'):
+            read_record_array(data_file, min_version=3, fields=self.fields)
+
+
 class ErrorMetricsParserTest(TestCase):
     def setUp(self):
         self.addTypeEqualityFunc(str, self.assertMultiLineEqual)
@@ -241,3 +300,21 @@ tile,cycle,errorrate
         write_phix_csv(out_file, records, read_lengths, summary=summary)
 
         self.assertEqual(expected_summary, summary)
+
+    def test_write_array(self):
+        out_file = StringIO()
+        errors = read_error_array(self.sample_stream)
+        expected_csv = """\
+tile,cycle,errorrate
+2,1
+2,2
+2,3,0.5
+"""
+        expected_summary = dict(error_rate_fwd=0.5)
+
+        summary = {}
+        write_phix_array(out_file, errors, summary=summary)
+
+        self.assertEqual(expected_csv, out_file.getvalue())
+        self.assertEqual(expected_summary, summary)
+        self.assertIsInstance(errors, np.ndarray)
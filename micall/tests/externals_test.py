@@ -0,0 +1,72 @@
+from subprocess import CalledProcessError, DEVNULL
+import sys
+from unittest import TestCase
+
+from micall.utils.externals import CommandWrapper
+
+
+class PythonWrapper(CommandWrapper):
+    def __init__(self):
+        super(PythonWrapper, self).__init__(version=None, execname='python')
+        self.path = sys.executable
+
+
+class YieldOutputTest(TestCase):
+    def setUp(self):
+        self.python = PythonWrapper()
+
+    def test_lines(self):
+        expected_lines = ['a\n', 'b\n', 'c\n']
+
+        lines = list(self.python.yield_output(
+            ['-c', 'print("a"); print("b"); print("c")'],
+            stdin=DEVNULL))
+
+        self.assertEqual(expected_lines, lines)
+
+    def test_lines_without_final_newline(self):
+        """ Lines are passed through unchanged, unlike batches. """
+        expected_lines = ['a\n', 'b']
+
+        lines = list(self.python.yield_output(
+            ['-c', 'import sys; sys.stdout.write("a\\nb")'],
+            stdin=DEVNULL))
+
+        self.assertEqual(expected_lines, lines)
+
+    def test_batches(self):
+        expected_count = 300000
+
+        batches = list(self.python.yield_output_batches(
+            ['-c', 'for i in range(300000): print(i)']))
+        lines = [line for batch in batches for line in batch]
+
+        self.assertGreater(len(batches), 1)
+        self.assertEqual(expected_count, len(lines))
+        self.assertEqual(str(expected_count-1), lines[-1])
+
+    def test_no_final_newline(self):
+        expected_batches = [['a'], ['b']]
+
+        batches = list(self.python.yield_output_batches(
+            ['-c', 'import sys; sys.stdout.write("a\\nb")']))
+
+        self.assertEqual(expected_batches, batches)
+
+    def test_error(self):
+        batches = self.python.yield_output_batches(
+            ['-c', 'print("a"); exit(3)'])
+
+        with self.assertRaisesRegex(CalledProcessError,
+                                    'returned non-zero exit status 3'):
+            list(batches)
+
+    def test_stop_early(self):
+        """ The caller stops before the output is finished. """
+        batches = self.python.yield_output_batches(
+            ['-c', 'while True: print("spam" * 100)'])
+
+        first_batch = next(batches)
+        batches.close()
+
+        self.assertEqual('spam' * 100, first_batch[0])
@@ -1,3 +1,4 @@
+from collections import Counter
 import os
 from io import StringIO
 import unittest
@@ -241,6 +242,33 @@ mapped,valid,X4calls,X4pct,final,validpct
         self.assertEqual(expected_g2p_csv, self.g2p_csv.getvalue())
         self.assertEqual(expected_summary_csv, self.g2p_summary_csv.getvalue())
 
+    def testSynonymousVariants(self):
+        """ Different codons for the same protein get the same score. """
+        counts = [(("TGTACAAGACCCAACAACAATACAAGAAAAAGAATCCGTATCCAGAGAGGACCAGGGA"
+                    "GAGCATTT---GTTACAATAGGAAAAATAGGAAATATGAGACAAGCACATTGT",
+                    "TGTACAAGACCCAACAACAATACAAGAAAAA------GTATACATATAGGACCAGGGA"
+                    "GAGCATTTTATGCAACAGGAGAAATAATAGGAGATATAAGACAAGCACATTGT"),
+                   2),
+                  (("TGTACAAGACCCAACAACAATACAAGAAAAAGAATCCGTATCCAGAGAGGACCAGGGA"
+                    "GAGCATTT---GTTACAATAGGAAAAATAGGAAATATGAGACAAGCACATTGT",
+                    "TGTACGAGACCCAACAACAATACAAGAAAAA------GTATACATATAGGACCAGGGA"
+                    "GAGCATTTTATGCAACAGGAGAAATAATAGGAGATATAAGACAAGCACATTGT"),
+                   1)]
+        expected_g2p_csv = """\
+rank,count,g2p,fpr,call,seq,aligned,error,comment
+1,2,0.067754,42.3,R5,CTRPNNNTRKSIHIGPGRAFYATGEIIGDIRQAHC,CTRPN-NNT--RKSIHI---GPGR---AFYAT----GEIIGDI--RQAHC,,
+2,1,0.067754,42.3,R5,CTRPNNNTRKSIHIGPGRAFYATGEIIGDIRQAHC,CTRPN-NNT--RKSIHI---GPGR---AFYAT----GEIIGDI--RQAHC,,
+"""
+        expected_summary_csv = """\
+mapped,valid,X4calls,X4pct,final,validpct
+3,3,0,0.00,R5,100.00
+"""
+
+        write_rows(self.pssm, counts, self.g2p_csv, self.g2p_summary_csv)
+
+        self.assertEqual(expected_g2p_csv, self.g2p_csv.getvalue())
+        self.assertEqual(expected_summary_csv, self.g2p_summary_csv.getvalue())
+
     def testSynonymMixture(self):
         """ Marking position 12 as low quality means codon 4 has to be P.
         """
@@ -559,6 +587,34 @@ LAUQ
             list(reader)
 
 
+    def test_cache_limit(self):
+        self.fastq1 = StringIO("""\
+@A:B:C X:Y
+ACGT
++
+QUAL
+""")
+        self.fastq2 = StringIO("""\
+@A:B:E Q:R
+TAGA
++
+LAUQ
+@A:B:F Q:R
+TAGA
++
+LAUQ
+@A:B:C Q:R
+TTGG
++
+LAUQ
+""")
+        reader = FastqReader(self.fastq1, self.fastq2, max_cache_size=1)
+
+        with self.assertRaisesRegex(FastqError,
+                                    'No match for read A:B:C in the next 1 reads.'):
+            list(reader)
+
+
 class MergeReadsTest(unittest.TestCase):
     def test_overlap(self):
         reads = [("A:B:C",
@@ -767,6 +823,22 @@ qual2
         self.assertEqual(expected_unmapped1, unmapped1.getvalue())
         self.assertEqual(expected_unmapped2, unmapped2.getvalue())
 
+    def test_counts(self):
+        reads = [("A:B:C",
+                  ("name1", "bases1", "qual1"),
+                  ("name2", "bases2", "qual2"),
+                  (None, None)),
+                 ("A:B:D",
+                  ("name1", "bases1", "qual1"),
+                  ("name2", "bases2", "qual2"),
+                  ("ref", "seq"))]
+        expected_counts = Counter(unmapped=1)
+        counts = Counter()
+
+        list(write_unmapped_reads(reads, StringIO(), StringIO(), counts))
+
+        self.assertEqual(expected_counts, counts)
+
     def test_mapped(self):
         reads = [("A:B:C",
                   ("name1", "bases1", "qual1"),
@@ -943,6 +1015,21 @@ HIV1-CON-XX-Consensus-seed,15,0,2,1,TGTACA---AGACCCAAC
 
         self.assertEqual(expected_aligned_csv, aligned_csv.getvalue())
 
+    def test_seq_insertion(self):
+        v3loop_ref = 'TGTACAAGACCCAACAAC'
+        # inserted codon          vvv shouldn't be included in aligned seq.
+        counts = [(("TGTACA---AGACCCAAC", "TGTACAGGGAGACCCAAC"), 2)]
+        hiv_seed = "ATGTACAAGACCCAACAAC"
+        aligned_csv = DummyFile()
+        expected_aligned_csv = """\
+refname,qcut,rank,count,offset,seq
+HIV1-CON-XX-Consensus-seed,15,0,2,1,TGTACAAGACCCAAC
+"""
+
+        list(write_aligned_reads(counts, aligned_csv, hiv_seed, v3loop_ref))
+
+        self.assertEqual(expected_aligned_csv, aligned_csv.getvalue())
+
     def test_ref_and_read_deletion(self):
         v3loop_ref = 'TGTACAAGACCCAACAAC'
         counts = [(("TGTACAAGACCCAAC", "TGTACAAGACCCAAC"), 2)]
@@ -0,0 +1,191 @@
+import gzip
+from io import StringIO, BytesIO
+import os
+from tempfile import NamedTemporaryFile, TemporaryDirectory
+from unittest import TestCase
+
+from micall.utils.fastq_parser import read_records, read_record_batches, \
+    open_fastq, FastqError, save_record_counts, load_record_count
+
+FASTQ_TEXT = """\
+@M01841:45:000000000-A5FEG:1:1101:5296:13227 1:N:0:9
+ACGT
++
+AAAA
+@M01841:45:000000000-A5FEG:1:1101:5297:13228 1:N:0:9
+TTGCA
++
+ABCDE
+"""
+EXPECTED_RECORDS = [
+    ('@M01841:45:000000000-A5FEG:1:1101:5296:13227 1:N:0:9',
+     'ACGT',
+     '+',
+     'AAAA'),
+    ('@M01841:45:000000000-A5FEG:1:1101:5297:13228 1:N:0:9',
+     'TTGCA',
+     '+',
+     'ABCDE')]
+
+
+class ReadRecordsTest(TestCase):
+    def test_text(self):
+        records = list(read_records(StringIO(FASTQ_TEXT)))
+
+        self.assertEqual(EXPECTED_RECORDS, records)
+
+    def test_binary(self):
+        records = list(read_records(BytesIO(FASTQ_TEXT.encode())))
+
+        self.assertEqual(EXPECTED_RECORDS, records)
+
+    def test_small_blocks(self):
+        records = list(read_records(BytesIO(FASTQ_TEXT.encode()),
+                                    block_size=7))
+
+        self.assertEqual(EXPECTED_RECORDS, records)
+
+    def test_windows_line_endings(self):
+        fastq = BytesIO(FASTQ_TEXT.replace('\n', '\r\n').encode())
+
+        records = list(read_records(fastq, block_size=7))
+
+        self.assertEqual(EXPECTED_RECORDS, records)
+
+    def test_missing_final_line_ending(self):
+        records = list(read_records(StringIO(FASTQ_TEXT.rstrip('\n'))))
+
+        self.assertEqual(EXPECTED_RECORDS, records)
+
+    def test_incomplete_record(self):
+        fastq = StringIO(FASTQ_TEXT + '@M01841:45:000000000-A5FEG:1:1101:1:2\n')
+
+        with self.assertRaisesRegex(FastqError, 'Incomplete FASTQ record'):
+            list(read_records(fastq))
+
+    def test_invalid_header(self):
+        fastq = StringIO(FASTQ_TEXT.replace('@', '>', 1))
+
+        with self.assertRaisesRegex(FastqError, 'Invalid FASTQ header'):
+            list(read_records(fastq))
+
+    def test_batches(self):
+        batches = list(read_record_batches(StringIO(FASTQ_TEXT), batch_size=1))
+
+        self.assertEqual([EXPECTED_RECORDS[:1], EXPECTED_RECORDS[1:]], batches)
+
+
+class OpenFastqTest(TestCase):
+    def setUp(self):
+        self.filenames = []
+
+    def tearDown(self):
+        for filename in self.filenames:
+            os.remove(filename)
+
+    def write_file(self, content, suffix):
+        with NamedTemporaryFile(suffix=suffix, delete=False) as f:
+            f.write(content)
+        self.filenames.append(f.name)
+        return f.name
+
+    def test_plain(self):
+        filename = self.write_file(FASTQ_TEXT.encode(), '.fastq')
+
+        with open_fastq(filename) as fastq:
+            records = list(read_records(fastq))
+
+        self.assertEqual(EXPECTED_RECORDS, records)
+
+    def test_empty(self):
+        filename = self.write_file(b'', '.fastq')
+
+        with open_fastq(filename) as fastq:
+            records = list(read_records(fastq))
+
+        self.assertEqual([], records)
+
+    def test_gzip(self):
+        filename = self.write_file(gzip.compress(FASTQ_TEXT.encode()),
+                                   '.fastq.gz')
+
+        with open_fastq(filename) as fastq:
+            records = list(read_records(fastq))
+
+        self.assertEqual(EXPECTED_RECORDS, records)
+
+    def test_gzip_without_extension(self):
+        filename = self.write_file(gzip.compress(FASTQ_TEXT.encode()), '.fq')
+
+        with open_fastq(filename, use_gzip=True) as fastq:
+            records = list(read_records(fastq))
+
+        self.assertEqual(EXPECTED_RECORDS, records)
+
+    def test_gzip_read_ahead(self):
+        filename = self.write_file(gzip.compress(FASTQ_TEXT.encode()),
+                                   '.fastq.gz')
+
+        with open_fastq(filename, read_ahead=True) as fastq:
+            records = list(read_records(fastq, block_size=10))
+
+        self.assertEqual(EXPECTED_RECORDS, records)
+
+
+class RecordCountsTest(TestCase):
+    def setUp(self):
+        self.working_dir = TemporaryDirectory()
+        self.addCleanup(self.working_dir.cleanup)
+        self.fastq1 = self.write_file('reads1.fastq', FASTQ_TEXT)
+        self.fastq2 = self.write_file('reads2.fastq', FASTQ_TEXT)
+
+    def write_file(self, name, text):
+        path = os.path.join(self.working_dir.name, name)
+        with open(path, 'w') as f:
+            f.write(text)
+        return path
+
+    def test_save_and_load(self):
+        save_record_counts({self.fastq1: 2, self.fastq2: 3})
+
+        self.assertEqual(2, load_record_count(self.fastq1))
+        self.assertEqual(3, load_record_count(self.fastq2))
+
+    def test_not_saved(self):
+        save_record_counts({self.fastq1: 2})
+
+        self.assertIsNone(load_record_count(self.fastq2))
+
+    def test_no_counts_file(self):
+        self.assertIsNone(load_record_count(self.fastq1))
+
+    def test_file_changed(self):
+        save_record_counts({self.fastq1: 2})
+        self.write_file('reads1.fastq', FASTQ_TEXT * 2)
+
+        self.assertIsNone(load_record_count(self.fastq1))
+
+    def test_file_rewritten_with_same_size(self):
+        save_record_counts({self.fastq1: 2})
+        stats = os.stat(self.fastq1)
+        self.write_file('reads1.fastq', FASTQ_TEXT.lower())
+        os.utime(self.fastq1, ns=(stats.st_atime_ns,
+                                  stats.st_mtime_ns + 1000000000))
+
+        self.assertIsNone(load_record_count(self.fastq1))
+
+    def test_no_temporary_files_left(self):
+        save_record_counts({self.fastq1: 2})
+        save_record_counts({self.fastq2: 3})
+
+        self.assertEqual(
+            ['fastq_counts.json', 'fastq_counts.json.lock', 'reads1.fastq',
+             'reads2.fastq'],
+            sorted(os.listdir(self.working_dir.name)))
+
+    def test_update(self):
+        save_record_counts({self.fastq1: 2})
+        save_record_counts({self.fastq2: 3})
+
+        self.assertEqual(2, load_record_count(self.fastq1))
+        self.assertEqual(3, load_record_count(self.fastq2))
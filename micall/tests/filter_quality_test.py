@@ -1,6 +1,11 @@
 from io import StringIO
 from unittest import TestCase
-from micall.core.filter_quality import report_bad_cycles
+
+import numpy as np
+
+from micall.core.filter_quality import report_bad_cycles, \
+    report_bad_cycle_array
+from micall.monitor.error_metrics_parser import build_record_array
 
 
 class FilterQualityTest(TestCase):
@@ -106,3 +111,84 @@ tile,bad_cycles
         report_bad_cycles(quality_csv, bad_cycles_csv, bad_tiles_csv)
 
         self.assertEqual(expected_bad_tiles_csv, bad_tiles_csv.getvalue())
+
+
+class BadCycleArrayTest(TestCase):
+    def setUp(self):
+        self.addTypeEqualityFunc(str, self.assertMultiLineEqual)
+
+    def build_errors(self, records):
+        return build_record_array(
+            [dict(tile=tile, cycle=cycle, error_rate=error_rate)
+             for tile, cycle, error_rate in records],
+            [('tile', '<u2'), ('cycle', '<u2'), ('error_rate', '<f4')])
+
+    def test_bad(self):
+        errors = self.build_errors([(2, 1, 1.0),
+                                    (2, 2, 7.5),
+                                    (2, 3, 1.0)])
+        expected_bad_cycles_csv = """\
+tile,cycle,errorrate
+2,2,7.5
+2,3,1.0
+"""
+        expected_bad_tiles_csv = """\
+tile,bad_cycles
+2,2
+"""
+        bad_cycles_csv = StringIO()
+        bad_tiles_csv = StringIO()
+
+        report_bad_cycle_array(errors, bad_cycles_csv, bad_tiles_csv)
+
+        self.assertEqual(expected_bad_cycles_csv, bad_cycles_csv.getvalue())
+        self.assertEqual(expected_bad_tiles_csv, bad_tiles_csv.getvalue())
+
+    def test_missing_and_reverse(self):
+        errors = self.build_errors([(1, 1, 1.0),
+                                    (1, 3, 1.0),
+                                    (1, 4, 1.0),
+                                    (2, 1, 1.0),
+                                    (2, 2, 1.0),
+                                    (2, 3, 1.0),
+                                    (2, 4, 9.0)])
+        read_lengths = [2, 0, 0, 2]
+        expected_bad_cycles_csv = """\
+tile,cycle,errorrate
+1,2,
+2,-2,9.0
+"""
+        expected_bad_tiles_csv = """\
+tile,bad_cycles
+1,1
+2,1
+"""
+        bad_cycles_csv = StringIO()
+        bad_tiles_csv = StringIO()
+
+        report_bad_cycle_array(errors,
+                               bad_cycles_csv,
+                               bad_tiles_csv,
+                               read_lengths)
+
+        self.assertEqual(expected_bad_cycles_csv, bad_cycles_csv.getvalue())
+        self.assertEqual(expected_bad_tiles_csv, bad_tiles_csv.getvalue())
+
+    def test_cycle_masks(self):
+        errors = self.build_errors([(1, 1, 1.0),
+                                    (1, 2, 7.5),
+                                    (1, 3, 1.0),
+                                    (1, 4, 1.0),
+                                    (2, 1, 1.0)])
+        read_lengths = [3, 0, 0, 1]
+        expected_masks = {('1', True): [False, False, True, True],
+                          ('2', True): [False, False, True, True]}
+
+        cycle_masks = report_bad_cycle_array(errors,
+                                             StringIO(),
+                                             read_lengths=read_lengths)
+
+        self.assertEqual(expected_masks,
+                         {key: mask.tolist()
+                          for key, mask in cycle_masks.items()})
+        self.assertIsInstance(cycle_masks[('1', True)], np.ndarray)
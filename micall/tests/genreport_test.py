@@ -0,0 +1,109 @@
+import os
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from micall.hivdb import genreport
+from micall.hivdb.genreport import get_config, gen_reports
+
+
+class GetConfigTest(TestCase):
+    def setUp(self):
+        genreport.loaded_configs.clear()
+
+    def test_cached(self):
+        cfg_dct1 = get_config('v1.0')
+        cfg_dct2 = get_config('v1.0')
+
+        self.assertEqual(['v1.0'], list(genreport.loaded_configs))
+        self.assertIs(cfg_dct1['drug_dct'], cfg_dct2['drug_dct'])
+        self.assertIn('level_coltab', cfg_dct1)
+
+    def test_copies_independent(self):
+        cfg_dct1 = get_config('v1.0')
+        cfg_dct1['res_results'] = {'3TC': (1, 'Susceptible')}
+
+        cfg_dct2 = get_config('v1.0')
+
+        self.assertNotIn('res_results', cfg_dct2)
+
+    def test_versions(self):
+        cfg_dct1 = get_config('v1.0')
+        cfg_dct2 = get_config('v2.0')
+
+        self.assertIn('v1.0', cfg_dct1['generated_by_text'])
+        self.assertIn('v2.0', cfg_dct2['generated_by_text'])
+
+
+class GenReportsTest(TestCase):
+    def setUp(self):
+        self.working_dir = TemporaryDirectory()
+        self.addCleanup(self.working_dir.cleanup)
+        self.resistance_path = self.create_file(
+            'resistance.csv',
+            """\
+region,drug_class,drug,drug_name,level,level_name,score
+RT,NRTI,3TC,lamivudine,5,High-level Resistance,60.0
+""")
+        self.mutations_path = self.create_file(
+            'mutations.csv',
+            """\
+drug_class,mutation,prevalence
+NRTI,M184V,0.5
+""")
+        self.report_path = os.path.join(self.working_dir.name, 'report.pdf')
+        self.report_paths = [(self.resistance_path,
+                              self.mutations_path,
+                              self.report_path,
+                              'E1234')]
+
+    def create_file(self, name, text):
+        path = os.path.join(self.working_dir.name, name)
+        with open(path, 'w') as f:
+            f.write(text)
+        return path
+
+    def test_write(self):
+        report_count = gen_reports(self.report_paths, git_version='v1.0')
+
+        self.assertEqual(1, report_count)
+        with open(self.report_path, 'rb') as f:
+            self.assertEqual(b'%PDF', f.read(4))
+
+    def test_skip_unchanged(self):
+        gen_reports(self.report_paths, git_version='v1.0')
+
+        report_count = gen_reports(self.report_paths,
+                                   git_version='v1.0',
+                                   skip_unchanged=True)
+
+        self.assertEqual(0, report_count)
+
+    def test_rewrite_unchanged_without_skip(self):
+        gen_reports(self.report_paths, git_version='v1.0')
+
+        report_count = gen_reports(self.report_paths, git_version='v1.0')
+
+        self.assertEqual(1, report_count)
+
+    def test_skip_changed_input(self):
+        gen_reports(self.report_paths, git_version='v1.0')
+        self.create_file('mutations.csv',
+                         """\
+drug_class,mutation,prevalence
+NRTI,M184V,0.75
+""")
+
+        report_count = gen_reports(self.report_paths,
+                                   git_version='v1.0',
+                                   skip_unchanged=True)
+
+        self.assertEqual(1, report_count)
+
+    def test_skip_changed_version(self):
+        gen_reports(self.report_paths, git_version='v1.0')
+
+        report_count = gen_reports(self.report_paths,
+                                   git_version='v2.0',
+                                   skip_unchanged=True)
+
+        self.assertEqual(1, report_count)
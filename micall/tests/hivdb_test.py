@@ -1,7 +1,9 @@
 from io import StringIO
+from multiprocessing.pool import Pool
 from unittest import TestCase
 
-from micall.hivdb.hivdb import read_aminos, write_resistance, find_good_regions, select_reported_regions
+from micall.hivdb.hivdb import read_aminos, write_resistance, find_good_regions, select_reported_regions, \
+    hivdb_run
 
 
 class SelectReportedRegionsTest(TestCase):
@@ -290,6 +292,26 @@ R1-seed,R1,15,,3,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0
 
         self.assertEqual(expected_aminos, aminos)
 
+    def test_selected_positions(self):
+        amino_csv = StringIO("""\
+seed,region,q-cutoff,query.nuc.pos,refseq.aa.pos,\
+A,C,D,E,F,G,H,I,K,L,M,N,P,Q,R,S,T,V,W,Y,*,X,partial,del,ins,clip,g2p_overlap,coverage
+R1-seed,R1,15,1,1,0,0,0,0,0,0,0,0,9,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,9
+R1-seed,R1,15,4,2,0,0,0,0,9,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,9
+R1-seed,R1,15,7,3,9,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,9
+R2-seed,R2,15,1,1,0,0,0,0,0,0,0,0,9,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,9
+""")
+        min_fraction = 0.2
+        region_positions = {'R1': {2, 3, 99}}
+        expected_aminos = [('R1', [{}, {'F': 1.0}, {'A': 1.0}]),
+                           ('R2', [{'K': 1.0}])]
+
+        aminos = list(read_aminos(amino_csv,
+                                  min_fraction,
+                                  region_positions=region_positions))
+
+        self.assertEqual(expected_aminos, aminos)
+
 
 class WriteResistanceTest(TestCase):
     def test_simple(self):
@@ -386,3 +408,86 @@ NRTI,M41L,0.3
 
         self.assertEqual(expected_resistance, resistance_csv.getvalue())
         self.assertEqual(expected_mutations, mutations_csv.getvalue())
+
+
+class HivdbRunTest(TestCase):
+    def setUp(self):
+        self.maxDiff = None
+        amino_lines = ["""\
+sample,seed,region,q-cutoff,query.nuc.pos,refseq.aa.pos,\
+A,C,D,E,F,G,H,I,K,L,M,N,P,Q,R,S,T,V,W,Y,*,X,partial,del,ins,clip,g2p_overlap,coverage
+"""]
+        for sample_name in ('S1', 'S2'):
+            for pos in range(1, 42):
+                counts = ['0'] * 27
+                # A for wild type, then L at 41.
+                counts[0 if pos < 41 else 9] = '9'
+                amino_lines.append(','.join(
+                    [sample_name, 'RT-seed', 'RT', '15', str(pos*3-2), str(pos)] +
+                    counts +
+                    ['9']) + '\n')
+        self.amino_csv = StringIO(''.join(amino_lines))
+        self.coverage_scores_csv = StringIO("""\
+sample,project,region,on.score
+S1,RT,RT,4
+S2,RT,RT,1
+""")
+        self.expected_resistance = """\
+sample,region,drug_class,drug,drug_name,level,level_name,score
+S1,RT,NRTI,3TC,lamivudine,1,Susceptible,0.0
+S1,RT,NRTI,ABC,abacavir,1,Susceptible,5.0
+S1,RT,NRTI,AZT,zidovudine,3,Low-Level Resistance,15.0
+S1,RT,NRTI,D4T,stavudine,3,Low-Level Resistance,15.0
+S1,RT,NRTI,DDI,didanosine,2,Potential Low-Level Resistance,10.0
+S1,RT,NRTI,FTC,emtricitabine,1,Susceptible,0.0
+S1,RT,NRTI,TDF,tenofovir,1,Susceptible,5.0
+S1,RT,NNRTI,EFV,efavirenz,1,Susceptible,0.0
+S1,RT,NNRTI,ETR,etravirine,1,Susceptible,0.0
+S1,RT,NNRTI,NVP,nevirapine,1,Susceptible,0.0
+S1,RT,NNRTI,RPV,rilpivirine,1,Susceptible,0.0
+S2,RT,NRTI,ABC,abacavir,0,Insufficient data available,0.0
+S2,RT,NRTI,AZT,zidovudine,0,Insufficient data available,0.0
+S2,RT,NRTI,D4T,stavudine,0,Insufficient data available,0.0
+S2,RT,NRTI,DDI,didanosine,0,Insufficient data available,0.0
+S2,RT,NRTI,FTC,emtricitabine,0,Insufficient data available,0.0
+S2,RT,NRTI,3TC,lamivudine,0,Insufficient data available,0.0
+S2,RT,NRTI,TDF,tenofovir,0,Insufficient data available,0.0
+S2,RT,NNRTI,EFV,efavirenz,0,Insufficient data available,0.0
+S2,RT,NNRTI,ETR,etravirine,0,Insufficient data available,0.0
+S2,RT,NNRTI,NVP,nevirapine,0,Insufficient data available,0.0
+S2,RT,NNRTI,RPV,rilpivirine,0,Insufficient data available,0.0
+"""
+        self.expected_mutations = """\
+sample,drug_class,mutation,prevalence
+S1,NRTI,M41L,1.0
+"""
+
+    def test_run(self):
+        resistance_csv = StringIO()
+        mutations_csv = StringIO()
+
+        hivdb_run(self.amino_csv,
+                  self.coverage_scores_csv,
+                  resistance_csv,
+                  mutations_csv,
+                  region_choices=['RT'])
+
+        self.assertEqual(self.expected_resistance, resistance_csv.getvalue())
+        self.assertEqual(self.expected_mutations, mutations_csv.getvalue())
+
+    def test_pool(self):
+        resistance_csv = StringIO()
+        mutations_csv = StringIO()
+        pool = Pool(2)
+        self.addCleanup(pool.join)
+        self.addCleanup(pool.close)
+
+        hivdb_run(self.amino_csv,
+                  self.coverage_scores_csv,
+                  resistance_csv,
+                  mutations_csv,
+                  region_choices=['RT'],
+                  pool=pool)
+
+        self.assertEqual(self.expected_resistance, resistance_csv.getvalue())
+        self.assertEqual(self.expected_mutations, mutations_csv.getvalue())
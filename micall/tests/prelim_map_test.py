@@ -1,9 +1,13 @@
+from io import StringIO
 import os
 from random import randrange
-from tempfile import NamedTemporaryFile
+from tempfile import NamedTemporaryFile, TemporaryDirectory
 from unittest import TestCase
+from unittest.mock import patch, Mock, DEFAULT
 
-from micall.core.prelim_map import check_fastq
+from micall.core.prelim_map import check_fastq, prelim_map, read_prelim_counts
+from micall.core.project_config import ProjectConfig
+from micall.utils.externals import Bowtie2, Bowtie2Build
 
 
 class CheckFastqTest(TestCase):
@@ -64,3 +68,74 @@ class CheckFastqTest(TestCase):
         new_name = check_fastq(f.name, gzip=True)
 
         self.assertEqual(expected_new_name, new_name)
+
+
+class PrelimMapTest(TestCase):
+    def setUp(self):
+        self.addTypeEqualityFunc(str, self.assertMultiLineEqual)
+        patcher = patch.multiple(Bowtie2,
+                                 __init__=Mock(return_value=None),
+                                 yield_output_batches=DEFAULT)
+        mocks = patcher.start()
+        self.addCleanup(patcher.stop)
+        mocks['yield_output_batches'].return_value = [[
+            "read1\t99\tR1\t1\t44\t60M\t=\t1\t-81\tGTGGG\tAAAAA\tAS:i:0",
+            "read1\t147\tR1\t1\t44\t5M\t=\t1\t-81\tGTGGG\tAAAAA"], [
+            "read2\t77\t*\t0\t0\t*\t*\t0\t0\tGTAAA\tAAAAA"]]
+        patcher = patch.multiple(Bowtie2Build,
+                                 __init__=Mock(return_value=None),
+                                 build=DEFAULT)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = patch.object(ProjectConfig, 'loadDefault')
+        mock_projects = patcher.start()
+        self.addCleanup(patcher.stop)
+        mock_projects.return_value.getAllReferences.return_value = {
+            'R1': 'GTGGG'}
+        test_path = os.path.dirname(__file__)
+        self.fastq1 = os.path.join(test_path,
+                                   'microtest',
+                                   '1234A-V3LOOP_S1_L001_R1_001.fastq')
+        self.fastq2 = self.fastq1.replace('_R1_', '_R2_')
+        self.working_dir = TemporaryDirectory()
+        self.addCleanup(self.working_dir.cleanup)
+
+    def test_csv(self):
+        prelim_csv = StringIO()
+        expected_prelim_csv = """\
+qname,flag,rname,pos,mapq,cigar,rnext,pnext,tlen,seq,qual
+read1,99,R1,1,44,60M,=,1,-81,GTGGG,AAAAA
+read1,147,R1,1,44,5M,=,1,-81,GTGGG,AAAAA
+read2,77,*,0,0,*,*,0,0,GTAAA,AAAAA
+"""
+
+        prelim_map(self.fastq1,
+                   self.fastq2,
+                   prelim_csv,
+                   work_path=self.working_dir.name)
+
+        self.assertEqual(expected_prelim_csv, prelim_csv.getvalue())
+
+    def test_sam_and_counts(self):
+        prelim_sam = StringIO()
+        prelim_counts_csv = StringIO()
+        expected_prelim_sam = """\
+@HD\tVN:1.0\tSO:unsorted
+@SQ\tSN:R1\tLN:5
+@PG\tID:bowtie2\tPN:bowtie2\tVN:2.2.3\tCL:""
+read1\t99\tR1\t1\t44\t60M\t=\t1\t-81\tGTGGG\tAAAAA
+read1\t147\tR1\t1\t44\t5M\t=\t1\t-81\tGTGGG\tAAAAA
+read2\t77\t*\t0\t0\t*\t*\t0\t0\tGTAAA\tAAAAA
+"""
+        expected_counts = {'*': [0, 1], 'R1': [1, 2]}
+
+        prelim_map(self.fastq1,
+                   self.fastq2,
+                   None,
+                   work_path=self.working_dir.name,
+                   prelim_sam=prelim_sam,
+                   prelim_counts_csv=prelim_counts_csv)
+
+        prelim_counts_csv.seek(0)
+        self.assertEqual(expected_prelim_sam, prelim_sam.getvalue())
+        self.assertEqual(expected_counts, read_prelim_counts(prelim_counts_csv))
@@ -55,3 +55,26 @@ class PssmTest(TestCase):
 
         self.assertEqual(expected_aa, aligned_aa)
         self.assertAlmostEqual(expected_score, score, places=5)
+
+    def test_batch(self):
+        pssm = Pssm()
+        nucs = [('TGTACAAGACCCAACAACAATACAAGAAAAAGTATACATATAGGACCAGGGAG'
+                 'AGCATTTTATGCAACAGGAGAAATAATAGGAGATATAAGACAAGCACATTGT'),
+                ('TGTACAAGTCCCAACAACAATACAAGAAAAAGTATACATATAGGACCAGGGAG'
+                 'AGCATTTTATGCAACAGGAGAAATAATAGGAGATATAAGACAAGCACATTGT'),
+                # Synonym of the first sequence: ACA -> ACG
+                ('TGTACGAGACCCAACAACAATACAAGAAAAAGTATACATATAGGACCAGGGAG'
+                 'AGCATTTTATGCAACAGGAGAAATAATAGGAGATATAAGACAAGCACATTGT'),
+                'TGTACAAGA']  # Too short
+        expected_scores = [0.06775, 0.06486, 0.06775, None]
+        expected_aligned = [pssm.run_g2p(nucs[0])[1],
+                            pssm.run_g2p(nucs[1])[1],
+                            pssm.run_g2p(nucs[0])[1],
+                            -1]
+
+        results = pssm.run_g2p_batch(nucs)
+
+        rounded_scores = [score and round(score, 5) for score, _ in results]
+        aligned = [aligned for _, aligned in results]
+        self.assertEqual(expected_scores, rounded_scores)
+        self.assertEqual(expected_aligned, aligned)
@@ -2,7 +2,7 @@ from io import BytesIO
 from struct import pack
 from unittest import TestCase
 from micall.monitor.quality_metrics_parser import read_quality,\
-    summarize_quality_records
+    summarize_quality_records, read_quality_array, summarize_quality_array
 
 
 class QualityMetricsParserTest(TestCase):
@@ -91,3 +91,21 @@ class QualityMetricsParserTest(TestCase):
         summarize_quality_records(records, summary)
 
         self.assertEqual(expected_summary, summary)
+
+    def test_summarize_array(self):
+        self.sample_data[:2] = [5, 207]
+        self.sample_data.append(42)
+        self.sample_data.extend(self.sample_data[2:])
+        self.sample_data[58] = 101  # second cycle
+        format_string = '<BB' + 2*('HHH' + 50*'L' + 'B')
+        self.sample_stream = BytesIO(pack(format_string, *self.sample_data))
+        good_count = sum(range(130, 151))
+        total_count = sum(range(101, 151))
+        expected_summary = dict(q30_fwd=good_count/total_count,
+                                q30_rev=good_count/total_count)
+
+        records = read_quality_array(self.sample_stream)
+        summary = {}
+        summarize_quality_array(records, summary, read_lengths=[95, 5, 95])
+
+        self.assertEqual(expected_summary, summary)
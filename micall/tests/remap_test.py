@@ -1,6 +1,7 @@
 from csv import DictWriter
 from io import StringIO
 import os
+from tempfile import TemporaryDirectory
 import unittest
 from unittest.mock import patch, Mock, DEFAULT
 
@@ -1129,10 +1130,12 @@ prelim R1-seed,1,2
 
 class RemapTest(unittest.TestCase):
     def setUp(self):
-        patcher = patch.multiple(Bowtie2, __init__=Mock(return_value=None), yield_output=DEFAULT)
+        patcher = patch.multiple(Bowtie2,
+                                 __init__=Mock(return_value=None),
+                                 yield_output_batches=DEFAULT)
         self.bowtie2_output = []
         mocks = patcher.start()
-        mocks['yield_output'].return_value = self.bowtie2_output
+        mocks['yield_output_batches'].return_value = [self.bowtie2_output]
 
         self.addCleanup(patcher.stop)
         patcher = patch.multiple(Bowtie2Build,
@@ -1147,6 +1150,8 @@ class RemapTest(unittest.TestCase):
         patcher = patch('micall.core.remap.is_short_read', Mock(return_value=False))
         patcher.start()
         self.addCleanup(patcher.stop)
+        self.working_dir = TemporaryDirectory()
+        self.addCleanup(self.working_dir.cleanup)
 
     def test(self):
         test_path = os.path.dirname(__file__)
@@ -1196,6 +1201,57 @@ unmapped,2,,,,
                     StringIO(),
                     StringIO(),
                     StringIO(),
-                    work_path=os.path.join(test_path, 'working'))
+                    work_path=self.working_dir.name)
+
+        self.assertEqual(expected_remap_counts_csv, remap_counts_csv.getvalue())
+
+    def test_prelim_sam(self):
+        test_path = os.path.dirname(__file__)
+        prelim_rows = ''.join(
+            'read{}\t{}\tR1\t1\t0\t5M\t=\t1\t-78\tGTGGG\tAAAAA\n'.format(
+                i,
+                flag)
+            for i in range(1, 6)
+            for flag in (99, 147))
+        prelim_counts_csv = StringIO("""\
+rname,count,filtered_count
+R1,10,10
+""")
+        self.bowtie2_output.extend([
+            "read1\t99\tR1\t1\t44\t5M\t=\t1\t-81\tGTGGG\tAAAAA",
+            "read1\t147\tR1\t1\t44\t5M\t=\t1\t-81\tGTGGG\tAAAAA",
+            "read5\t77\t*\t0\t0\t*\t*\t0\t0\tGTAAA\tAAAAA",
+            "read5\t141\t*\t0\t0\t*\t*\t0\t0\tGTAAA\tAAAAA"])
+        expected_remap_counts_csv = """\
+type,count,filtered_count,seed_dist,other_dist,other_seed
+raw,20,,,,
+prelim R1,10,10,,,
+remap-1 R1,2,,,,
+remap-final R1,2,,,,
+unmapped,2,,,,
+"""
+        remap_counts_csv = StringIO()
+
+        with TemporaryDirectory() as work_path:
+            prelim_sam = os.path.join(work_path, 'prelim.sam')
+            with open(prelim_sam, 'w') as f:
+                f.write('@HD\tVN:1.0\tSO:unsorted\n')
+                f.write('@SQ\tSN:R1\tLN:5\n')
+                f.write(prelim_rows)
+            remap.remap(os.path.join(test_path,
+                                     'microtest',
+                                     '1234A-V3LOOP_S1_L001_R1_001.fastq'),
+                        os.path.join(test_path,
+                                     'microtest',
+                                     '1234A-V3LOOP_S1_L001_R2_001.fastq'),
+                        None,
+                        StringIO(),
+                        remap_counts_csv,
+                        StringIO(),
+                        StringIO(),
+                        StringIO(),
+                        work_path=work_path,
+                        prelim_sam=prelim_sam,
+                        prelim_counts_csv=prelim_counts_csv)
 
         self.assertEqual(expected_remap_counts_csv, remap_counts_csv.getvalue())
@@ -0,0 +1,119 @@
+import sys
+from unittest import TestCase, skipUnless
+from unittest.mock import patch
+
+from micall.utils.startup_benchmark import parse_import_times, \
+    find_slow_imports, measure_import, find_errors, check_entry_point, \
+    ENTRY_POINTS
+
+
+class ParseImportTimesTest(TestCase):
+    def test_parse(self):
+        report = """\
+import time: self [us] | cumulative | imported package
+import time:       200 |        200 |     _json
+import time:       500 |        700 |   json
+import time:      1200 |       1200 |   numpy.core
+import time:      3000 |       4900 | micall.core.example
+"""
+
+        milliseconds, imported = parse_import_times(report,
+                                                    'micall.core.example')
+
+        self.assertEqual(4.9, milliseconds)
+        self.assertEqual({'_json', 'json', 'numpy.core', 'micall.core.example'},
+                         imported)
+
+    def test_slow_imports(self):
+        imported = {'json', 'numpy.core', 'xml.dom.minidom', 'yamlish'}
+
+        slow_imports = find_slow_imports(imported)
+
+        self.assertEqual({'numpy', 'xml.dom.minidom'}, slow_imports)
+
+
+class FindErrorsTest(TestCase):
+    def setUp(self):
+        patcher = patch.dict(ENTRY_POINTS,
+                             {'micall.example': (100, {'numpy'})})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_within_budget(self):
+        errors = find_errors('micall.example', 99, {'json'})
+
+        self.assertEqual([], errors)
+
+    def test_over_budget(self):
+        expected_errors = [
+            'micall.example took 150ms, over its budget of 100ms.']
+
+        errors = find_errors('micall.example', 150, {'json'})
+
+        self.assertEqual(expected_errors, errors)
+
+    def test_scaled_budget(self):
+        errors = find_errors('micall.example', 150, {'json'}, scale=2)
+
+        self.assertEqual([], errors)
+
+    def test_slow_import(self):
+        expected_errors = [
+            'micall.example imported matplotlib, yaml at start up.']
+
+        errors = find_errors('micall.example',
+                             50,
+                             {'matplotlib.pyplot', 'yaml'})
+
+        self.assertEqual(expected_errors, errors)
+
+    def test_allowed_slow_import(self):
+        errors = find_errors('micall.example', 50, {'numpy.core'})
+
+        self.assertEqual([], errors)
+
+
+class CheckEntryPointTest(TestCase):
+    def setUp(self):
+        patcher = patch.dict(ENTRY_POINTS,
+                             {'micall.example': (100, set())})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = patch('micall.utils.startup_benchmark.measure_import')
+        self.measure_import = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_median(self):
+        """ One slow import doesn't break the budget. """
+        self.measure_import.side_effect = [(90, {'json'}),
+                                           (500, {'json'}),
+                                           (80, {'json'})]
+
+        milliseconds, errors = check_entry_point('micall.example', repeat=3)
+
+        self.assertEqual(90, milliseconds)
+        self.assertEqual([], errors)
+
+    def test_over_budget(self):
+        expected_errors = [
+            'micall.example took 120ms, over its budget of 100ms.']
+        self.measure_import.side_effect = [(120, {'json'}),
+                                           (500, {'json'}),
+                                           (80, {'json'})]
+
+        _, errors = check_entry_point('micall.example', repeat=3)
+
+        self.assertEqual(expected_errors, errors)
+
+
+@skipUnless(sys.version_info >= (3, 7), 'python -X importtime needs 3.7.')
+class EntryPointImportsTest(TestCase):
+    def test_slow_imports(self):
+        """ Slow imports don't depend on the machine, unlike the budgets. """
+        for module_name, (_, allowed_libraries) in sorted(ENTRY_POINTS.items()):
+            with self.subTest(module_name):
+                _, imported = measure_import(module_name)
+
+                self.assertEqual(
+                    set(),
+                    find_slow_imports(imported) - allowed_libraries)
@@ -3,7 +3,7 @@ from struct import pack
 from unittest import TestCase
 
 from micall.monitor.tile_metrics_parser import read_tiles, MetricCodes,\
-    summarize_tile_records
+    summarize_tile_records, read_tile_array, summarize_tile_array
 
 
 class TileMetricsParserTest(TestCase):
@@ -82,3 +82,16 @@ class TileMetricsParserTest(TestCase):
         summarize_tile_records(records, summary)
 
         self.assertEqual(expected_summary, summary)
+
+    def test_summarize_array(self):
+        self.sample_data.extend([1, 2, MetricCodes.CLUSTER_COUNT, 100.0,
+                                 1, 2, MetricCodes.CLUSTER_COUNT_PASSING_FILTERS, 25.0])
+        format_string = '<BB' + 3*'HHHf'
+        self.sample_stream = BytesIO(pack(format_string, *self.sample_data))
+        expected_summary = dict(cluster_density=4.0, pass_rate=0.25)
+
+        records = read_tile_array(self.sample_stream)
+        summary = {}
+        summarize_tile_array(records, summary)
+
+        self.assertEqual(expected_summary, summary)
@@ -1,5 +1,6 @@
 import unittest
-from micall.utils.translation import translate, reverse_and_complement
+from micall.utils.translation import translate, reverse_and_complement, \
+    translate_batch
 
 
 class TranslateTest(unittest.TestCase):
@@ -176,6 +177,44 @@ class TranslateTest(unittest.TestCase):
         self.assertEqual(expected_stats, stats)
 
 
+    def testReturnListCanBeModified(self):
+        nucs = 'CGATTM'  # TTA or TTC: map to L or F
+        expected_aminos = [['R'], ['F', 'L']]
+
+        aminos = translate(nucs, return_list=True)
+        aminos[1][0] = 'X'
+        aminos = translate(nucs, return_list=True)
+
+        self.assertEqual(expected_aminos, aminos)
+
+
+class TranslateBatchTest(unittest.TestCase):
+    def testBatch(self):
+        nucs = ['TTT', 'CGATTM', 'TTT', 'TTTA']
+        expected_aminos = ['F', 'R?', 'F', 'F']
+
+        aminos = translate_batch(nucs)
+
+        self.assertEqual(expected_aminos, aminos)
+
+    def testBatchOptions(self):
+        nucs = ['TTT', 'CGATTM']
+        expected_aminos = [[['F']], [['R'], ['F', 'L']]]
+
+        aminos = translate_batch(nucs, return_list=True)
+
+        self.assertEqual(expected_aminos, aminos)
+
+    def testRepeatedListsNotShared(self):
+        nucs = ['TTT', 'TTT']
+        expected_aminos = [[['X']], [['F']]]
+
+        aminos = translate_batch(nucs, return_list=True)
+        aminos[0][0][0] = 'X'
+
+        self.assertEqual(expected_aminos, aminos)
+
+
 class ReverseAndComplementTest(unittest.TestCase):
     def testSimple(self):
         fwd = 'ACTG'
@@ -184,3 +223,19 @@ class ReverseAndComplementTest(unittest.TestCase):
         rev = reverse_and_complement(fwd)
 
         self.assertEqual(expected, rev)
+
+    def testMixtures(self):
+        fwd = 'ACTGRYN-'
+        expected = '-NRYCAGT'
+
+        rev = reverse_and_complement(fwd)
+
+        self.assertEqual(expected, rev)
+
+    def testUnknownNucleotide(self):
+        with self.assertRaises(KeyError):
+            reverse_and_complement('ACXG')
+
+    def testNonAsciiNucleotide(self):
+        with self.assertRaisesRegex(KeyError, 'É'):
+            reverse_and_complement('ACÉG')
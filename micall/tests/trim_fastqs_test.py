@@ -2,9 +2,16 @@ import csv
 import os
 from io import BytesIO
 from io import StringIO
+import subprocess
+import sys
+from tempfile import TemporaryDirectory
 import unittest
+from unittest.mock import patch, Mock, DEFAULT
 
-from micall.core.trim_fastqs import censor
+from micall.core.trim_fastqs import censor, censor_files, trim, \
+    build_cycle_masks, save_cycle_masks, load_cycle_masks
+from micall.utils.externals import CutAdapt
+from micall.utils.fastq_parser import load_record_count, FastqError
 
 
 class CensorTest(unittest.TestCase):
@@ -60,6 +67,40 @@ AA#A
 AC
 +
 AA
+"""
+
+        censor(self.original_file,
+               self.bad_cycles,
+               self.censored_file,
+               use_gzip=False)
+
+        self.assertEqual(expected_text, self.censored_file.getvalue())
+
+    def testBadCyclesPastEnd(self):
+        self.bad_cycles = [{'tile': '1101', 'cycle': '2'},
+                           {'tile': '1101', 'cycle': '10'}]
+        expected_text = """\
+@M01841:45:000000000-A5FEG:1:1101:5296:13227 1:N:0:9
+ANGT
++
+A#AA
+"""
+
+        censor(self.original_file,
+               self.bad_cycles,
+               self.censored_file,
+               use_gzip=False)
+
+        self.assertEqual(expected_text, self.censored_file.getvalue())
+
+    def testAllBadCycles(self):
+        self.bad_cycles = [{'tile': '1101', 'cycle': str(cycle)}
+                           for cycle in range(1, 5)]
+        expected_text = """\
+@M01841:45:000000000-A5FEG:1:1101:5296:13227 1:N:0:9
+
++
+
 """
 
         censor(self.original_file,
@@ -205,3 +246,259 @@ avg_quality,base_count
                summary_writer=self.summary_writer)
 
         self.assertEqual(expected_summary, self.summary_file.getvalue())
+
+
+class CensorFilesTest(unittest.TestCase):
+    def setUp(self):
+        self.addTypeEqualityFunc(str, self.assertMultiLineEqual)
+        self.working_dir = TemporaryDirectory()
+        self.addCleanup(self.working_dir.cleanup)
+
+    def create_fastq(self, name, text):
+        path = os.path.join(self.working_dir.name, name)
+        with open(path, 'w') as f:
+            f.write(text)
+        return path
+
+    def read_file(self, path):
+        with open(path) as f:
+            return f.read()
+
+    def testPairedFiles(self):
+        original_filenames = [
+            self.create_fastq('original1.fastq', """\
+@M01841:45:000000000-A5FEG:1:1101:5296:13227 1:N:0:9
+ACGT
++
+AAAA
+"""),
+            self.create_fastq('original2.fastq', """\
+@M01841:45:000000000-A5FEG:1:1101:5296:13227 2:N:0:9
+TTGCA
++
+CCCCC
+""")]
+        censored_filenames = [os.path.join(self.working_dir.name, name)
+                              for name in ('censored1.fastq',
+                                           'censored2.fastq')]
+        bad_cycles = [{'tile': '1101', 'cycle': '2'},
+                      {'tile': '1101', 'cycle': '-3'}]
+        expected_text1 = """\
+@M01841:45:000000000-A5FEG:1:1101:5296:13227 1:N:0:9
+ANGT
++
+A#AA
+"""
+        expected_text2 = """\
+@M01841:45:000000000-A5FEG:1:1101:5296:13227 2:N:0:9
+TTNCA
++
+CC#CC
+"""
+        expected_summaries = [dict(avg_quality=32.0, base_count=4, read_count=1),
+                              dict(avg_quality=34.0, base_count=5, read_count=1)]
+
+        summaries = censor_files(original_filenames,
+                                 bad_cycles,
+                                 censored_filenames,
+                                 use_gzip=False)
+
+        self.assertEqual(expected_summaries, summaries)
+        self.assertEqual(expected_text1, self.read_file(censored_filenames[0]))
+        self.assertEqual(expected_text2, self.read_file(censored_filenames[1]))
+
+    def testBuiltinTrimmer(self):
+        original_filenames = [
+            self.create_fastq('original1.fastq', """\
+@M01841:45:000000000-A5FEG:1:1101:5296:13227 1:N:0:9
+ACGTCTGTCTCTTATACACATCTCCG
++
+AAAAAAAAAAAAAAAAAAAAAAAAAA
+"""),
+            self.create_fastq('original2.fastq', """\
+@M01841:45:000000000-A5FEG:1:1101:5296:13227 2:N:0:9
+TTGCA
++
+CCCCC
+""")]
+        trimmed_filenames = [os.path.join(self.working_dir.name, name)
+                             for name in ('trimmed1.fastq', 'trimmed2.fastq')]
+        bad_cycles_filename = os.path.join(self.working_dir.name,
+                                           'bad_cycles.csv')  # missing
+        summary_file = StringIO()
+        expected_text1 = """\
+@M01841:45:000000000-A5FEG:1:1101:5296:13227 1:N:0:9
+ACGT
++
+AAAA
+"""
+        expected_text2 = """\
+@M01841:45:000000000-A5FEG:1:1101:5296:13227 2:N:0:9
+TTGCA
++
+CCCCC
+"""
+        expected_summary = """\
+avg_quality,base_count
+32.0,26
+34.0,5
+"""
+
+        trim(original_filenames,
+             bad_cycles_filename,
+             trimmed_filenames,
+             use_gzip=False,
+             summary_file=summary_file,
+             use_cutadapt=False)
+
+        self.assertEqual(expected_text1, self.read_file(trimmed_filenames[0]))
+        self.assertEqual(expected_text2, self.read_file(trimmed_filenames[1]))
+        self.assertEqual(expected_summary, summary_file.getvalue())
+        self.assertEqual(1, load_record_count(trimmed_filenames[0]))
+        self.assertEqual(1, load_record_count(trimmed_filenames[1]))
+
+    def testBuiltinTrimmerWorkers(self):
+        """ Trimming in worker processes keeps the batches in order. """
+        adapter = 'CTGTCTCTTATACACATCT'
+        read_count = 45000  # several batches
+        original_filenames = [
+            self.create_fastq(
+                'original{}.fastq'.format(read_number),
+                ''.join('@M01841:45:000000000-A5FEG:1:1101:{}:1 {}:N:0:9\n'
+                        '{}\n+\n{}\n'.format(
+                            i,
+                            read_number,
+                            'ACGT'[i % 4]*(i % 7 + 3) + adapter[:i % 11],
+                            'A'*(i % 7 + 3 + i % 11))
+                        for i in range(read_count)))
+            for read_number in (1, 2)]
+        results = []
+        for trim_workers in (1, 2):
+            trimmed_filenames = [
+                os.path.join(self.working_dir.name,
+                             'trimmed{}_{}.fastq'.format(i, trim_workers))
+                for i in (1, 2)]
+            trim(original_filenames,
+                 'missing_bad_cycles.csv',
+                 trimmed_filenames,
+                 use_gzip=False,
+                 use_cutadapt=False,
+                 trim_workers=trim_workers)
+            results.append([self.read_file(filename)
+                            for filename in trimmed_filenames])
+        single_result, pool_result = results
+
+        self.assertEqual(single_result, pool_result)
+        self.assertEqual(read_count * 4, single_result[0].count('\n'))
+        self.assertNotIn('AAAAAAACTGT', single_result[0])  # adapter trimmed
+
+    def testSharedCycleMasks(self):
+        original_filenames = [
+            self.create_fastq('original1.fastq', """\
+@M01841:45:000000000-A5FEG:1:1101:5296:13227 1:N:0:9
+ACGT
++
+AAAA
+"""),
+            self.create_fastq('original2.fastq', """\
+@M01841:45:000000000-A5FEG:1:1101:5296:13227 2:N:0:9
+TTGCA
++
+CCCCC
+""")]
+        trimmed_filenames = [os.path.join(self.working_dir.name, name)
+                             for name in ('trimmed1.fastq', 'trimmed2.fastq')]
+        masks_filename = os.path.join(self.working_dir.name, 'bad_cycles.npy')
+        save_cycle_masks(build_cycle_masks([{'tile': '1101', 'cycle': '2'},
+                                            {'tile': '1101', 'cycle': '-5'}]),
+                         masks_filename)
+        expected_text1 = """\
+@M01841:45:000000000-A5FEG:1:1101:5296:13227 1:N:0:9
+ANGT
++
+A#AA
+"""
+        expected_text2 = """\
+@M01841:45:000000000-A5FEG:1:1101:5296:13227 2:N:0:9
+TTGC
++
+CCCC
+"""
+
+        trim(original_filenames,
+             'missing_bad_cycles.csv',
+             trimmed_filenames,
+             use_gzip=False,
+             use_cutadapt=False,
+             cycle_masks=load_cycle_masks(masks_filename))
+
+        self.assertEqual(expected_text1, self.read_file(trimmed_filenames[0]))
+        self.assertEqual(expected_text2, self.read_file(trimmed_filenames[1]))
+
+    @unittest.skipUnless(hasattr(os, 'mkfifo'), 'Needs named pipes.')
+    def testCensorFailsWithFifos(self):
+        """ Cutadapt gets stopped when censoring fails. """
+        original_filenames = [
+            self.create_fastq('original1.fastq', """\
+garbage
+ACGT
++
+AAAA
+"""),
+            self.create_fastq('original2.fastq', """\
+@M01841:45:000000000-A5FEG:1:1101:5296:13227 2:N:0:9
+TTGCA
++
+CCCCC
+""")]
+        trimmed_filenames = [os.path.join(self.working_dir.name, name)
+                             for name in ('trimmed1.fastq', 'trimmed2.fastq')]
+        processes = []
+
+        def create_process(args, **kwargs):
+            # Open the named pipes like cutadapt, then never finish.
+            script = ('import sys, time\n'
+                      'files = [open(name) for name in sys.argv[1:]]\n'
+                      'time.sleep(60)\n')
+            command = [sys.executable, '-c', script] + args[-2:]
+            process = subprocess.Popen(command, **kwargs)
+            processes.append(process)
+            return process
+
+        with patch.multiple(CutAdapt,
+                            __init__=Mock(return_value=None),
+                            create_process=DEFAULT) as mocks:
+            mocks['create_process'].side_effect = create_process
+            with self.assertRaises(FastqError):
+                trim(original_filenames,
+                     'missing_bad_cycles.csv',
+                     trimmed_filenames,
+                     use_gzip=False,
+                     use_fifos=True)
+
+        self.assertIsNotNone(processes[0].poll())
+
+
+class CycleMasksFileTest(unittest.TestCase):
+    def test_save_and_load(self):
+        cycle_masks = build_cycle_masks([{'tile': '1101', 'cycle': '3'},
+                                         {'tile': '1101', 'cycle': '-1'},
+                                         {'tile': '2101', 'cycle': '5'}])
+        expected_masks = {key: mask.tolist()
+                          for key, mask in cycle_masks.items()}
+
+        with TemporaryDirectory() as working_dir:
+            filename = os.path.join(working_dir, 'bad_cycles.npy')
+            save_cycle_masks(cycle_masks, filename)
+            loaded_masks = {key: mask.tolist()
+                            for key, mask in load_cycle_masks(filename).items()}
+
+        self.assertEqual(expected_masks, loaded_masks)
+
+    def test_empty(self):
+        with TemporaryDirectory() as working_dir:
+            filename = os.path.join(working_dir, 'bad_cycles.npy')
+            save_cycle_masks({}, filename)
+            loaded_masks = load_cycle_masks(filename)
+
+        self.assertEqual({}, loaded_masks)
@@ -0,0 +1,123 @@
+""" Trim 3' adapters from reads without starting a cutadapt process.
+
+This follows cutadapt's defaults for regular 3' adapters: the adapter can
+start anywhere in the read, and can run off the end of the read if at least
+MIN_OVERLAP bases overlap. The number of mismatches must be no more than
+ERROR_RATE times the overlap length, and the adapter with the most matching
+bases wins. Unlike cutadapt, only substitutions are allowed, not insertions
+or deletions, so the search is a simple overlap scan over whole batches of
+reads.
+"""
+
+import numpy as np
+
+ERROR_RATE = 0.1
+MIN_OVERLAP = 3
+BATCH_SIZE = 1000  # reads to compare at once, limits memory use
+
+
+def read_adapters(fasta_filename):
+    """ Read adapter sequences from a FASTA file.
+
+    :param fasta_filename: the FASTA file to read, like adapters_read1.fasta
+    :return: a list of adapter sequences, in the same order as the file
+    """
+    adapters = []
+    with open(fasta_filename) as fasta:
+        for line in fasta:
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith('>'):
+                adapters.append('')
+            else:
+                adapters[-1] += line.upper()
+    return adapters
+
+
+class AdapterTrimmer(object):
+    """ Finds and trims a set of 3' adapters.
+
+    Trimmers can be pickled, so batches can be trimmed in worker processes.
+    """
+    def __init__(self,
+                 adapters,
+                 error_rate=ERROR_RATE,
+                 min_overlap=MIN_OVERLAP):
+        """ Initialize.
+
+        :param adapters: a list of adapter sequences
+        :param error_rate: the maximum fraction of mismatches in an overlap
+        :param min_overlap: the minimum number of bases that have to overlap
+            the end of a read
+        """
+        self.adapters = [np.frombuffer(adapter.encode('ascii'), dtype=np.uint8)
+                         for adapter in adapters]
+        self.min_overlap = min_overlap
+        max_length = max((len(adapter) for adapter in adapters), default=0)
+        # allowed mismatches for each overlap length
+        self.max_errors = (np.arange(max_length+1) * error_rate).astype(int)
+
+    @classmethod
+    def from_fasta(cls, fasta_filename, **kwargs):
+        return cls(read_adapters(fasta_filename), **kwargs)
+
+    def find_trimmed_lengths(self, seqs):
+        """ Find how much of each read to keep after trimming adapters.
+
+        :param seqs: a list of base call strings
+        :return: an array of lengths, one for each read
+        """
+        trimmed_lengths = np.array([len(seq) for seq in seqs], dtype=np.int64)
+        for start in range(0, len(seqs), BATCH_SIZE):
+            end = start + BATCH_SIZE
+            trimmed_lengths[start:end] = self._find_batch_lengths(
+                seqs[start:end],
+                trimmed_lengths[start:end])
+        return trimmed_lengths
+
+    def _find_batch_lengths(self, seqs, seq_lengths):
+        trimmed_lengths = seq_lengths.copy()
+        if not self.adapters or not seqs:
+            return trimmed_lengths
+        max_seq_length = int(seq_lengths.max())
+        max_adapter_length = max(adapter.size for adapter in self.adapters)
+
+        # Pad each read with zeros, so it never matches past its end.
+        padded = np.zeros((len(seqs), max_seq_length + max_adapter_length),
+                          dtype=np.uint8)
+        for i, seq in enumerate(seqs):
+            padded[i, :len(seq)] = np.frombuffer(seq.encode('ascii'),
+                                                 dtype=np.uint8)
+        offsets = np.arange(max_seq_length)
+        remaining = seq_lengths[:, None] - offsets[None, :]
+        best_matches = np.full(len(seqs), -1, dtype=np.int64)
+        for adapter in self.adapters:
+            matches = np.zeros((len(seqs), max_seq_length), dtype=np.int16)
+            for i, base in enumerate(adapter):
+                matches += padded[:, i:i+max_seq_length] == base
+            overlaps = np.clip(remaining, 0, adapter.size)
+            errors = overlaps - matches
+            is_match = overlaps >= self.min_overlap
+            is_match &= errors <= self.max_errors[overlaps]
+            scores = np.where(is_match, matches, -1)
+            match_offsets = scores.argmax(axis=1)  # leftmost wins a tie
+            match_scores = scores[np.arange(len(seqs)), match_offsets]
+            is_better = match_scores > best_matches
+            best_matches[is_better] = match_scores[is_better]
+            trimmed_lengths[is_better] = match_offsets[is_better]
+        return trimmed_lengths
+
+    def trim_records(self, records):
+        """ Trim adapters from a batch of FASTQ records.
+
+        This is a method on a picklable object, so it can run in a pool.
+        :param records: a list of (header, bases, separator, quality) tuples
+        :return: a list of trimmed records
+        """
+        trimmed_lengths = self.find_trimmed_lengths(
+            [seq for _, seq, _, _ in records]).tolist()
+        return [(header, seq[:length], separator, qual[:length])
+                for (header, seq, separator, qual), length in zip(
+                    records,
+                    trimmed_lengths)]
@@ -1,13 +1,26 @@
 from collections import Counter
 from csv import DictWriter, DictReader
+import heapq
+from itertools import groupby
+from operator import itemgetter
 import os
 from tempfile import TemporaryFile
 
 
 class BigCounter:
-    def __init__(self, file_prefix, max_size=5000):
+    def __init__(self, file_prefix, max_size=5000, keep_size=None):
+        """ Count keys, and write the counts to temp files when there are
+        too many to hold in memory.
+
+        :param file_prefix: path and file name prefix for the temp files
+        :param max_size: maximum number of keys to hold in memory
+        :param keep_size: number of the most frequent keys to keep in memory
+            when the others are written to a temp file, so frequent keys
+            aren't written to every temp file. Defaults to a tenth of max_size.
+        """
         self.file_prefix = os.path.abspath(file_prefix)
         self.max_size = max_size
+        self.keep_size = max_size // 10 if keep_size is None else keep_size
         self.cache_files = []
         self.active_counts = Counter()
 
@@ -29,39 +42,33 @@ class BigCounter:
             self._write_cache()
             
     def _write_cache(self):
+        kept_counts = Counter()
+        if self.keep_size:
+            # Only keep keys that have been seen more than once.
+            for key, count in self.active_counts.most_common(self.keep_size):
+                if count <= 1:
+                    break
+                kept_counts[key] = count
         cache = TemporaryFile(mode='w+', prefix=self.file_prefix, suffix='.csv')
         self.cache_files.append(cache)
-        keys = sorted(self.active_counts)
+        keys = sorted(key for key in self.active_counts if key not in kept_counts)
         writer = DictWriter(cache, ['key', 'count'])
         writer.writeheader()
         for key in keys:
             writer.writerow(dict(key=key, count=self.active_counts[key]))
-        self.active_counts.clear()
+        self.active_counts = kept_counts
 
     def items(self):
-        item_count = 0
         active_keys = sorted(self.active_counts)
-        readers = [(dict(key=key, count=self.active_counts[key])
-                    for key in active_keys)]
+        readers = [((key, self.active_counts[key]) for key in active_keys)]
         for cache in self.cache_files:
             cache.seek(0)
             # noinspection PyTypeChecker
-            readers.append(DictReader(cache))
-        next_rows = [next(reader) for reader in readers]
-        while any(next_rows):
-            min_key = min(row['key']
-                          for row in next_rows
-                          if row is not None)
-            count = 0
-            for i, row in enumerate(next_rows):
-                if row is not None and row['key'] == min_key:
-                    count += int(row['count'])
-                    try:
-                        next_rows[i] = next(readers[i])
-                    except StopIteration:
-                        next_rows[i] = None
-            yield min_key, count
-            item_count += 1
+            readers.append((row['key'], int(row['count']))
+                           for row in DictReader(cache))
+        merged = heapq.merge(*readers)
+        for key, items in groupby(merged, itemgetter(0)):
+            yield key, sum(count for _, count in items)
 
     def clear(self):
         for cache in self.cache_files:
@@ -0,0 +1,108 @@
+""" Read files and pipes in large blocks, instead of line by line.
+
+A background thread can read ahead of the caller, so slow sources like
+decompression or a child process's output overlap with whatever the caller
+does with each block.
+"""
+
+import codecs
+from queue import Queue, Full
+from threading import Event, Thread
+
+BLOCK_SIZE = 1 << 20  # bytes to read at a time
+READ_AHEAD_BLOCKS = 4  # blocks to read before they are needed
+
+
+class ReadAheadReader(object):
+    """ Read blocks from a file in a background thread.
+
+    The thread stays up to READ_AHEAD_BLOCKS ahead of the caller, so reading
+    overlaps with whatever the caller does with each block. Blocks are bytes
+    or text, whatever the source returns.
+    """
+    def __init__(self, source, block_size=BLOCK_SIZE, max_blocks=READ_AHEAD_BLOCKS):
+        """ Start reading.
+
+        :param source: an open file, or anything else with a read() method.
+            Only the background thread reads from it until close() is called.
+        :param block_size: the number of bytes or characters to read at a time
+        :param max_blocks: the number of blocks to read ahead
+        """
+        self.source = source
+        self.block_size = block_size
+        self.blocks = Queue(max_blocks)
+        self.buffer = b''
+        self.is_finished = False
+        self.is_closed = Event()
+        self.thread = Thread(target=self._read_blocks, daemon=True)
+        self.thread.start()
+
+    def _read_blocks(self):
+        try:
+            while True:
+                block = self.source.read(self.block_size)
+                self._put(block)
+                if not block:
+                    break
+        except Exception as ex:
+            self._put(ex)
+
+    def _put(self, item):
+        while not self.is_closed.is_set():
+            try:
+                self.blocks.put(item, timeout=0.1)
+                return
+            except Full:
+                pass
+
+    def read(self, size=-1):
+        """ Read up to size bytes or characters, or everything if size < 0. """
+        while not self.is_finished and (size < 0 or len(self.buffer) < size):
+            block = self.blocks.get()
+            if isinstance(block, Exception):
+                self.is_finished = True
+                raise block
+            if not block:
+                self.is_finished = True
+            elif self.buffer:
+                self.buffer += block
+            else:
+                self.buffer = block
+        if size < 0:
+            size = len(self.buffer)
+        data = self.buffer[:size]
+        self.buffer = self.buffer[size:]
+        return data
+
+    def close(self):
+        """ Stop the background thread. """
+        self.is_closed.set()
+        self.thread.join()
+
+
+def read_lines(source, block_size=BLOCK_SIZE):
+    """ Yield lists of complete lines, read from a file in large blocks.
+
+    :param source: an open file, in binary or text mode, or anything else
+        with a read() method
+    :param block_size: the number of bytes or characters to read at a time
+    :return: a generator of lists of lines, without line endings
+    """
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    tail = ''
+    while True:
+        block = source.read(block_size)
+        if not block:
+            break
+        if not isinstance(block, str):
+            block = decoder.decode(block)
+        text = tail + block
+        lines = text.split('\n')
+        tail = lines.pop()
+        if '\r' in text:
+            # A line ending can be split between blocks, so check them all.
+            lines = [line.rstrip('\r') for line in lines]
+        yield lines
+    tail += decoder.decode(b'', final=True)
+    if tail:
+        yield [tail.rstrip('\r')]
@@ -4,6 +4,8 @@ import sys
 import re
 from subprocess import CalledProcessError
 
+from micall.utils.block_reader import ReadAheadReader, read_lines
+
 
 class AssetWrapper(object):
     """ Wraps a packaged asset, and finds its path. """
@@ -102,6 +104,9 @@ class CommandWrapper(AssetWrapper):
         Raise an exception if the return code is not zero.
         Standard error is written to standard error and not returned, unless
         you specify stderr=subprocessing.STDOUT as a keyword argument.
+        Lines are passed through as the subprocess wrote them, including line
+        endings. See yield_output_batches() for a faster way to read a lot of
+        output.
         @param args: A list of arguments to pass to subprocess.Popen().
         @param popenargs: other positional arguments to pass along
         @param kwargs: keyword arguments to pass along
@@ -117,6 +122,42 @@ class CommandWrapper(AssetWrapper):
             raise subprocess.CalledProcessError(p.returncode,
                                                 self.build_args(args))
 
+    def yield_output_batches(self, args, *popenargs, **kwargs):
+        """ Launch a subprocess, and yield lists of lines of standard output.
+
+        A background thread reads standard output in large blocks, and stays
+        a few blocks ahead of the caller, so the subprocess can keep writing
+        while the caller processes the previous batch. If the caller falls
+        behind, the pipe fills up and the subprocess waits. Raise an exception
+        if the return code is not zero, and kill the subprocess if the caller
+        stops early. Standard input is empty, unless you pass stdin as a
+        keyword argument.
+        @param args: A list of arguments to pass to subprocess.Popen().
+        @param popenargs: other positional arguments to pass along
+        @param kwargs: keyword arguments to pass along
+        @return: a generator of lists of lines, without line endings
+        """
+        kwargs.setdefault('stdin', subprocess.DEVNULL)
+        p = self.create_process(args,
+                                stdout=subprocess.PIPE,
+                                *popenargs,
+                                **kwargs)
+        reader = ReadAheadReader(p.stdout)
+        is_finished = False
+        try:
+            for lines in read_lines(reader):
+                yield lines
+            is_finished = True
+        finally:
+            if not is_finished:
+                p.kill()
+            reader.close()
+            p.stdout.close()
+            p.wait()
+        if p.returncode:
+            raise subprocess.CalledProcessError(p.returncode,
+                                                self.build_args(args))
+
     def redirect_call(self, args, outpath, format_string='%s', ignored=None):
         """ Launch a subprocess, and redirect the output to a file.
 
@@ -0,0 +1,179 @@
+""" Fast FASTQ parsing that is shared by all the steps that read FASTQ files.
+
+Files are read in large blocks instead of line by line. Plain files are
+memory-mapped, and gzip files are decompressed as a stream, optionally in a
+background thread. zlib releases the GIL while it decompresses, so that
+overlaps with parsing the previous block.
+"""
+
+from collections import defaultdict
+from contextlib import contextmanager
+import gzip
+from io import BytesIO
+import json
+import mmap
+import os
+from tempfile import NamedTemporaryFile
+
+try:
+    import fcntl
+except ImportError:
+    # Not available on Windows, so the counts file isn't locked there.
+    fcntl = None
+
+from micall.utils.block_reader import BLOCK_SIZE, ReadAheadReader, read_lines
+
+BATCH_SIZE = 10000  # records in each batch
+RECORD_COUNTS_FILENAME = 'fastq_counts.json'  # in the same folder as FASTQs
+
+
+class FastqError(Exception):
+    pass
+
+
+@contextmanager
+def open_fastq(filename, use_gzip=None, read_ahead=False):
+    """ Open a FASTQ file for fast, binary reading.
+
+    Use as a context manager.
+    :param filename: the FASTQ file to open
+    :param use_gzip: True if the file is compressed, None to decide by the
+        file name's extension
+    :param read_ahead: True if a compressed file should be decompressed in
+        a background thread, while the caller works on earlier blocks
+    :return: a binary file-like object that supports read(). Plain files are
+        memory-mapped.
+    """
+    if use_gzip is None:
+        use_gzip = filename.endswith('.gz')
+    if use_gzip:
+        with gzip.open(filename, 'rb') as fastq:
+            if not read_ahead:
+                yield fastq
+                return
+            reader = ReadAheadReader(fastq)
+            try:
+                yield reader
+            finally:
+                reader.close()
+        return
+    with open(filename, 'rb') as fastq:
+        if os.fstat(fastq.fileno()).st_size == 0:
+            # Can't map an empty file.
+            yield BytesIO()
+            return
+        mapped = mmap.mmap(fastq.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            yield mapped
+        finally:
+            mapped.close()
+
+
+def read_record_batches(fastq, batch_size=BATCH_SIZE, block_size=BLOCK_SIZE):
+    """ Yield batches of FASTQ records.
+
+    :param fastq: an open file, in binary or text mode
+    :param batch_size: the maximum number of records in each batch
+    :param block_size: the number of bytes or characters to read at a time
+    :return: a generator of lists of records, where each record is a tuple of
+        four lines: (header, bases, separator, quality), without line endings.
+    """
+    pending = []
+    for lines in read_lines(fastq, block_size):
+        if pending:
+            lines = pending + lines
+        record_count = len(lines) // 4
+        line_count = record_count * 4
+        pending = lines[line_count:]
+        for start in range(0, record_count, batch_size):
+            batch_lines = lines[start*4:min(start+batch_size, record_count)*4]
+            line_iter = iter(batch_lines)
+            batch = list(zip(line_iter, line_iter, line_iter, line_iter))
+            check_records(batch)
+            yield batch
+    if any(pending):
+        raise FastqError('Incomplete FASTQ record: {!r}.'.format(pending))
+
+
+def read_records(fastq, block_size=BLOCK_SIZE):
+    """ Yield FASTQ records.
+
+    :param fastq: an open file, in binary or text mode
+    :param block_size: the number of bytes or characters to read at a time
+    :return: a generator of records, where each record is a tuple of
+        four lines: (header, bases, separator, quality), without line endings.
+    """
+    for batch in read_record_batches(fastq, block_size=block_size):
+        yield from batch
+
+
+def check_records(records):
+    for header, _, separator, _ in records:
+        if not header.startswith('@'):
+            raise FastqError('Invalid FASTQ header: {!r}.'.format(header))
+        if not separator.startswith('+'):
+            raise FastqError('Invalid FASTQ separator: {!r}.'.format(separator))
+
+
+def save_record_counts(record_counts):
+    """ Record how many records were written to some FASTQ files.
+
+    Steps that write FASTQ files already see every record, so they can save
+    the counts, and later steps don't have to read the whole file again.
+    The counts are saved in RECORD_COUNTS_FILENAME, in the same folder as
+    each FASTQ file, along with the file's size and modification time to
+    check that they're current. Samples can share a folder, so the counts
+    file is locked while it's updated, and replaced in one step.
+    :param record_counts: {fastq_filename: record_count}, where each file has
+        been completely written and flushed
+    """
+    folder_counts = defaultdict(dict)
+    for filename, record_count in record_counts.items():
+        folder, name = os.path.split(os.path.abspath(filename))
+        folder_counts[folder][name] = dict(records=record_count,
+                                           **get_file_stamp(filename))
+    for folder, counts in folder_counts.items():
+        counts_filename = os.path.join(folder, RECORD_COUNTS_FILENAME)
+        with open(counts_filename + '.lock', 'w') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            all_counts = read_counts_file(counts_filename)
+            all_counts.update(counts)
+            with NamedTemporaryFile('w',
+                                    dir=folder,
+                                    prefix=RECORD_COUNTS_FILENAME,
+                                    delete=False) as counts_file:
+                json.dump(all_counts, counts_file, indent=2, sort_keys=True)
+            os.replace(counts_file.name, counts_filename)
+
+
+def load_record_count(fastq_filename):
+    """ Load a record count that was saved by save_record_counts().
+
+    :param fastq_filename: the FASTQ file that was counted
+    :return: the number of records, or None if the count wasn't saved, or if
+        the file has changed since.
+    """
+    folder, name = os.path.split(os.path.abspath(fastq_filename))
+    counts = read_counts_file(os.path.join(folder, RECORD_COUNTS_FILENAME))
+    count = counts.get(name)
+    if count is None:
+        return None
+    stamp = get_file_stamp(fastq_filename)
+    if any(count.get(key) != value for key, value in stamp.items()):
+        return None
+    return count['records']
+
+
+def get_file_stamp(filename):
+    """ Get the size and modification time that show a file has changed. """
+    stats = os.stat(filename)
+    return dict(size=stats.st_size, mtime_ns=stats.st_mtime_ns)
+
+
+def read_counts_file(counts_filename):
+    try:
+        with open(counts_filename) as counts_file:
+            return json.load(counts_file)
+    except FileNotFoundError:
+        return {}
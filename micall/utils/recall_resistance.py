@@ -0,0 +1,45 @@
+#! /usr/bin/env python3.4
+""" Recalculate resistance calls for a whole run, after the rules change. """
+from argparse import ArgumentParser, FileType
+from multiprocessing.pool import Pool
+
+from micall.hivdb.hivdb import hivdb_run
+
+
+def parse_args():
+    parser = ArgumentParser(
+        description='Make resistance calls for all the samples in a run.')
+    parser.add_argument('aminos_csv',
+                        type=FileType(),
+                        help='amino counts for the run, with a sample column')
+    parser.add_argument('coverage_scores_csv',
+                        type=FileType(),
+                        help='coverage scores for the run, with a sample column')
+    parser.add_argument('resistance_csv',
+                        type=FileType('w'),
+                        help='resistance calls for all samples')
+    parser.add_argument('mutations_csv',
+                        type=FileType('w'),
+                        help='relevant mutations for all samples')
+    parser.add_argument('--processes',
+                        type=int,
+                        help='number of processes to use (default: all CPUs)')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    pool = Pool(args.processes)
+    try:
+        hivdb_run(args.aminos_csv,
+                  args.coverage_scores_csv,
+                  args.resistance_csv,
+                  args.mutations_csv,
+                  pool=pool)
+    finally:
+        pool.close()
+        pool.join()
+
+
+if __name__ == '__main__':
+    main()
@@ -10,6 +10,7 @@ from micall.core.prelim_map import prelim_map
 from csv import DictReader
 from micall.core.trim_fastqs import trim, censor
 from micall.utils.dd import DD
+from micall.utils.fastq_parser import open_fastq, read_records
 from micall.g2p.pssm_lib import Pssm
 
 BOWTIE_THREADS = 11
@@ -208,14 +209,10 @@ def read_fastq(filename, reads):
     @param filename: the FASTQ file to open
     @param reads: defaultdict({qname: [line1, line2, line3, line4, line1, line2, line3, line4]}
     """
-    with open(filename, 'rU') as f:
-        for line1, line2, line3, line4 in zip(f, f, f, f):
-            qname = line1.split()[0]
-            lines = reads[qname]
-            lines.append(line1)
-            lines.append(line2)
-            lines.append(line3)
-            lines.append(line4)
+    with open_fastq(filename, use_gzip=False) as f:
+        for record in read_records(f):
+            qname = record[0].split()[0]
+            reads[qname].extend(line + '\n' for line in record)
 
 
 def main():
@@ -3,6 +3,8 @@
 import argparse
 import random
 
+from micall.utils.fastq_parser import read_records
+
 
 def parse_args():
     parser = argparse.ArgumentParser(
@@ -28,9 +30,11 @@ def parse_args():
 
 
 def get_reads(fastq_file):
-    """ Yield reads as tuples of four lines: header, sequence, '+', quality. """
-    for read in zip(fastq_file, fastq_file, fastq_file, fastq_file):
-        yield read
+    """ Yield reads as tuples of four lines: header, sequence, '+', quality.
+
+    Lines don't include line endings.
+    """
+    return read_records(fastq_file)
 
 
 def get_named_reads(fastq_file):
@@ -75,6 +79,7 @@ def process_read(name, read, out_file, odds, skipped_names, chosen_names):
     if is_chosen:
         for line in read:
             out_file.write(line)
+            out_file.write('\n')
 
 
 def main():
@@ -88,7 +93,7 @@ def main():
     skipped_names = set()
     chosen_names = set()
     for fwd_name, fwd_read in get_named_reads(args.fastq1):
-        rev_name, rev_read = rev_reads.next()
+        rev_name, rev_read = next(rev_reads)
         process_read(fwd_name,
                      fwd_read,
                      args.short_fastq1,
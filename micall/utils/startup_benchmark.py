@@ -0,0 +1,173 @@
+#! /usr/bin/env python3
+""" Measure how long each MiCall entry point takes to start up.
+
+Kive launches each step in a new process for every sample, so the time to
+import a step's module is paid over and over. This runs each module under
+python -X importtime, and fails if a module is over its time budget, or if
+it imports a slow library that it should only import when it's used.
+It needs Python 3.7 or later for -X importtime. The budgets depend on the
+machine, so they are only enforced when you run this script, not by the
+unit tests.
+"""
+from argparse import ArgumentParser
+import os
+import re
+import subprocess
+import sys
+from statistics import median
+
+# {module: (budget in ms, slow libraries it may import at start up)}
+# Budgets are about 1.5 times the median on a developer machine, so a
+# regression shows up. Use --scale on slower machines.
+ENTRY_POINTS = {
+    'micall.core.aln2counts': (30, {'gotoh'}),
+    'micall.core.coverage_plots': (150, {'gotoh', 'numpy'}),
+    'micall.core.coverage_scores': (130, {'gotoh', 'numpy'}),
+    'micall.core.filter_quality': (30, set()),
+    'micall.core.prelim_map': (45, set()),
+    'micall.core.remap': (200, {'gotoh', 'numpy'}),
+    'micall.core.sam2aln': (160, {'numpy'}),
+    'micall.core.trim_fastqs': (60, set()),
+    'micall.g2p.fastq_g2p': (150, {'gotoh', 'numpy'}),
+    'micall.hivdb.genreport': (15, set()),
+    'micall.hivdb.hivdb': (85, {'gotoh'}),
+}
+SLOW_LIBRARIES = ('Levenshtein',
+                  'gotoh',
+                  'matplotlib',
+                  'numpy',
+                  'reportlab',
+                  'xml.dom.minidom',
+                  'yaml')
+IMPORT_TIME_PATTERN = re.compile(r'import time:\s*(\d+)\s*\|\s*(\d+)\s*\|\s*(\S+)')
+
+
+def parse_args():
+    parser = ArgumentParser(
+        description='Measure start-up time for MiCall entry points.')
+    parser.add_argument('modules',
+                        nargs='*',
+                        help='modules to measure (default: all entry points)')
+    parser.add_argument('--repeat',
+                        type=int,
+                        default=5,
+                        help='number of times to import each module')
+    parser.add_argument('--scale',
+                        type=float,
+                        default=1.0,
+                        help='multiply all the time budgets, for slow machines')
+    return parser.parse_args()
+
+
+def measure_import(module_name):
+    """ Import a module in a new process, and measure it.
+
+    :param module_name: the full name of the module to import
+    :return: (milliseconds, imported), the cumulative import time of the
+        module, and the set of all modules it imported
+    """
+    root_path = os.path.dirname(os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__))))
+    env = dict(os.environ, PYTHONPATH=root_path)
+    # Importing shouldn't write anything else, and other lines are ignored.
+    report = subprocess.check_output([sys.executable,
+                                      '-X',
+                                      'importtime',
+                                      '-c',
+                                      'import ' + module_name],
+                                     env=env,
+                                     stderr=subprocess.STDOUT,
+                                     universal_newlines=True)
+    return parse_import_times(report, module_name)
+
+
+def parse_import_times(report, module_name):
+    """ Parse the report from python -X importtime.
+
+    :param report: the text that python wrote, including stderr
+    :param module_name: the module that was imported
+    :return: (milliseconds, imported), the cumulative import time of the
+        module, and the set of all modules it imported
+    """
+    milliseconds = None
+    imported = set()
+    for line in report.splitlines():
+        match = IMPORT_TIME_PATTERN.match(line)
+        if match is None:
+            continue
+        _, cumulative, name = match.groups()
+        imported.add(name)
+        if name == module_name:
+            milliseconds = int(cumulative) / 1000
+    return milliseconds, imported
+
+
+def find_slow_imports(imported):
+    """ Find which slow libraries are in a set of imported modules. """
+    return {library
+            for library in SLOW_LIBRARIES
+            if any(name == library or name.startswith(library + '.')
+                   for name in imported)}
+
+
+def check_entry_point(module_name, repeat=5, scale=1.0):
+    """ Measure an entry point, and check it against its budget.
+
+    :return: (milliseconds, errors), the median import time and a list of
+        error messages
+    """
+    times = []
+    imported = set()
+    for _ in range(repeat):
+        milliseconds, imported = measure_import(module_name)
+        times.append(milliseconds)
+    median_time = median(times)
+    return median_time, find_errors(module_name, median_time, imported, scale)
+
+
+def find_errors(module_name, milliseconds, imported, scale=1.0):
+    """ Check an entry point's measurements against its budget.
+
+    :param module_name: the entry point that was measured
+    :param milliseconds: the time it took to import
+    :param imported: the set of all modules it imported
+    :param scale: the factor to multiply the time budget by
+    :return: a list of error messages
+    """
+    budget, allowed_libraries = ENTRY_POINTS[module_name]
+    errors = []
+    if milliseconds > budget * scale:
+        errors.append('{} took {:.0f}ms, over its budget of {:.0f}ms.'.format(
+            module_name,
+            milliseconds,
+            budget * scale))
+    unexpected = find_slow_imports(imported) - allowed_libraries
+    if unexpected:
+        errors.append('{} imported {} at start up.'.format(
+            module_name,
+            ', '.join(sorted(unexpected))))
+    return errors
+
+
+def main():
+    args = parse_args()
+    module_names = args.modules or sorted(ENTRY_POINTS)
+    all_errors = []
+    for module_name in module_names:
+        median_time, errors = check_entry_point(module_name,
+                                                args.repeat,
+                                                args.scale)
+        budget, _ = ENTRY_POINTS[module_name]
+        print('{:<30} {:6.0f}ms (budget {:.0f}ms)'.format(
+            module_name,
+            median_time,
+            budget * args.scale))
+        all_errors.extend(errors)
+    for error in all_errors:
+        print(error)
+    if all_errors:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
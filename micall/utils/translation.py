@@ -33,8 +33,101 @@ complement_dict = {'A': 'T', 'C': 'G', 'G': 'C', 'T': 'A',
                    '*': '*', 'N': 'N', '-': '-'}
 
 
+class ComplementTable(dict):
+    """ Translation table that deletes any character it doesn't know.
+
+    That includes non-ASCII characters, so reverse_and_complement() can
+    detect all of them by the change in length.
+    """
+    def __missing__(self, key):
+        return None
+
+
+complement_table = ComplementTable(str.maketrans(
+    ''.join(complement_dict),
+    ''.join(complement_dict.values())))
+
+# {(resolve, return_list, ambig_char, translate_mixtures, list_ambiguous):
+#  {codon: (aa_text, aminos, is_ambiguous)}}
+codon_caches = {}
+
+
 def reverse_and_complement(seq):
-    return ''.join(complement_dict[nuc] for nuc in reversed(seq))
+    complement = seq.translate(complement_table)
+    if len(complement) != len(seq):
+        bad_nucs = [nuc for nuc in seq if nuc not in complement_dict]
+        raise KeyError(bad_nucs[0])
+    return complement[::-1]
+
+
+def translate_codon(codon,
+                    resolve=False,
+                    return_list=False,
+                    ambig_char='?',
+                    translate_mixtures=True,
+                    list_ambiguous=False):
+    """ Translate a single codon, and cache the result.
+
+    See translate() for the parameters.
+    :return: (aa_text, aminos, is_ambiguous) where aa_text is the text to
+        add to the amino acid sequence, aminos is the list of possible amino
+        acids (shared, so copy before modifying), and is_ambiguous is True if
+        the codon should count as ambiguous.
+    """
+    options = (resolve,
+               return_list,
+               ambig_char,
+               translate_mixtures,
+               list_ambiguous)
+    codon_cache = codon_caches.setdefault(options, {})
+    result = codon_cache.get(codon)
+    if result is not None:
+        return result
+    original_codon = codon
+    # note that we're willing to handle a single missing nucleotide as an ambiguity
+    if codon.count('-') > 1 or '?' in codon:
+        if codon == '---':  # don't bother to translate incomplete codons
+            result = ('-', ['-'], False)
+        else:
+            result = (ambig_char, [ambig_char], False)
+    elif not mixture_regex.search(codon):
+        aa = codon_dict[codon]
+        result = (aa, [aa], False)
+    elif not translate_mixtures and not list_ambiguous:
+        result = (ambig_char, [ambig_char], True)
+    else:
+        # expand codon into all possible resolutions of mixtures
+        codons = [codon]
+        while True:
+            next_codons = []
+            for codon in codons:
+                mixtures = mixture_regex.findall(codon)
+                if len(mixtures) == 0:
+                    next_codons.append(codon)
+                    continue
+                pos = codon.index(mixtures[0])
+                for nuc in mixture_dict[mixtures[0]]:
+                    next_codons.append(codon[0:pos] + nuc + codon[(pos+1):])
+
+            if len(codons) == len(next_codons):
+                # no change in number of codons, exit
+                break
+            codons = next_codons
+
+        aminos = list(set([codon_dict[codon] for codon in codons]))
+        if len(aminos) > 1:
+            if list_ambiguous or return_list:
+                aminos.sort()
+                aa_text = '[{}]'.format(''.join(aminos))
+            elif resolve:
+                aa_text = aminos[0]  # arbitrary resolution
+            else:
+                aa_text = ambig_char
+            result = (aa_text, aminos, True)
+        else:
+            result = (aminos[0], aminos, False)
+    codon_cache[original_codon] = result
+    return result
 
 
 def translate(seq,
@@ -65,80 +158,54 @@ def translate(seq,
     """
 
     seq = '-'*offset + seq.upper()
-    aa_list = []
-    aa_seq = ''  # use to align against reference, for resolving indels
+    codon_count = len(seq) // 3
+    options = (resolve,
+               return_list,
+               ambig_char,
+               translate_mixtures,
+               list_ambiguous)
+    codon_cache = codon_caches.get(options)
+    if codon_cache is None:
+        codon_cache = codon_caches.setdefault(options, {})
+    codons = [seq[codon_site:codon_site+3]
+              for codon_site in range(0, codon_count*3, 3)]
+    results = [codon_cache.get(codon) or translate_codon(codon, *options)
+               for codon in codons]
+
     if stats is not None:
-        stats['ambiguous'] = 0
-        stats['length'] = 0
-        stats['max_aminos'] = 1 if seq else 0
-
-    # loop over codon sites in nucleotide sequence
-    for codon_site in range(0, len(seq), 3):
-        codon = seq[codon_site:codon_site+3]
-
-        if len(codon) < 3:
-            break
-
-        if stats is not None:
-            stats['length'] += 1
-        # note that we're willing to handle a single missing nucleotide as an ambiguity
-        if codon.count('-') > 1 or '?' in codon:
-            if codon == '---':  # don't bother to translate incomplete codons
-                aa_seq += '-'
-                aa_list.append(['-'])
-            else:
-                aa_seq += ambig_char
-                aa_list.append([ambig_char])
-            continue
-
-        # look for nucleotide mixtures in codon, resolve to alternative codons if found
-        num_mixtures = len(mixture_regex.findall(codon))
-
-        if num_mixtures == 0:
-            aa = codon_dict[codon]
-            aa_seq += aa
-            aa_list.append([aa])
-        elif not translate_mixtures and not list_ambiguous:
-            if stats is not None:
-                stats['ambiguous'] += 1
-            aa_seq += ambig_char
-            aa_list.append([ambig_char])
-        else:
-            # expand codon into all possible resolutions of mixtures
-            codons = [codon]
-            while True:
-                next_codons = []
-                for codon in codons:
-                    mixtures = mixture_regex.findall(codon)
-                    if len(mixtures) == 0:
-                        next_codons.append(codon)
-                        continue
-                    pos = codon.index(mixtures[0])
-                    for nuc in mixture_dict[mixtures[0]]:
-                        next_codons.append(codon[0:pos] + nuc + codon[(pos+1):])
-
-                if len(codons) == len(next_codons):
-                    # no change in number of codons, exit
-                    break
-                codons = next_codons
-
-            aminos = list(set([codon_dict[codon] for codon in codons]))
-            aa_list.append(aminos)
-
-            if len(aminos) > 1:
-                if stats is not None:
-                    stats['ambiguous'] += 1
-                    stats['max_aminos'] = max(len(aminos), stats['max_aminos'])
-                if list_ambiguous or return_list:
-                    aminos.sort()
-                    aa_seq += '[{}]'.format(''.join(aminos))
-                elif resolve:
-                    aa_seq += aminos[0]  # arbitrary resolution
-                else:
-                    aa_seq += ambig_char
-            else:
-                aa_seq += aminos[0]
-    return aa_list if return_list else aa_seq
+        ambiguous_sizes = [len(aminos)
+                           for _, aminos, is_ambiguous in results
+                           if is_ambiguous]
+        stats['ambiguous'] = len(ambiguous_sizes)
+        stats['length'] = codon_count
+        stats['max_aminos'] = max(ambiguous_sizes + [1 if seq else 0])
+    if return_list:
+        return [list(aminos) for _, aminos, _ in results]
+    return ''.join([aa_text for aa_text, _, _ in results])
+
+
+def translate_batch(seqs, **kwargs):
+    """ Translate many nucleotide sequences with the same options.
+
+    Repeated sequences are only translated once.
+    :param seqs: an iterable of nucleotide sequences
+    :param kwargs: any of the options for translate(), except stats
+    :return: a list of translations, in the same order as seqs. With
+        return_list, each translation gets its own lists, so callers can
+        modify them.
+    """
+    return_list = kwargs.get('return_list')
+    translations = {}
+    results = []
+    for seq in seqs:
+        translation = translations.get(seq)
+        if translation is None:
+            translation = translations[seq] = translate(seq, **kwargs)
+        elif return_list:
+            translation = [list(aminos) for aminos in translation]
+        results.append(translation)
+    return results
+
 
 if __name__ == '__live_coding__':
     import unittest
@@ -19,8 +19,8 @@ from xml.etree import ElementTree
 
 from micall.core.aln2counts import aln2counts
 from micall.core.cascade_report import CascadeReport
-from micall.core.trim_fastqs import trim
-from micall.core.filter_quality import report_bad_cycles
+from micall.core.trim_fastqs import trim, save_cycle_masks, load_cycle_masks
+from micall.core.filter_quality import report_bad_cycle_array
 from micall.core.remap import remap
 from micall.core.prelim_map import prelim_map
 from micall.core.sam2aln import sam2aln
@@ -31,6 +31,7 @@ from micall.g2p.fastq_g2p import fastq_g2p, DEFAULT_MIN_COUNT, MIN_VALID, MIN_VA
 from micall.g2p.pssm_lib import Pssm
 from micall.monitor.tile_metrics_parser import summarize_tiles
 from micall.core.coverage_plots import coverage_plot
+from micall.core.coverage_scores import coverage_scores
 
 EXCLUDED_SEEDS = ['HLA-B-seed']  # Not ready yet.
 EXCLUDED_PROJECTS = ['HCV-NS5a',
@@ -390,6 +391,11 @@ def process_sample(sample_index, run_info, args, pssm):
     makedirs(sample_scratch_path)
 
     bad_cycles_path = os.path.join(scratch_path, 'bad_cycles.csv')
+    cycle_masks_path = os.path.join(scratch_path, 'bad_cycles.npy')
+    if os.path.exists(cycle_masks_path):
+        cycle_masks = load_cycle_masks(cycle_masks_path)
+    else:
+        cycle_masks = None
     trimmed_path1 = os.path.join(sample_scratch_path, 'trimmed1.fastq')
     read_summary_path = os.path.join(sample_scratch_path, 'read_summary.csv')
     trimmed_path2 = os.path.join(sample_scratch_path, 'trimmed2.fastq')
@@ -398,7 +404,8 @@ def process_sample(sample_index, run_info, args, pssm):
              bad_cycles_path,
              (trimmed_path1, trimmed_path2),
              summary_file=read_summary,
-             use_gzip=sample_path.endswith('.gz'))
+             use_gzip=sample_path.endswith('.gz'),
+             cycle_masks=cycle_masks)
 
     logger.info('Running fastq_g2p (%d of %d).', sample_index+1, len(run_info.samples))
     g2p_unmapped1_path = os.path.join(sample_scratch_path, 'g2p_unmapped1.fastq')
@@ -425,19 +432,33 @@ def process_sample(sample_index, run_info, args, pssm):
 
     logger.info('Running prelim_map (%d of %d).', sample_index+1, len(run_info.samples))
     excluded_seeds = [] if args.all_projects else EXCLUDED_SEEDS
-    with open(os.path.join(sample_scratch_path, 'prelim.csv'), 'w') as prelim_csv:
-        prelim_map(g2p_unmapped1_path,
-                   g2p_unmapped2_path,
-                   prelim_csv,
-                   work_path=sample_scratch_path,
-                   excluded_seeds=excluded_seeds)
+    prelim_sam_path = os.path.join(sample_scratch_path, 'prelim.sam')
+    prelim_counts_path = os.path.join(sample_scratch_path, 'prelim_counts.csv')
+    with open(prelim_sam_path, 'w') as prelim_sam, \
+            open(prelim_counts_path, 'w') as prelim_counts_csv:
+        if args.debug_remap:
+            prelim_csv = open(os.path.join(sample_scratch_path, 'prelim.csv'),
+                              'w')
+        else:
+            prelim_csv = None
+        try:
+            prelim_map(g2p_unmapped1_path,
+                       g2p_unmapped2_path,
+                       prelim_csv,
+                       work_path=sample_scratch_path,
+                       excluded_seeds=excluded_seeds,
+                       prelim_sam=prelim_sam,
+                       prelim_counts_csv=prelim_counts_csv)
+        finally:
+            if prelim_csv is not None:
+                prelim_csv.close()
 
     logger.info('Running remap (%d of %d).', sample_index+1, len(run_info.samples))
     if args.debug_remap:
         debug_file_prefix = os.path.join(sample_scratch_path, 'debug')
     else:
         debug_file_prefix = None
-    with open(os.path.join(sample_scratch_path, 'prelim.csv'), 'r') as prelim_csv, \
+    with open(prelim_counts_path, 'r') as prelim_counts_csv, \
             open(os.path.join(sample_scratch_path, 'remap.csv'), 'w') as remap_csv, \
             open(os.path.join(sample_scratch_path, 'remap_counts.csv'), 'w') as counts_csv, \
             open(os.path.join(sample_scratch_path, 'remap_conseq.csv'), 'w') as conseq_csv, \
@@ -446,14 +467,16 @@ def process_sample(sample_index, run_info, args, pssm):
 
         remap(g2p_unmapped1_path,
               g2p_unmapped2_path,
-              prelim_csv,
+              None,
               remap_csv,
               counts_csv,
               conseq_csv,
               unmapped1,
               unmapped2,
               sample_scratch_path,
-              debug_file_prefix=debug_file_prefix)
+              debug_file_prefix=debug_file_prefix,
+              prelim_sam=prelim_sam_path,
+              prelim_counts_csv=prelim_counts_csv)
 
     logger.info('Running sam2aln (%d of %d).', sample_index+1, len(run_info.samples))
     with open(os.path.join(sample_scratch_path, 'remap.csv'), 'r') as remap_csv, \
@@ -493,14 +516,20 @@ def process_sample(sample_index, run_info, args, pssm):
                    g2p_aligned_csv=g2p_aligned_csv,
                    remap_conseq_csv=remap_conseq_csv)
 
-    logger.info('Running coverage_plots (%d of %d).', sample_index+1, len(run_info.samples))
-    coverage_maps_path = os.path.join(args.qc_path, 'coverage_maps')
-    makedirs(coverage_maps_path)
+    logger.info('Running coverage_scores (%d of %d).', sample_index+1, len(run_info.samples))
     excluded_projects = [] if args.all_projects else EXCLUDED_PROJECTS
     with open(os.path.join(sample_scratch_path, 'amino.csv'), 'r') as amino_csv, \
             open(os.path.join(sample_scratch_path, 'coverage_scores.csv'), 'w') as coverage_scores_csv:
+        coverage_scores(amino_csv,
+                        coverage_scores_csv,
+                        excluded_projects=excluded_projects)
+
+    logger.info('Running coverage_plots (%d of %d).', sample_index+1, len(run_info.samples))
+    coverage_maps_path = os.path.join(args.qc_path, 'coverage_maps')
+    makedirs(coverage_maps_path)
+    with open(os.path.join(sample_scratch_path, 'amino.csv'), 'r') as amino_csv:
         coverage_plot(amino_csv,
-                      coverage_scores_csv,
+                      coverage_scores_csv=None,
                       coverage_maps_path=coverage_maps_path,
                       coverage_maps_prefix=sample_name,
                       excluded_projects=excluded_projects)
@@ -573,17 +602,24 @@ def summarize_run(args, run_json):
         phix_path = os.path.join(interop_path, 'ErrorMetricsOut.bin')
         quality_path = os.path.join(args.data_path, 'scratch', 'quality.csv')
         bad_cycles_path = os.path.join(args.data_path, 'scratch', 'bad_cycles.csv')
+        cycle_masks_path = os.path.join(args.data_path,
+                                        'scratch',
+                                        'bad_cycles.npy')
         bad_tiles_path = os.path.join(args.qc_path, 'bad_tiles.csv')
         with open(phix_path, 'rb') as phix, open(quality_path, 'w') as quality:
-            records = error_metrics_parser.read_errors(phix)
-            error_metrics_parser.write_phix_csv(quality,
-                                                records,
-                                                read_lengths,
-                                                summary)
-        with open(quality_path, 'r') as quality, \
-                open(bad_cycles_path, 'w') as bad_cycles, \
+            errors = error_metrics_parser.read_error_array(phix)
+            error_metrics_parser.write_phix_array(quality,
+                                                  errors,
+                                                  read_lengths,
+                                                  summary)
+        with open(bad_cycles_path, 'w') as bad_cycles, \
                 open(bad_tiles_path, 'w') as bad_tiles:
-            report_bad_cycles(quality, bad_cycles, bad_tiles)
+            cycle_masks = report_bad_cycle_array(errors,
+                                                 bad_cycles,
+                                                 bad_tiles,
+                                                 read_lengths)
+        # Every sample gets censored with these, so only build them once.
+        save_cycle_masks(cycle_masks, cycle_masks_path)
 
         quality_metrics_path = os.path.join(interop_path, 'QMetricsOut.bin')
         quality_metrics_parser.summarize_quality(quality_metrics_path,